@@ -0,0 +1,241 @@
+"""
+LoRA adapter serving on one shared base model
+Adapters live in <adapter_dir>/<name>/ (as written by peft's save_pretrained) and are
+loaded into the base model on first use, up to an LRU-bounded number at a time.
+Requests for different adapters share a batch: each row names its own adapter.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+import torch
+
+logger = logging.getLogger("deepseek_adapters")
+
+# Row name peft uses for "no adapter" in a mixed batch
+BASE = "__base__"
+
+
+def list_adapters(adapter_dir: str) -> List[str]:
+    """Adapter names found in `adapter_dir` (subdirectories with an adapter_config.json)"""
+    if not adapter_dir or not os.path.isdir(adapter_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(adapter_dir)
+        if os.path.isfile(os.path.join(adapter_dir, name, "adapter_config.json"))
+    )
+
+
+class AdapterCache:
+    """
+    LoRA adapters attached to a base model, loaded lazily and evicted least-recently-used.
+
+    peft injects each adapter's low-rank matrices into the shared model, so an
+    adapter costs megabytes. No adapter is ever active on the model itself:
+    direct calls give base outputs, forward() applies per-row adapters and
+    active() one adapter to everything. Loading must not overlap a forward
+    pass, so the BatchScheduler calls ensure() from its own thread.
+
+    For mixed batches, each LoRA layer keeps the loaded adapters' A and B
+    matrices concatenated (scaling folded in, padded to the largest rank), so
+    the per-row deltas take a fixed handful of matmuls however many adapters
+    the batch holds: decode steps multiply by all adapters at once and mask
+    each row to its own, prefills gather each row's matrices. Adapters this
+    does not cover (DoRA and other variants, LoRA on embeddings, LoRA bias) go
+    through peft's slower mixed-batch path.
+
+    Args:
+        model: Base causal LM (modified in place: LoRA layers are injected into it)
+        adapter_dir: Directory holding one subdirectory per adapter
+        max_loaded: Adapters kept in memory at once
+    """
+
+    def __init__(self, model, adapter_dir: str = "adapters", max_loaded: int = 8):
+        self.model = model
+        self.adapter_dir = adapter_dir
+        self.max_loaded = max(1, max_loaded)
+        self.peft_model = None
+        self._loaded: "OrderedDict[str, int]" = OrderedDict()  # name -> bytes
+        self._slots: Dict[str, int] = {}  # name -> index into the stacked weights (0 is the base model)
+        self._stacks: Dict[torch.nn.Module, tuple] = {}  # LoRA layer -> (A^T, scaled B^T), slots side by side
+        self._rank = 0
+        self._stacked: set = set()  # Adapters the stacked path covers
+        self._hooked: set = set()
+        self._rows = threading.local()  # (slots, mask) of the batch this thread is running through forward()
+        self._lock = threading.Lock()
+        self._stats = {"loads": 0, "evictions": 0, "load_seconds": 0.0}
+        if any(isinstance(m, torch.ao.nn.quantized.dynamic.Linear) for m in model.modules()):
+            raise ValueError("LoRA adapters need an unquantized base model (unset R2D2_CPU_INT8)")
+
+    def available(self) -> List[str]:
+        return list_adapters(self.adapter_dir)
+
+    def ensure(self, name: str, in_use: Iterable[str] = ()):
+        """
+        Load `name` if needed and mark it most recently used.
+
+        Least-recently-used adapters beyond max_loaded are unloaded, except
+        those in `in_use` (adapters of running requests).
+
+        Raises:
+            ValueError: No such adapter in adapter_dir
+        """
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                return
+            if name not in self.available():
+                raise ValueError(f"Unknown adapter '{name}'")
+            self._evict(keep=set(in_use), room_for=1)
+            self._load(name)
+            self._restack()
+
+    def forward(self, adapters: List[Optional[str]], **inputs):
+        """Model call for a batch whose rows use `adapters` (None is the base model); all must be loaded"""
+        if self.peft_model is None or not any(adapters):
+            return self.model(**inputs)
+        if all(name is None or name in self._stacked for name in adapters):
+            slots = torch.tensor([self._slots[name] if name else 0 for name in adapters], device=self.model.device)
+            mask = torch.nn.functional.one_hot(slots, len(self._slots) + 1).repeat_interleave(self._rank, 1)
+            self._rows.batch = (slots, mask.unsqueeze(1))
+            try:
+                return self.model(**inputs)
+            finally:
+                self._rows.batch = None
+        return self.peft_model(**inputs, adapter_names=[name or BASE for name in adapters])
+
+    @contextmanager
+    def active(self, name: str):
+        """
+        Apply `name` to every call on the base model inside the block.
+
+        For the unbatched path (model.generate), which must then be the only
+        user of the model; batched requests use forward() instead.
+        """
+        self.ensure(name)
+        self.peft_model.base_model.set_adapter(name)
+        try:
+            yield
+        finally:
+            self.peft_model.base_model.set_adapter([])
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["loaded"] = list(self._loaded)
+            stats["bytes"] = sum(self._loaded.values()) + sum(
+                t.numel() * t.element_size() for stack in self._stacks.values() for t in stack
+            )
+            return stats
+
+    def _load(self, name: str):
+        from peft import PeftModel
+
+        started = time.perf_counter()
+        path = os.path.join(self.adapter_dir, name)
+        if self.peft_model is None:
+            self.peft_model = PeftModel.from_pretrained(self.model, path, adapter_name=name)
+        else:
+            self.peft_model.load_adapter(path, adapter_name=name)
+        self.peft_model.eval()
+        # No active adapter: rows pick theirs per forward(), everything else sees the base model
+        self.peft_model.base_model.set_adapter([])
+        nbytes = sum(
+            p.numel() * p.element_size() for n, p in self.peft_model.named_parameters() if f".{name}." in n
+        )
+        self._loaded[name] = nbytes
+        elapsed = time.perf_counter() - started
+        self._stats["loads"] += 1
+        self._stats["load_seconds"] += elapsed
+        logger.info(f"Loaded adapter '{name}' ({nbytes / 1024 / 1024:.1f} MB) in {elapsed:.2f}s")
+
+    def _evict(self, keep: set, room_for: int):
+        for name in list(self._loaded):
+            if len(self._loaded) + room_for <= self.max_loaded:
+                return
+            if name in keep:
+                continue
+            self.peft_model.delete_adapter(name)
+            self.peft_model.base_model.set_adapter([])
+            del self._loaded[name]
+            self._stats["evictions"] += 1
+            logger.info(f"Unloaded adapter '{name}'")
+        if len(self._loaded) + room_for > self.max_loaded:
+            logger.warning(f"All {len(self._loaded)} loaded adapters are in use; going over max_loaded")
+
+    def _restack(self):
+        """Rebuild every LoRA layer's stacked weights for the adapters loaded now"""
+        from peft.tuners.lora import LoraLayer
+        from peft.tuners.lora.layer import Linear as LoraLinear
+
+        names = list(self._loaded)
+        self._slots = {name: slot for slot, name in enumerate(names, 1)}
+        layers = [m for m in self.peft_model.modules() if isinstance(m, LoraLayer)]
+        unsupported = set()
+        for module in layers:
+            present = [n for n in names if n in module.lora_A or n in module.lora_embedding_A]
+            if not isinstance(module, LoraLinear):
+                unsupported.update(present)
+            else:
+                unsupported.update(n for n in present if n in module.lora_variant or module.lora_bias.get(n))
+
+        stacked = {
+            module: [n for n in names if n in module.lora_A and n not in unsupported]
+            for module in layers if isinstance(module, LoraLinear)
+        }
+        stacked = {module: present for module, present in stacked.items() if present}
+        self._rank = max((m.lora_A[n].weight.shape[0] for m, present in stacked.items() for n in present), default=0)
+        self._stacks = {}
+        for module, present in stacked.items():
+            weight = module.lora_A[present[0]].weight
+            # Slot s owns columns s*rank.. of A^T and rows s*rank.. of B^T; slot 0 (base model) stays zero
+            a = weight.new_zeros(module.in_features, len(names) + 1, self._rank)
+            b = weight.new_zeros(len(names) + 1, self._rank, module.out_features)
+            for name in present:
+                slot, r = self._slots[name], module.lora_A[name].weight.shape[0]
+                a[:, slot, :r] = module.lora_A[name].weight.t()
+                b[slot, :r] = module.lora_B[name].weight.t() * module.scaling[name]
+            self._stacks[module] = (a.flatten(1), b.flatten(0, 1))
+            if module not in self._hooked:
+                module.register_forward_hook(self._add_lora)
+                self._hooked.add(module)
+        self._stacked = set(names) - unsupported
+        if unsupported:
+            logger.info(f"Adapters {sorted(unsupported)} use peft's mixed-batch path")
+
+    def _add_lora(self, module, args, output):
+        """Forward hook on each LoRA layer: add every row's own adapter delta"""
+        batch = getattr(self._rows, "batch", None)
+        stacked = self._stacks.get(module)
+        if batch is None or stacked is None:
+            return None
+        slots, mask = batch
+        a, b = stacked
+        x = args[0].to(a.dtype)
+        if x.shape[1] == 1:
+            # Decode step: all adapters' A at once is cheaper than copying per-row matrices
+            delta = ((x @ a) * mask) @ b
+        else:
+            a_rows = a.view(a.shape[0], -1, self._rank).transpose(0, 1)[slots]
+            delta = torch.bmm(torch.bmm(x, a_rows), b.view(-1, self._rank, b.shape[1])[slots])
+        return output + delta.to(output.dtype)
+
+
+def adapters_from_env(model, environ: Dict[str, str]) -> Optional[AdapterCache]:
+    """AdapterCache over R2D2_ADAPTER_DIR (default "adapters") when it holds any adapter, else None"""
+    adapter_dir = environ.get("R2D2_ADAPTER_DIR", "adapters")
+    names = list_adapters(adapter_dir)
+    if not names:
+        return None
+    try:
+        cache = AdapterCache(model, adapter_dir, max_loaded=int(environ.get("R2D2_MAX_ADAPTERS", "8")))
+    except ValueError as e:
+        logger.warning(f"Adapters disabled: {e}")
+        return None
+    logger.info(f"Serving {len(names)} adapters from {adapter_dir}: {', '.join(names)}")
+    return cache
@@ -0,0 +1,218 @@
+"""
+Admission control for generation requests
+Bounded wait queue in front of the model with per-client fair share; requests
+that cannot start soon are turned away with a retry hint instead of piling up.
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from metrics import QUEUE_WAIT, REJECTED
+
+logger = logging.getLogger("deepseek_admission")
+
+
+class ServerBusy(Exception):
+    """The request was not admitted; retry after `retry_after` seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """An admitted request; use as a context manager around the generation"""
+
+    def __init__(self, controller: "AdmissionController", client_id: str, cost: int):
+        self.controller = controller
+        self.client_id = client_id
+        self.cost = cost
+        self.queued_at = time.perf_counter()
+        self.admitted_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.bumped = False
+
+    @property
+    def queue_wait(self) -> float:
+        return (self.admitted_at or time.perf_counter()) - self.queued_at
+
+    @property
+    def generation_time(self) -> float:
+        if self.admitted_at is None:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.admitted_at
+
+    def __enter__(self) -> "Ticket":
+        return self
+
+    def __exit__(self, *exc):
+        self.controller.release(self)
+
+
+class AdmissionController:
+    """
+    Bounded, fair admission in front of generate_code / safe_generate.
+
+    Up to `max_active` requests generate at once and up to `max_queued` wait.
+    A client may hold at most its fair share of those slots while others are
+    waiting, and freed slots go to the waiting client with the fewest active
+    requests. The cost of a request (prompt tokens + max_tokens) and the
+    measured seconds per token give the retry hint and the expected wait.
+
+    Args:
+        max_active: Requests generating at the same time
+        max_queued: Requests allowed to wait for a slot
+        max_wait: Longest expected (and actual) queue wait before turning a request away
+    """
+
+    def __init__(self, max_active: int = 8, max_queued: int = 32, max_wait: float = 30.0):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._active: Dict[str, int] = {}
+        self._queue: List[Ticket] = []
+        self._seconds_per_token: Optional[float] = None
+        self._stats = {
+            "admitted": 0,
+            "rejected_queue_full": 0,
+            "rejected_fair_share": 0,
+            "rejected_wait": 0,
+            "queue_wait_seconds": 0.0,
+            "queue_wait_max": 0.0,
+            "generation_seconds": 0.0,
+            "completed": 0,
+        }
+
+    def admit(self, client_id: Optional[str], cost: int) -> Ticket:
+        """
+        Wait for a generation slot.
+
+        Args:
+            client_id: Session or caller identity used for fair share
+            cost: Estimated work, prompt tokens + max new tokens
+
+        Returns:
+            Admitted Ticket; release it (or leave its `with` block) when done
+
+        Raises:
+            ServerBusy: Queue full, client over its share, or the wait would be too long
+        """
+        ticket = Ticket(self, client_id or "anonymous", cost)
+        with self._cond:
+            if not self._queue and self._active_total() < self.max_active:
+                self._start(ticket)
+                return ticket
+            self._check_capacity(ticket)
+            self._queue.append(ticket)
+            deadline = ticket.queued_at + self.max_wait
+            while ticket.admitted_at is None:
+                if ticket.bumped:
+                    REJECTED.inc()
+                    raise ServerBusy("Server busy, slot given to a client with fewer requests", self._retry_after(0))
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._queue.remove(ticket)
+                    raise self._reject("rejected_wait", "Server busy, queue wait timed out", 0)
+                self._cond.wait(remaining)
+        return ticket
+
+    def release(self, ticket: Ticket):
+        with self._cond:
+            if ticket.admitted_at is None or ticket.finished_at is not None:
+                return
+            ticket.finished_at = time.perf_counter()
+            self._active[ticket.client_id] -= 1
+            if not self._active[ticket.client_id]:
+                del self._active[ticket.client_id]
+            elapsed = ticket.generation_time
+            self._stats["completed"] += 1
+            self._stats["generation_seconds"] += elapsed
+            if ticket.cost > 0:
+                sample = elapsed / ticket.cost
+                previous = self._seconds_per_token
+                self._seconds_per_token = sample if previous is None else 0.8 * previous + 0.2 * sample
+            self._grant_waiting()
+
+    def stats(self) -> dict:
+        with self._cond:
+            admitted = self._stats["admitted"]
+            completed = self._stats["completed"]
+            return dict(
+                self._stats,
+                active=self._active_total(),
+                queued=len(self._queue),
+                queue_wait_mean=self._stats["queue_wait_seconds"] / admitted if admitted else 0.0,
+                generation_mean=self._stats["generation_seconds"] / completed if completed else 0.0,
+                seconds_per_token=self._seconds_per_token or 0.0,
+            )
+
+    # Callers hold the lock
+    def _active_total(self) -> int:
+        return sum(self._active.values())
+
+    def _check_capacity(self, ticket: Ticket):
+        clients = set(self._active) | {t.client_id for t in self._queue} | {ticket.client_id}
+        share = max(1, (self.max_active + self.max_queued) // len(clients))
+        held = self._held(ticket.client_id)
+        if held >= share:
+            raise self._reject("rejected_fair_share", "Too many requests from this client, wait for one to finish", 0)
+        if self._expected_wait(ticket.cost) > self.max_wait:
+            raise self._reject("rejected_wait", "Server busy", ticket.cost)
+        if len(self._queue) >= self.max_queued:
+            # A full queue still makes room for a client below its share, at the expense of the heaviest one
+            heaviest = max(self._queue, key=lambda t: (self._held(t.client_id), t.queued_at))
+            if self._held(heaviest.client_id) <= held + 1:
+                raise self._reject("rejected_queue_full", "Server busy, queue is full", 0)
+            self._queue.remove(heaviest)
+            heaviest.bumped = True
+            self._stats["rejected_fair_share"] += 1
+            self._cond.notify_all()
+
+    def _reject(self, reason: str, message: str, cost: int) -> ServerBusy:
+        self._stats[reason] += 1
+        REJECTED.inc()
+        return ServerBusy(message, self._retry_after(cost))
+
+    def _held(self, client_id: str) -> int:
+        return self._active.get(client_id, 0) + sum(t.client_id == client_id for t in self._queue)
+
+    def _expected_wait(self, cost: int) -> float:
+        if self._seconds_per_token is None:
+            return 0.0
+        queued_cost = sum(t.cost for t in self._queue) + cost
+        return queued_cost * self._seconds_per_token / self.max_active
+
+    def _retry_after(self, cost: int) -> float:
+        return min(60.0, max(1.0, self._expected_wait(cost)))
+
+    def _start(self, ticket: Ticket):
+        ticket.admitted_at = time.perf_counter()
+        self._active[ticket.client_id] = self._active.get(ticket.client_id, 0) + 1
+        wait = ticket.queue_wait
+        self._stats["admitted"] += 1
+        self._stats["queue_wait_seconds"] += wait
+        self._stats["queue_wait_max"] = max(self._stats["queue_wait_max"], wait)
+        QUEUE_WAIT.observe(wait)
+
+    def _grant_waiting(self):
+        granted = False
+        while self._queue and self._active_total() < self.max_active:
+            # Fewest active requests first; FIFO between equals
+            ticket = min(self._queue, key=lambda t: self._active.get(t.client_id, 0))
+            self._queue.remove(ticket)
+            self._start(ticket)
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+
+def controller_from_env(environ: Dict[str, str], default_active: int) -> AdmissionController:
+    """Build the controller from R2D2_MAX_ACTIVE / R2D2_MAX_QUEUE / R2D2_MAX_QUEUE_WAIT"""
+    return AdmissionController(
+        max_active=int(environ.get("R2D2_MAX_ACTIVE", str(default_active))),
+        max_queued=int(environ.get("R2D2_MAX_QUEUE", "32")),
+        max_wait=float(environ.get("R2D2_MAX_QUEUE_WAIT", "30")),
+    )
@@ -0,0 +1,414 @@
+"""
+OpenAI-compatible HTTP API for the chat model
+Serves /v1/completions and /v1/chat/completions (JSON or server-sent events) from
+a plain asyncio server that runs next to the Gradio UI and shares its model.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("deepseek_api")
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+@dataclass
+class CompletionRequest:
+    """One API request, already mapped onto the chat app's message/history shape"""
+    message: str
+    history: List[Tuple[str, str]] = field(default_factory=list)
+    temperature: float = 0.2
+    max_tokens: int = 256
+    seed: Optional[int] = None
+    session_id: Optional[str] = None
+    client_id: Optional[str] = None
+    stream: bool = False
+    adapter: Optional[str] = None
+    # Set by the backend: "length" when the reply ran into max_tokens
+    finish_reason: str = "stop"
+
+
+class Unavailable(Exception):
+    """Raised by a backend that cannot take the request right now; sent as 503 with Retry-After"""
+
+    def __init__(self, message: str, retry_after: float = 5.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_chat_messages(messages) -> Tuple[str, List[Tuple[str, str]]]:
+    """
+    Turn OpenAI chat messages into (message, history) for the chat prompt format.
+
+    System messages are prepended to the first user message; the last message
+    must come from the user.
+    """
+    if not isinstance(messages, list) or not messages:
+        raise HttpError(400, "'messages' must be a non-empty list")
+    system: List[str] = []
+    turns: List[Tuple[str, str]] = []
+    pending: Optional[str] = None
+    for item in messages:
+        if not isinstance(item, dict) or not isinstance(item.get("content"), str):
+            raise HttpError(400, "Each message needs a role and string content")
+        role, content = item.get("role"), item["content"]
+        if role == "system":
+            system.append(content)
+        elif role == "user":
+            if pending is not None:
+                turns.append((pending, ""))
+            pending = content
+        elif role == "assistant":
+            turns.append((pending or "", content))
+            pending = None
+        else:
+            raise HttpError(400, f"Unsupported role {role!r}")
+    if pending is None:
+        raise HttpError(400, "The last message must have role 'user'")
+    if system:
+        prefix = "\n".join(system)
+        if turns:
+            turns[0] = (f"{prefix}\n{turns[0][0]}", turns[0][1])
+        else:
+            pending = f"{prefix}\n{pending}"
+    return pending, turns
+
+
+def _sampling_fields(body: dict) -> dict:
+    try:
+        fields = dict(
+            temperature=float(body.get("temperature", 0.2)),
+            max_tokens=int(body.get("max_tokens") or 256),
+            seed=None if body.get("seed") is None else int(body["seed"]),
+        )
+    except (TypeError, ValueError) as e:
+        raise HttpError(400, f"Invalid sampling parameter: {e}")
+    if fields["max_tokens"] < 1:
+        raise HttpError(400, "'max_tokens' must be positive")
+    user = body.get("user")
+    user = str(user) if user else None
+    return dict(fields, session_id=user, client_id=user, stream=bool(body.get("stream", False)))
+
+
+class ApiServer:
+    """
+    asyncio HTTP/1.1 server for the OpenAI-style endpoints.
+
+    Generation runs on worker threads; at most `max_concurrency` requests are
+    in progress and the rest are turned away at once. Streamed text is coalesced,
+    so a slow client receives larger chunks instead of holding up the model.
+
+    Args:
+        backend: Called with a CompletionRequest on a worker thread; yields the reply so far
+        model_name: Reported in responses and /v1/models
+        host: Interface to bind
+        port: Port to bind
+        max_concurrency: Requests in progress at the same time; more are answered 503 straight away
+        max_body_bytes: Largest accepted request body
+        adapter_names: Returns the LoRA adapters that may be requested as "model"; listed by /v1/models
+    """
+
+    def __init__(
+        self,
+        backend: Callable[[CompletionRequest], Iterator[str]],
+        model_name: str,
+        host: str = "0.0.0.0",
+        port: int = 8000,
+        max_concurrency: int = 8,
+        max_body_bytes: int = 1024 * 1024,
+        adapter_names: Optional[Callable[[], List[str]]] = None,
+    ):
+        self.backend = backend
+        self.model_name = model_name
+        self.host = host
+        self.port = port
+        self.max_concurrency = max_concurrency
+        self.max_body_bytes = max_body_bytes
+        self.adapter_names = adapter_names or (lambda: [])
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="api-generate")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._started = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "ApiServer":
+        """Serve on a background thread with its own event loop"""
+        self._thread = threading.Thread(target=self._run_loop, name="api-server", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._bind())
+        finally:
+            self._started.set()
+        if self._server is not None:
+            logger.info(f"OpenAI-compatible API listening on http://{self.host}:{self.port}/v1")
+            self._loop.run_until_complete(self._server.serve_forever())
+
+    async def _bind(self):
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        try:
+            self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        except OSError as e:
+            logger.error(f"Could not start the API server on port {self.port}: {e}")
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                request_line, *header_lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+                try:
+                    method, path, version = request_line.split(" ", 2)
+                except ValueError:
+                    await self._send_error(writer, HttpError(400, "Malformed request line"), keep_alive=False)
+                    break
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                if "chunked" in headers.get("transfer-encoding", "").lower():
+                    await self._send_error(writer, HttpError(411, "Chunked request bodies are not supported"), False)
+                    break
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._send_error(writer, HttpError(400, "Malformed Content-Length header"), keep_alive=False)
+                    break
+                if length > self.max_body_bytes:
+                    await self._send_error(writer, HttpError(413, "Request body too large"), keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                keep_alive = await self._dispatch(method, path.split("?", 1)[0], body, writer, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error(f"API connection error: {e}", exc_info=True)
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter, keep_alive: bool) -> bool:
+        """Route one request; returns whether the connection may be reused"""
+        try:
+            if path == "/v1/models":
+                if method != "GET":
+                    raise HttpError(405, "Use GET")
+                names = [self.model_name] + self.adapter_names()
+                models = {"object": "list", "data": [{"id": name, "object": "model", "owned_by": "local"} for name in names]}
+                await self._send_json(writer, 200, models, keep_alive)
+                return keep_alive
+            if path not in ("/v1/completions", "/v1/chat/completions"):
+                raise HttpError(404, f"No route for {path}")
+            if method != "POST":
+                raise HttpError(405, "Use POST")
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                raise HttpError(400, "Request body is not valid JSON")
+            if not isinstance(payload, dict):
+                raise HttpError(400, "Request body must be a JSON object")
+            chat = path == "/v1/chat/completions"
+            request = self._parse(payload, chat)
+            if request.client_id is None:
+                peer = writer.get_extra_info("peername")
+                request.client_id = peer[0] if peer else None
+            if request.stream:
+                await self._respond_stream(request, chat, writer)
+                return False
+            await self._respond_json(request, chat, writer, keep_alive)
+            return keep_alive
+        except HttpError as e:
+            await self._send_error(writer, e, keep_alive)
+            return keep_alive
+        except Unavailable as e:
+            await self._send_error(writer, HttpError(503, str(e)), keep_alive, retry_after=e.retry_after)
+            return keep_alive
+
+    def _parse(self, payload: dict, chat: bool) -> CompletionRequest:
+        if chat:
+            message, history = parse_chat_messages(payload.get("messages"))
+        else:
+            prompt = payload.get("prompt")
+            if isinstance(prompt, list) and len(prompt) == 1:
+                prompt = prompt[0]
+            if not isinstance(prompt, str) or not prompt:
+                raise HttpError(400, "'prompt' must be a non-empty string")
+            message, history = prompt, []
+        # "model" picks a LoRA adapter; the base model's own name (or none) means no adapter
+        model = payload.get("model")
+        adapter = None
+        if model and model != self.model_name:
+            if model not in self.adapter_names():
+                raise HttpError(404, f"The model '{model}' does not exist")
+            adapter = model
+        return CompletionRequest(message=message, history=history, adapter=adapter, **_sampling_fields(payload))
+
+    async def _generate(self, request: CompletionRequest) -> AsyncIterator[str]:
+        """Run the backend on a worker thread and yield new text as it becomes available"""
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        cancelled = threading.Event()
+        state: Dict[str, object] = {"text": "", "done": False, "error": None}
+
+        def work():
+            replies = self.backend(request)
+            try:
+                for text in replies:
+                    if cancelled.is_set():
+                        break
+                    state["text"] = text
+                    loop.call_soon_threadsafe(changed.set)
+            except Exception as e:
+                state["error"] = e
+            finally:
+                replies.close()
+                state["done"] = True
+                loop.call_soon_threadsafe(changed.set)
+
+        if self._slots.locked():
+            raise Unavailable("Server busy, too many open requests", retry_after=1.0)
+        async with self._slots:
+            future = loop.run_in_executor(self._executor, work)
+            sent = ""
+            try:
+                while True:
+                    await changed.wait()
+                    changed.clear()
+                    done = state["done"]
+                    text = state["text"]
+                    if len(text) > len(sent) and text.startswith(sent):
+                        yield text[len(sent):]
+                        sent = text
+                    if done:
+                        break
+                if state["error"] is not None:
+                    raise state["error"]
+            finally:
+                # The client went away or the response finished; free the model either way
+                cancelled.set()
+                await asyncio.shield(future)
+
+    def _envelope(self, request: CompletionRequest, chat: bool, request_id: str, created: int, chunk: bool, text: str, finish: Optional[str]) -> dict:
+        if chat:
+            if chunk:
+                choice = {"index": 0, "delta": {"content": text} if text else {}, "finish_reason": finish}
+            else:
+                choice = {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish}
+            kind = "chat.completion.chunk" if chunk else "chat.completion"
+        else:
+            choice = {"index": 0, "text": text, "logprobs": None, "finish_reason": finish}
+            kind = "text_completion"
+        return {"id": request_id, "object": kind, "created": created, "model": request.adapter or self.model_name, "choices": [choice]}
+
+    async def _respond_json(self, request: CompletionRequest, chat: bool, writer: asyncio.StreamWriter, keep_alive: bool):
+        created = int(time.time())
+        try:
+            text = "".join([delta async for delta in self._generate(request)])
+        except (HttpError, Unavailable):
+            raise
+        except Exception as e:
+            logger.error(f"API generation failed: {e}", exc_info=True)
+            raise HttpError(500, f"Generation failed: {str(e)[:200]}")
+        request_id = f"{'chatcmpl' if chat else 'cmpl'}-{uuid.uuid4().hex[:24]}"
+        await self._send_json(
+            writer, 200, self._envelope(request, chat, request_id, created, False, text, request.finish_reason), keep_alive
+        )
+
+    async def _respond_stream(self, request: CompletionRequest, chat: bool, writer: asyncio.StreamWriter):
+        created = int(time.time())
+        request_id = f"{'chatcmpl' if chat else 'cmpl'}-{uuid.uuid4().hex[:24]}"
+        deltas = self._generate(request)
+        started = False
+        try:
+            async for delta in deltas:
+                if not started:
+                    # Headers wait for the first text, so "not ready" can still be a plain 503
+                    await self._send_stream_head(writer)
+                    if chat:
+                        first = self._envelope(request, chat, request_id, created, True, "", None)
+                        first["choices"][0]["delta"] = {"role": "assistant"}
+                        await self._send_event(writer, first)
+                    started = True
+                await self._send_event(writer, self._envelope(request, chat, request_id, created, True, delta, None))
+        except (HttpError, Unavailable, ConnectionError):
+            raise
+        except Exception as e:
+            logger.error(f"API generation failed: {e}", exc_info=True)
+            if not started:
+                raise HttpError(500, f"Generation failed: {str(e)[:200]}")
+            await self._send_event(writer, {"error": {"message": str(e)[:200], "type": "server_error"}})
+            return
+        finally:
+            await deltas.aclose()
+        if not started:
+            await self._send_stream_head(writer)
+        await self._send_event(writer, self._envelope(request, chat, request_id, created, True, "", request.finish_reason))
+        writer.write(b"data: [DONE]\n\n")
+        await writer.drain()
+
+    async def _send_stream_head(self, writer: asyncio.StreamWriter):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n"
+        )
+        await writer.drain()
+
+    async def _send_event(self, writer: asyncio.StreamWriter, payload: dict):
+        writer.write(b"data: " + json.dumps(payload).encode() + b"\n\n")
+        await writer.drain()  # Backpressure: a slow reader pauses this coroutine, not the model
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: dict, keep_alive: bool, extra_headers=()):
+        body = json.dumps(payload).encode()
+        head = [
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+            *extra_headers,
+        ]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+
+    async def _send_error(self, writer: asyncio.StreamWriter, error: HttpError, keep_alive: bool, retry_after: Optional[float] = None):
+        kind = "invalid_request_error" if error.status < 500 else "server_error"
+        headers = [f"Retry-After: {max(1, round(retry_after))}"] if retry_after is not None else []
+        payload = {"error": {"message": str(error), "type": kind, "code": error.status}}
+        await self._send_json(writer, error.status, payload, keep_alive, headers)
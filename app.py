@@ -1,8 +1,24 @@
 import gradio as gr
 import logging
+import os
 import torch
 import socket
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from contextlib import nullcontext
+from transformers import AutoTokenizer
+from adapters import adapters_from_env, list_adapters
+from admission import ServerBusy, controller_from_env
+from coalescing import Coalescer
+from device import load_causal_lm, select_device
+from metrics import DETOKENIZE, POSTPROCESS, PROMPT_TOKENS, TOKENIZE, start_http_server, track_request
+from model_loader import ModelHolder
+from paged_kv import PagedKVCache
+from response_cache import cache_from_env, make_key
+from scheduler import BatchScheduler
+from server_args import MODEL_PATH, server_arg_parser
+from streaming import TimingStreamer
+from warmup import warm_up
+from worker_pool import WorkerPool, load_pool_model
+from workload import recorder_from_env
 
 # Setup logging
 logging.basicConfig(
@@ -11,35 +27,182 @@ logging.basicConfig(
 )
 logger = logging.getLogger("deepseek_gradio")
 
-# Load the model
-logger.info("Loading DeepSeek Coder model...")
-try:
-    model_path = "models/deepseek-coder-1.3b-instruct"
+# Continuous batching lets concurrent users share each forward pass
+USE_BATCHING = os.environ.get("R2D2_BATCHING", "1") != "0"
+MAX_BATCH_SIZE = int(os.environ.get("R2D2_MAX_BATCH_SIZE", "8"))
+# Long prompts are prefilled this many tokens at a time between decode steps (0: all at once)
+PREFILL_CHUNK = int(os.environ.get("R2D2_PREFILL_CHUNK", "512"))
+# Paged KV cache: blocks of R2D2_KV_BLOCK_SIZE tokens in one preallocated pool; requests wait for free
+# blocks instead of growing memory without bound (0: each batch keeps its own contiguous cache)
+KV_BLOCKS = int(os.environ.get("R2D2_KV_BLOCKS", "0"))
+KV_BLOCK_SIZE = int(os.environ.get("R2D2_KV_BLOCK_SIZE", "16"))
+# CPU only: model replicas in separate processes, each pinned to its own cores (weights shared via mmap)
+WORKERS = int(os.environ.get("R2D2_WORKERS", "1"))
+
+# LoRA adapters (one subdirectory each) served on the shared base model, and how many stay loaded
+ADAPTER_DIR = os.environ.get("R2D2_ADAPTER_DIR", "adapters")
+MAX_ADAPTERS = int(os.environ.get("R2D2_MAX_ADAPTERS", "8"))
+BASE_MODEL_CHOICE = "(base model)"
+
+# Run one dummy generation per prompt-length bucket after the model loads
+USE_WARMUP = os.environ.get("R2D2_WARMUP", "0") == "1"
+# Seconds a request waits for a model that is still loading
+MODEL_WAIT_SECONDS = float(os.environ.get("R2D2_MODEL_WAIT", "30"))
+# Prometheus metrics port (0 disables); R2D2_PROFILER=1 also serves /debug/profile there
+METRICS_PORT = int(os.environ.get("R2D2_METRICS_PORT", "9100"))
+PROFILER_ENDPOINT = os.environ.get("R2D2_PROFILER", "0") == "1"
+
+# Greedy decoding: the same prompt always produces the same answer, so it is cached
+GENERATION_PARAMS = {"max_new_tokens": 256, "do_sample": False}
+response_cache = cache_from_env(os.environ)
+# ...and identical prompts arriving while it is being generated share that one generation
+coalescer = Coalescer() if os.environ.get("R2D2_COALESCE", "1") != "0" else None
+# R2D2_RECORD_WORKLOAD=<path> logs every request's shape and timings for benchmarks/replay.py
+workload = recorder_from_env(os.environ)
+# Admission: requests generating at once, requests allowed to wait, and the longest wait
+admission = controller_from_env(
+    os.environ, default_active=MAX_BATCH_SIZE * max(1, WORKERS) if USE_BATCHING else 1
+)
+
+def load_model():
+    """Load tokenizer and model; runs on the background loader thread"""
+    global pool_setup
+    logger.info("Loading DeepSeek Coder model...")
+    model_path = MODEL_PATH
+    device_config = select_device()
+    logger.info(f"Loading on {device_config.describe()}")
     tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
-    model = AutoModelForCausalLM.from_pretrained(model_path, trust_remote_code=True, torch_dtype=torch.float16).to('cuda')
+    if USE_BATCHING and WORKERS > 1 and device_config.device == "cpu":
+        model, prepared_dir = load_pool_model(model_path, device_config)
+        pool_setup = (prepared_dir, device_config)
+    else:
+        if WORKERS > 1:
+            logger.warning("R2D2_WORKERS applies to CPU serving with batching; using one in-process model")
+        model = load_causal_lm(model_path, device_config)
     logger.info(f"Model device after loading: {model.device}")
     logger.info(f"CUDA available: {torch.cuda.is_available()}")
     logger.info("Model loaded successfully.")
-except Exception as e:
-    logger.error(f"Failed to load model: {e}")
-    model = None
+    return model, tokenizer
+
+model = None
+tokenizer = None
+scheduler = None
+adapter_cache = None
+pool_setup = None  # (prepared model dir, DeviceConfig) when serving from a worker pool
+
+def _on_model_ready(loaded_model, loaded_tokenizer):
+    global model, tokenizer, scheduler, adapter_cache
+    if pool_setup is not None:
+        # Each worker loads the adapters it is asked for into its own replica
+        prepared_dir, device_config = pool_setup
+        scheduler = WorkerPool(
+            prepared_dir, device_config, num_workers=WORKERS, max_batch_size=MAX_BATCH_SIZE,
+            prefill_chunk=PREFILL_CHUNK, adapter_dir=ADAPTER_DIR, max_adapters=MAX_ADAPTERS,
+            kv_blocks=KV_BLOCKS, kv_block_size=KV_BLOCK_SIZE,
+        ).start()
+    else:
+        adapter_cache = adapters_from_env(loaded_model, os.environ)
+        if USE_BATCHING:
+            scheduler = BatchScheduler(
+                loaded_model, loaded_tokenizer, max_batch_size=MAX_BATCH_SIZE, adapters=adapter_cache,
+                prefill_chunk=PREFILL_CHUNK,
+                kv_cache=PagedKVCache.for_model(loaded_model, KV_BLOCKS, KV_BLOCK_SIZE) if KV_BLOCKS else None,
+            )
+    tokenizer = loaded_tokenizer
+    model = loaded_model  # Set last: handlers treat a model as "ready"
+
+def _on_model_failed(error):
+    """Unpublish what _on_model_ready set up, so a retry starts from scratch"""
+    global model, tokenizer, scheduler, adapter_cache
+    model = None  # First: handlers stop treating the app as ready
+    if scheduler is not None:
+        scheduler.close()
+    scheduler = tokenizer = adapter_cache = None
+
+def _warm_up(loaded_model, loaded_tokenizer):
+    if USE_WARMUP:
+        warm_up(loaded_model, loaded_tokenizer, scheduler=scheduler)
+
+model_holder = ModelHolder(load_model, on_ready=[_on_model_ready, _warm_up], on_failure=_on_model_failed)
+
+def _not_ready_message():
+    if model_holder.loading:
+        return "Model is warming up. Please retry in a few seconds."
+    model_holder.retry()
+    return "Model not loaded. Error during initialization. A reload has been scheduled, please retry shortly."
+
+def safe_generate(prompt, adapter=None, request: gr.Request = None):
+    """Generate code for `prompt`, optionally with one of the LoRA adapters in ADAPTER_DIR"""
+    adapter = None if adapter in (None, "", BASE_MODEL_CHOICE) else adapter
+    record = workload.request("simple", prompt, params=GENERATION_PARAMS, adapter=adapter)
+    model_id = f"{MODEL_PATH}+{adapter}" if adapter else MODEL_PATH
+    request_key = make_key(prompt, params=dict(GENERATION_PARAMS, model=model_id))
+    if response_cache is not None:
+        cached = response_cache.get(request_key)
+        if cached is not None:
+            record.finish(cached=True)
+            return cached
+    if model is None and not model_holder.wait(MODEL_WAIT_SECONDS):
+        record.finish("unavailable")
+        return _not_ready_message()
+
+    def generate(cancel=None):
+        # Runs once for every identical prompt in flight; the caller that started it gets the timings
+        with track_request(ignore=(ServerBusy,)):
+            with TOKENIZE.time():
+                prompt_ids = tokenizer(prompt).input_ids
+            PROMPT_TOKENS.inc(len(prompt_ids))
+            record.prompt_tokens = len(prompt_ids)
+            client_id = request.session_hash if request is not None else None
+            with admission.admit(client_id, len(prompt_ids) + GENERATION_PARAMS["max_new_tokens"]):
+                record.admitted()
+                if scheduler is not None:
+                    handle = scheduler.submit(prompt_ids, adapter=adapter, **GENERATION_PARAMS)
+                    new_ids = handle.result()
+                    model_holder.mark_first_token(handle.first_token_at)
+                    record.first_token(handle.first_token_at)
+                else:
+                    if adapter and adapter_cache is None:
+                        raise ValueError(f"No LoRA adapters are served (looked in {ADAPTER_DIR})")
+                    input_ids = torch.tensor([prompt_ids], device=model.device)
+                    with adapter_cache.active(adapter) if adapter else nullcontext():
+                        output = model.generate(input_ids, streamer=TimingStreamer(), **GENERATION_PARAMS)
+                    model_holder.mark_first_token()
+                    new_ids = output[0][input_ids.shape[1]:]
+            record.completion_tokens = len(new_ids)
+            with DETOKENIZE.time():
+                generated_text = tokenizer.decode(new_ids, skip_special_tokens=True)
+            with POSTPROCESS.time():
+                generated_text = generated_text.strip()
+                if response_cache is not None and generated_text:
+                    response_cache.put(request_key, generated_text)
+        yield generated_text
 
-def safe_generate(prompt):
-    if model is None:
-        return "Model not loaded. Error during initialization."
     try:
-        input_ids = tokenizer(prompt, return_tensors="pt").input_ids.to(model.device)
-        output = model.generate(input_ids, max_new_tokens=256)
-        generated_text = tokenizer.decode(output[0], skip_special_tokens=True)
-        generated_text = generated_text[len(prompt):].strip()
+        if coalescer is not None:
+            flight, started = coalescer.join(request_key, generate)
+            generated_text = flight.result()
+        else:
+            started, generated_text = True, next(generate())
+        record.finish(coalesced=not started)
         return generated_text
+    except ServerBusy as e:
+        record.finish("busy")
+        return f"Server busy: {e}. Please retry in {e.retry_after:.0f} s."
     except Exception as e:
+        record.finish("error")
         logger.error(f"Error during inference: {e}", exc_info=True)
         return f"Error: {e}"
 
+inputs = [gr.Textbox(label="Code Prompt", placeholder="Enter your code generation prompt here...")]
+if list_adapters(ADAPTER_DIR):
+    inputs.append(gr.Dropdown(
+        choices=[BASE_MODEL_CHOICE] + list_adapters(ADAPTER_DIR), value=BASE_MODEL_CHOICE, label="Adapter"
+    ))
+
 iface = gr.Interface(
     fn=safe_generate,
-    inputs=[gr.Textbox(label="Code Prompt", placeholder="Enter your code generation prompt here...")],
+    inputs=inputs,
     outputs=[gr.Textbox(label="Generated Code")],
     title="Mozart R2D2",
     description="Generate code using DeepSeek Coder model."
@@ -56,10 +219,21 @@ def find_open_port(start=7860, end=9000):
                 continue
     raise RuntimeError(f"No open port found in range {start}-{end}")
 
+# Start loading only now: the on_ready callbacks use everything defined above
+model_holder.start()
+
 if __name__ == "__main__":
+    args = server_arg_parser("DeepSeek Coder simple interface", default_port=None, metrics_port=METRICS_PORT).parse_args()
     try:
-        port = find_open_port(7860, 9000)
-        logger.info(f"Starting Gradio app on 0.0.0.0:{port} with share=True")
-        iface.launch(server_name="0.0.0.0", server_port=port, share=True)
+        port = args.port or find_open_port(7860, 9000)
+        if args.metrics_port:
+            start_http_server(args.metrics_port, profiling=PROFILER_ENDPOINT, health=model_holder.health)
+        logger.info(f"Starting Gradio app on {args.host}:{port} with share={args.share}")
+        # Handlers run as soon as a worker is free; admission decides who waits and who is turned away
+        iface.queue(default_concurrency_limit=admission.max_active + admission.max_queued, max_size=admission.max_queued)
+        iface.launch(server_name=args.host, server_port=port, share=args.share, prevent_thread_lock=True)
+        model_holder.mark_bound()
+        iface.block_thread()
     except Exception as e:
         logger.error(f"Failed to launch Gradio app: {e}")
+        raise
@@ -0,0 +1,248 @@
+"""
+Offline batch generation
+Runs a JSONL file of prompts through batched model.generate, grouping prompts
+of similar token length to keep padding low, and writes one JSONL result per
+prompt in input order. Re-running with the same output file resumes.
+
+Usage: python -m batch_generate --input prompts.jsonl --output results.jsonl [--prompt-field prompt]
+       python -m batch_generate --input requests.jsonl --prompt-field body --id-field request_id --output out.jsonl
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterator, List, Optional, Set
+
+import torch
+
+from server_args import MODEL_PATH
+
+logger = logging.getLogger("deepseek_batch")
+
+
+def read_prompts(path: str, prompt_field: str = "prompt", id_field: Optional[str] = "id") -> List[dict]:
+    """Load {index, id, prompt} records; lines without the prompt field are skipped with a warning"""
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            prompt = record.get(prompt_field) if isinstance(record, dict) else record
+            if not isinstance(prompt, str):
+                logger.warning(f"{path}:{line_number}: no '{prompt_field}' string, skipped")
+                continue
+            index = len(items)
+            key = record.get(id_field, index) if id_field and isinstance(record, dict) else index
+            items.append({"index": index, "id": key, "prompt": prompt})
+    return items
+
+
+def completed_indices(output_path: str) -> Set[int]:
+    """Indices already in the output; a line cut off by an interruption is truncated away"""
+    done: Set[int] = set()
+    if not os.path.exists(output_path):
+        return done
+    good_bytes = 0
+    with open(output_path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done.add(json.loads(line)["index"])
+            except (ValueError, KeyError):
+                break
+            good_bytes += len(line)
+    if good_bytes < os.path.getsize(output_path):
+        logger.warning(f"Dropping a partial record at the end of {output_path}")
+        with open(output_path, "r+b") as f:
+            f.truncate(good_bytes)
+    return done
+
+
+def plan_batches(
+    lengths: Dict[int, int], batch_size: int, max_batch_tokens: int, bucket: bool = True
+) -> List[List[int]]:
+    """
+    Group item indices into batches.
+
+    Sorting by prompt length puts prompts of similar length together, so the
+    left padding up to the longest prompt in a batch stays small. A batch also
+    closes once batch_size x longest prompt would exceed max_batch_tokens.
+    """
+    order = sorted(lengths, key=lambda i: (lengths[i], i)) if bucket else list(lengths)
+    batches: List[List[int]] = []
+    current: List[int] = []
+    longest = 0
+    for index in order:
+        longest_if_added = max(longest, lengths[index])
+        if current and (len(current) >= batch_size or longest_if_added * (len(current) + 1) > max_batch_tokens):
+            batches.append(current)
+            current, longest_if_added = [], lengths[index]
+        current.append(index)
+        longest = longest_if_added
+    if current:
+        batches.append(current)
+    return batches
+
+
+@torch.inference_mode()
+def generate_batch(
+    model, pad_token_id: int, prompts: List[List[int]], eos_token_ids: Set[int], **params
+) -> List[List[int]]:
+    """Left-pad one batch, run model.generate and return each row's new tokens up to (excluding) EOS"""
+    width = max(len(ids) for ids in prompts)
+    input_ids = torch.full((len(prompts), width), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(prompts), width), dtype=torch.long)
+    for row, ids in enumerate(prompts):
+        input_ids[row, width - len(ids):] = torch.tensor(ids)
+        attention_mask[row, width - len(ids):] = 1
+    output = model.generate(
+        input_ids=input_ids.to(model.device),
+        attention_mask=attention_mask.to(model.device),
+        pad_token_id=pad_token_id,
+        **params,
+    )
+    results = []
+    for row in output[:, width:].tolist():
+        end = next((i for i, token in enumerate(row) if token in eos_token_ids), len(row))
+        results.append(row[:end])
+    return results
+
+
+def _windows(items: List[dict], size: int) -> Iterator[List[dict]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def run_batch(
+    model,
+    tokenizer,
+    items: List[dict],
+    output_path: str,
+    batch_size: int = 8,
+    max_batch_tokens: int = 16384,
+    window: int = 1024,
+    bucket: bool = True,
+    generation_params: Optional[dict] = None,
+) -> dict:
+    """
+    Generate for every item not yet in `output_path` and append the results.
+
+    Items are processed in windows of `window` consecutive inputs: prompts are
+    length-bucketed within a window and the whole window is written in input
+    order before the next one starts, so memory stays bounded and an
+    interrupted run loses at most one window.
+
+    Returns:
+        Aggregate counts and throughput
+    """
+    params = dict({"max_new_tokens": 256, "do_sample": False}, **(generation_params or {}))
+    done = completed_indices(output_path)
+    pending = [item for item in items if item["index"] not in done]
+    if done:
+        logger.info(f"Resuming: {len(done)} of {len(items)} prompts already in {output_path}")
+
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    eos = getattr(model.generation_config, "eos_token_id", None)
+    if eos is None:
+        eos = tokenizer.eos_token_id
+    eos_token_ids = set(eos if isinstance(eos, (list, tuple)) else [eos]) - {None}
+
+    stats = {"prompts": 0, "prompt_tokens": 0, "padded_tokens": 0, "generated_tokens": 0, "batches": 0}
+    started = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as out:
+        for chunk in _windows(pending, window):
+            encoded = {item["index"]: tokenizer(item["prompt"]).input_ids for item in chunk}
+            lengths = {index: len(ids) for index, ids in encoded.items()}
+            results: Dict[int, dict] = {}
+            for batch in plan_batches(lengths, batch_size, max_batch_tokens, bucket):
+                batch_started = time.perf_counter()
+                new_tokens = generate_batch(model, pad_token_id, [encoded[i] for i in batch], eos_token_ids, **params)
+                seconds = time.perf_counter() - batch_started
+                for index, ids in zip(batch, new_tokens):
+                    results[index] = {"tokens": ids, "seconds": seconds}
+                stats["batches"] += 1
+                stats["padded_tokens"] += len(batch) * max(lengths[i] for i in batch)
+                stats["generated_tokens"] += sum(len(ids) for ids in new_tokens)
+            for item in chunk:
+                result = results[item["index"]]
+                record = {
+                    "index": item["index"],
+                    "id": item["id"],
+                    "text": tokenizer.decode(result["tokens"], skip_special_tokens=True).strip(),
+                    "prompt_tokens": lengths[item["index"]],
+                    "completion_tokens": len(result["tokens"]),
+                    "batch_seconds": round(result["seconds"], 4),
+                }
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+            stats["prompts"] += len(chunk)
+            stats["prompt_tokens"] += sum(lengths.values())
+            elapsed = time.perf_counter() - started
+            logger.info(
+                f"{len(done) + stats['prompts']}/{len(items)} prompts, "
+                f"{stats['generated_tokens'] / elapsed:.1f} generated tok/s"
+            )
+
+    elapsed = time.perf_counter() - started
+    stats.update(
+        seconds=elapsed,
+        prompts_per_sec=stats["prompts"] / elapsed if elapsed else 0.0,
+        generated_tokens_per_sec=stats["generated_tokens"] / elapsed if elapsed else 0.0,
+        padding_efficiency=stats["prompt_tokens"] / stats["padded_tokens"] if stats["padded_tokens"] else 1.0,
+    )
+    return stats
+
+
+def main():
+    from transformers import AutoTokenizer
+
+    from device import load_causal_lm, select_device
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", required=True, help="JSONL of prompts (objects, or bare JSON strings)")
+    parser.add_argument("--output", required=True, help="JSONL results; an existing file is resumed")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--prompt-field", default="prompt")
+    parser.add_argument("--id-field", default="id", help="Copied to each result (default: line index)")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-batch-tokens", type=int, default=16384, help="Cap on batch size x longest prompt")
+    parser.add_argument("--window", type=int, default=1024, help="Prompts bucketed and written together")
+    parser.add_argument("--no-bucket", action="store_true", help="Batch in input order (for comparison)")
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--temperature", type=float, default=0.0, help="0 is greedy, like app.py")
+    parser.add_argument("--top-p", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    items = read_prompts(args.input, args.prompt_field, args.id_field)
+    device_config = select_device()
+    logger.info(f"{len(items)} prompts; loading {args.model} on {device_config.describe()}")
+    tokenizer = AutoTokenizer.from_pretrained(args.model, trust_remote_code=True)
+    model = load_causal_lm(args.model, device_config)
+
+    params = {"max_new_tokens": args.max_new_tokens, "do_sample": args.temperature > 0}
+    if args.temperature > 0:
+        params.update(temperature=args.temperature, top_p=args.top_p)
+    if args.seed is not None:
+        torch.manual_seed(args.seed)
+    stats = run_batch(
+        model, tokenizer, items, args.output,
+        batch_size=args.batch_size, max_batch_tokens=args.max_batch_tokens,
+        window=args.window, bucket=not args.no_bucket, generation_params=params,
+    )
+    logger.info(
+        f"Done: {stats['prompts']} prompts in {stats['seconds']:.1f}s ({stats['prompts_per_sec']:.2f} prompts/s), "
+        f"{stats['prompt_tokens']} prompt + {stats['generated_tokens']} generated tokens "
+        f"({stats['generated_tokens_per_sec']:.1f} tok/s), {stats['batches']} batches, "
+        f"padding efficiency {stats['padding_efficiency']:.0%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
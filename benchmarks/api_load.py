@@ -0,0 +1,132 @@
+"""
+Load test for the OpenAI-compatible API
+Opens N concurrent streaming clients against /v1/chat/completions and reports
+time to first chunk, total latency and throughput. With --tiny it starts an
+in-process API server over a tiny CPU model and the batch scheduler.
+
+Usage: python -m benchmarks.api_load [--url http://127.0.0.1:8000] [--clients 16] [--requests 64] [--tiny]
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlparse
+
+PROMPTS = [
+    "Write a Python function to reverse a string",
+    "Write a SQL query to find duplicates",
+    "Explain async/await in JavaScript",
+    "Write a quick sort algorithm in Python",
+]
+
+
+async def one_request(host: str, port: int, prompt: str, max_tokens: int, stream: bool) -> dict:
+    body = json.dumps({
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": max_tokens,
+        "temperature": 0.7,
+        "stream": stream,
+    }).encode()
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(
+        f"POST /v1/chat/completions HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    while (await reader.readline()) not in (b"\r\n", b""):
+        pass
+    first_chunk = None
+    chunks = 0
+    if stream:
+        async for line in reader:
+            if line.startswith(b"data: ") and line.strip() != b"data: [DONE]":
+                chunks += 1
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+    else:
+        await reader.read()
+        first_chunk = time.perf_counter() - start
+        chunks = 1
+    writer.close()
+    return {"status": status, "ttfc": first_chunk, "latency": time.perf_counter() - start, "chunks": chunks}
+
+
+async def run_load(host: str, port: int, clients: int, requests: int, max_tokens: int, stream: bool) -> list:
+    results = []
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(PROMPTS[i % len(PROMPTS)])
+
+    async def client():
+        while not queue.empty():
+            prompt = queue.get_nowait()
+            results.append(await one_request(host, port, prompt, max_tokens, stream))
+
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return results
+
+
+def start_tiny_server(port: int, max_batch_size: int):
+    from api_server import ApiServer
+    from benchmarks.tiny_model import build_tiny_model
+    from scheduler import BatchScheduler
+    from streaming import stream_handle
+
+    model, tokenizer = build_tiny_model(hidden_size=256, num_layers=4)
+    tokenizer.padding_side = "left"
+    scheduler = BatchScheduler(model, tokenizer, max_batch_size=max_batch_size)
+
+    def backend(request):
+        prompt = f"User: {request.message}\nAssistant:"
+        handle = scheduler.submit(tokenizer(prompt).input_ids, max_new_tokens=request.max_tokens)
+        yield from stream_handle(handle, tokenizer)
+
+    ApiServer(backend, model_name="tiny", host="127.0.0.1", port=port, max_concurrency=max_batch_size).start()
+    return scheduler
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--no-stream", action="store_true")
+    parser.add_argument("--tiny", action="store_true", help="Serve a tiny CPU model in-process")
+    args = parser.parse_args()
+
+    url = urlparse(args.url)
+    scheduler = start_tiny_server(url.port or 8000, max_batch_size=8) if args.tiny else None
+
+    start = time.perf_counter()
+    results = asyncio.run(run_load(url.hostname, url.port or 80, args.clients, args.requests, args.max_tokens, not args.no_stream))
+    elapsed = time.perf_counter() - start
+    if scheduler is not None:
+        scheduler.close()
+
+    ok = [r for r in results if r["status"] == 200]
+    statuses = {}
+    for r in results:
+        statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+    print(f"requests: {len(results)} in {elapsed:.2f}s ({len(results) / elapsed:.1f} req/s), statuses {statuses}")
+    if ok:
+        for name in ("ttfc", "latency"):
+            values = [r[name] for r in ok]
+            print(
+                f"{name:<8} p50 {percentile(values, 0.5) * 1000:7.0f}ms  p95 {percentile(values, 0.95) * 1000:7.0f}ms"
+                f"  mean {statistics.mean(values) * 1000:7.0f}ms"
+            )
+        print(f"chunks per response: {statistics.mean(r['chunks'] for r in ok):.1f}")
+
+
+if __name__ == "__main__":
+    main()
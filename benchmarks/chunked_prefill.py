@@ -0,0 +1,140 @@
+"""
+Chunked prefill benchmark
+Short chats stream replies from the BatchScheduler while long-prompt requests
+(a pasted file) keep arriving. Reports the short chats' inter-token latency
+and the long requests' time to first token, with prefill chunking off and at
+a few chunk sizes, on a tiny CPU model. Then checks that a long prompt still
+gets its first token while short prompts keep queueing for prefill.
+
+Usage: python -m benchmarks.chunked_prefill [--chunks 0 64 256] [--long-tokens 2048]
+"""
+
+import argparse
+import random
+import sys
+import threading
+import time
+from typing import List
+
+from benchmarks.scheduler_load import percentile
+from benchmarks.tiny_model import build_tiny_model
+from scheduler import BatchScheduler
+
+
+def run(scheduler: BatchScheduler, args, vocab: int) -> dict:
+    """Short chat clients plus a long-prompt injector for args.seconds; returns latency samples"""
+    rng = random.Random(0)
+    stop = threading.Event()
+    gaps: List[float] = []
+    long_ttft: List[float] = []
+    short_tokens = [0]
+    lock = threading.Lock()
+
+    def chat(seed: int):
+        local = random.Random(seed)
+        while not stop.is_set():
+            prompt = [local.randrange(5, vocab) for _ in range(args.short_tokens)]
+            handle = scheduler.submit(prompt, max_new_tokens=args.max_new_tokens)
+            last = None
+            for _ in handle:
+                now = time.perf_counter()
+                if last is not None:
+                    with lock:
+                        gaps.append(now - last)
+                last = now
+            with lock:
+                short_tokens[0] += len(handle.output_ids)
+
+    def paste():
+        while not stop.wait(args.long_interval):
+            prompt = [rng.randrange(5, vocab) for _ in range(args.long_tokens)]
+            handle = scheduler.submit(prompt, max_new_tokens=8)
+            handle.result()
+            long_ttft.append(handle.first_token_at - handle.submitted_at)
+
+    threads = [threading.Thread(target=chat, args=(i,)) for i in range(args.chats)]
+    threads.append(threading.Thread(target=paste))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    return {"gaps": gaps, "long_ttft": long_ttft, "short_tps": short_tokens[0] / wall}
+
+
+def check_starvation(model, tokenizer, args, vocab: int, chunk: int) -> float:
+    """Flood the prefill queue with short prompts behind a long one; returns the long prompt's TTFT (inf if starved)"""
+    scheduler = BatchScheduler(model, tokenizer, max_batch_size=args.chats + 4, prefill_chunk=chunk)
+    rng = random.Random(1)
+    long = scheduler.submit([rng.randrange(5, vocab) for _ in range(args.long_tokens)], max_new_tokens=1)
+
+    def flood(seed: int):
+        local = random.Random(seed)
+        # One-token replies keep each slot cycling straight back into prefill
+        while not long.done:
+            scheduler.submit([local.randrange(5, vocab) for _ in range(args.short_tokens)], max_new_tokens=1).result()
+
+    threads = [threading.Thread(target=flood, args=(i,), daemon=True) for i in range(args.chats + 3)]
+    for thread in threads:
+        thread.start()
+    try:
+        long.result(timeout=args.starvation_limit)
+        ttft = long.first_token_at - long.submitted_at
+    except TimeoutError:
+        ttft = float("inf")
+        long.cancel()
+    for thread in threads:
+        thread.join()
+    scheduler.close()
+    return ttft
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[0, 64, 256], help="Prefill chunk sizes (0: off)")
+    parser.add_argument("--chats", type=int, default=4, help="Concurrent short chats")
+    parser.add_argument("--short-tokens", type=int, default=32)
+    parser.add_argument("--long-tokens", type=int, default=2048)
+    parser.add_argument("--long-interval", type=float, default=1.0, help="Seconds between long prompts")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=15.0, help="Duration of each run")
+    parser.add_argument("--starvation-limit", type=float, default=30.0, help="Longest TTFT allowed for a long prompt behind a flood")
+    args = parser.parse_args()
+
+    model, tokenizer = build_tiny_model(hidden_size=256, num_layers=4)
+    # Random weights rarely emit EOS; make every request run to max_new_tokens
+    model.generation_config.eos_token_id = None
+    vocab = model.config.vocab_size
+
+    print(f"{args.chats} short chats ({args.short_tokens}-token prompts) + a {args.long_tokens}-token prompt every {args.long_interval:g} s")
+    print(f"{'chunk':>8}{'ITL p50 ms':>12}{'ITL p99 ms':>12}{'ITL max ms':>12}{'chat tok/s':>12}{'long TTFT p50 s':>17}{'long reqs':>11}")
+    for chunk in args.chunks:
+        scheduler = BatchScheduler(model, tokenizer, max_batch_size=args.chats + 4, prefill_chunk=chunk)
+        result = run(scheduler, args, vocab)
+        scheduler.close()
+        gaps, ttft = result["gaps"], result["long_ttft"]
+        label = str(chunk) if chunk else "off"
+        print(
+            f"{label:>8}{percentile(gaps, 50) * 1000:>12.1f}{percentile(gaps, 99) * 1000:>12.1f}"
+            f"{max(gaps) * 1000:>12.1f}{result['short_tps']:>12.1f}"
+            f"{percentile(ttft, 50) if ttft else float('nan'):>17.2f}{len(ttft):>11}"
+        )
+
+    failures = []
+    for chunk in [c for c in args.chunks if c]:
+        ttft = check_starvation(model, tokenizer, args, vocab, chunk)
+        print(f"chunk {chunk}: long prompt behind a flood of short ones, TTFT {ttft:.2f} s")
+        if ttft > args.starvation_limit:
+            failures.append(f"chunk {chunk}: short prompts starved the long prompt for over {args.starvation_limit:g} s")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK: long prompts make progress while short prompts keep arriving")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+In-flight coalescing benchmark and check
+Fires N identical greedy requests at the same moment, streamed through the
+BatchScheduler on a tiny CPU model, with and without coalescing.Coalescer.
+Verifies that coalesced callers run a single generation pipeline, all get the
+same reply and its token stream, and that one caller walking away does not cut
+the others short.
+
+Usage: python -m benchmarks.coalescing [--requests 16] [--max-new-tokens 64]
+"""
+
+import argparse
+import sys
+import threading
+import time
+from typing import Callable, Iterator, List, Optional
+
+from benchmarks.tiny_model import CORPUS, build_tiny_model
+from cancellation import CancelToken
+from coalescing import Coalescer
+from scheduler import BatchScheduler
+from streaming import stream_handle
+
+
+def fire(count: int, call: Callable[[int], List[str]]) -> tuple:
+    """Start `count` callers behind a barrier; returns (per-caller streams, per-caller latency, wall seconds)"""
+    streams: List[Optional[List[str]]] = [None] * count
+    latencies = [0.0] * count
+    barrier = threading.Barrier(count)
+
+    def caller(index: int):
+        barrier.wait()
+        started = time.perf_counter()
+        streams[index] = call(index)
+        latencies[index] = time.perf_counter() - started
+
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(count)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return streams, latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=16, help="Identical requests fired together")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    model, tokenizer = build_tiny_model(hidden_size=256, num_layers=4)
+    # Random weights rarely emit EOS; make every request run to max_new_tokens
+    model.generation_config.eos_token_id = None
+    prompt = tokenizer(CORPUS[0]).input_ids
+    params = dict(max_new_tokens=args.max_new_tokens, do_sample=False)
+
+    def reply(scheduler: BatchScheduler, cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        handle = scheduler.submit(prompt, **params)
+        if cancel is not None:
+            cancel.on_cancel(handle.cancel)
+        yield from stream_handle(handle, tokenizer)
+
+    results, failures = {}, []
+    for mode in ("independent", "coalesced"):
+        scheduler = BatchScheduler(model, tokenizer, max_batch_size=args.max_batch_size)
+        coalescer = Coalescer()
+
+        def call(index: int) -> List[str]:
+            if mode == "independent":
+                return list(reply(scheduler))
+            flight, _ = coalescer.join("same-prompt", lambda cancel: reply(scheduler, cancel))
+            return list(flight.stream())
+
+        streams, latencies, wall = fire(args.requests, call)
+        stats = scheduler.stats()
+        scheduler.close()
+        finals = {stream[-1] for stream in streams}
+        results[mode] = (wall, max(latencies), stats["requests"], stats["generated_tokens"])
+        if len(finals) != 1:
+            failures.append(f"{mode}: callers got {len(finals)} different replies")
+        if mode == "coalesced":
+            if stats["requests"] != 1:
+                failures.append(f"coalesced: {stats['requests']} generations ran for identical requests")
+            if coalescer.stats()["coalesced"] != args.requests - 1:
+                failures.append(f"coalesced: only {coalescer.stats()['coalesced']} callers joined")
+            if min(len(stream) for stream in streams) < 2:
+                failures.append("coalesced: a caller got the final text but not the stream")
+            expected = finals
+
+    # One caller disconnecting early must not cut the shared reply short for the rest
+    scheduler = BatchScheduler(model, tokenizer, max_batch_size=args.max_batch_size)
+    coalescer = Coalescer()
+
+    def call_and_leave(index: int) -> List[str]:
+        flight, _ = coalescer.join("same-prompt", lambda cancel: reply(scheduler, cancel))
+        stream = flight.stream()
+        if index == 0:
+            received = [next(stream)]
+            stream.close()
+            return received
+        return list(stream)
+
+    streams, _, _ = fire(max(2, args.requests), call_and_leave)
+    scheduler.close()
+    if any(stream[-1] not in expected for stream in streams[1:]):
+        failures.append("a caller disconnecting cut the shared reply short")
+
+    print(f"{args.requests} identical requests, {args.max_new_tokens} new tokens each")
+    print(f"{'mode':<14}{'wall s':>10}{'max lat s':>12}{'generations':>13}{'tokens':>9}")
+    for mode, (wall, latency, generations, tokens) in results.items():
+        print(f"{mode:<14}{wall:>10.2f}{latency:>12.2f}{generations:>13}{tokens:>9}")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK: one generation pipeline served every identical request")
+
+
+if __name__ == "__main__":
+    main()
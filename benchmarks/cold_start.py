@@ -0,0 +1,88 @@
+"""
+Cold-start load time and peak RSS: original checkpoint vs the prepared copy
+Saves a tiny model as a regular checkpoint in one dtype, prepares it for another
+(the usual case: bf16/fp32 download served in a different precision), then loads
+both ways in fresh processes so each peak RSS is clean.
+
+Usage: python -m benchmarks.cold_start [--hidden-size 1024] [--layers 8] [--source-dtype fp32] [--dtype bf16]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+_LOAD_SCRIPT = """
+import json, resource, sys, time, torch
+from device import DeviceConfig, load_causal_lm
+started = time.perf_counter()
+model = load_causal_lm(sys.argv[1], DeviceConfig("cpu", getattr(torch, sys.argv[2]), threads=1))
+seconds = time.perf_counter() - started
+status = dict(line.split(":", 1) for line in open("/proc/self/status"))
+print(json.dumps({"seconds": seconds, "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "anon_mb": int(status["RssAnon"].split()[0]) / 1024, "file_mb": int(status["RssFile"].split()[0]) / 1024}))
+"""
+
+_TORCH_NAMES = {"fp32": "float32", "bf16": "bfloat16", "fp16": "float16"}
+
+
+def load_in_subprocess(model_dir: str, dtype: str, baseline_mb: float) -> dict:
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    output = subprocess.run(
+        [sys.executable, "-c", _LOAD_SCRIPT, model_dir, _TORCH_NAMES[dtype]],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    result["model_mb"] = result["peak_mb"] - baseline_mb
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hidden-size", type=int, default=1024)
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--source-dtype", default="fp32", choices=_TORCH_NAMES)
+    parser.add_argument("--dtype", default="bf16", choices=_TORCH_NAMES, help="Precision served")
+    args = parser.parse_args()
+
+    import torch
+
+    from benchmarks.tiny_model import build_tiny_model
+    from model_cache import prepare
+
+    model, tokenizer = build_tiny_model(hidden_size=args.hidden_size, num_layers=args.layers)
+    model = model.to(getattr(torch, _TORCH_NAMES[args.source_dtype]))
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "tiny")
+        model.save_pretrained(source)
+        tokenizer.save_pretrained(source)
+        del model
+
+        # Interpreter + torch + transformers, without any model, to subtract from the peaks
+        baseline = subprocess.run(
+            [sys.executable, "-c", "import resource, torch, transformers, device; "
+             "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)"],
+            env=dict(os.environ, PYTHONPATH=os.getcwd()), capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()[-1]
+        baseline_mb = float(baseline)
+
+        original = load_in_subprocess(source, args.dtype, baseline_mb)
+        started = time.perf_counter()
+        prepare(source, getattr(torch, _TORCH_NAMES[args.dtype]))
+        prepare_seconds = time.perf_counter() - started
+        prepared = load_in_subprocess(source, args.dtype, baseline_mb)
+
+    print(f"{args.source_dtype} checkpoint served as {args.dtype}; runtime baseline {baseline_mb:.0f} MB")
+    print(f"one-time prepare: {prepare_seconds:.2f}s")
+    for name, result in (("original", original), ("prepared", prepared)):
+        print(
+            f"{name:<9} load {result['seconds']:6.2f}s  peak RSS above baseline {result['model_mb']:6.0f} MB  "
+            f"after load: anon {result['anon_mb']:6.0f} MB, file-backed {result['file_mb']:6.0f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+CPU precision benchmark: fp32 vs bf16 vs dynamic int8
+Each mode runs in its own process so peak resident memory is not shared between them.
+
+Usage: python -m benchmarks.cpu_precision [--hidden-size 1024] [--layers 6] [--new-tokens 64]
+"""
+
+import argparse
+import gc
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+MODES = ("fp32", "bf16", "int8")
+
+
+def current_rss_mb() -> float:
+    """Resident set size now (Linux), falling back to the peak elsewhere"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def weights_mb(model) -> float:
+    """Serialized state_dict size; counts packed int8 weights correctly"""
+    import torch
+
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2**20
+
+
+def run_mode(mode: str, args) -> dict:
+    import torch
+
+    from benchmarks.tiny_model import build_tiny_model
+    from device import DeviceConfig, available_cores, configure_threads, prepare_model
+
+    config = DeviceConfig(
+        device="cpu",
+        dtype=torch.bfloat16 if mode == "bf16" else torch.float32,
+        quantize_int8=mode == "int8",
+        threads=available_cores(),
+    )
+    configure_threads(config)
+    model, tokenizer = build_tiny_model(hidden_size=args.hidden_size, num_layers=args.layers)
+    model = prepare_model(model, config)
+    model.generation_config.eos_token_id = None
+    gc.collect()
+    rss_loaded = current_rss_mb()
+    input_ids = tokenizer("def quick_sort(xs):\n", return_tensors="pt").input_ids
+
+    with torch.inference_mode():
+        model.generate(input_ids, max_new_tokens=4, do_sample=False, pad_token_id=tokenizer.pad_token_id)
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            model.generate(input_ids, max_new_tokens=args.new_tokens, do_sample=False, pad_token_id=tokenizer.pad_token_id)
+        elapsed = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "tokens_per_s": args.new_tokens * args.repeats / elapsed,
+        "weights_mb": weights_mb(model),
+        "rss_loaded_mb": rss_loaded,
+        "rss_peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "threads": config.threads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hidden-size", type=int, default=1024)
+    parser.add_argument("--layers", type=int, default=6)
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args)))
+        return
+
+    print(f"{'mode':<6}{'tok/s':>10}{'weights MB':>12}{'RSS loaded MB':>16}{'RSS peak MB':>14}{'threads':>9}")
+    for mode in MODES:
+        child = subprocess.run(
+            [sys.executable, "-m", "benchmarks.cpu_precision", "--mode", mode,
+             "--hidden-size", str(args.hidden_size), "--layers", str(args.layers),
+             "--new-tokens", str(args.new_tokens), "--repeats", str(args.repeats)],
+            capture_output=True, text=True, check=True,
+        )
+        r = json.loads(child.stdout.strip().splitlines()[-1])
+        print(f"{r['mode']:<6}{r['tokens_per_s']:>10.1f}{r['weights_mb']:>12.1f}{r['rss_loaded_mb']:>16.1f}{r['rss_peak_mb']:>14.1f}{r['threads']:>9}")
+
+
+if __name__ == "__main__":
+    main()
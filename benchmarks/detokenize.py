@@ -0,0 +1,69 @@
+"""
+Output post-processing cost against chat history length
+Compares decoding the whole output and slicing the prompt off as a string with
+decoding only the new token ids, and naive per-step re-decoding of the reply
+with the incremental detokenizer used for streaming.
+
+Usage: python -m benchmarks.detokenize [--reply-tokens 256] [--repeats 20]
+"""
+
+import argparse
+import time
+
+from benchmarks.tiny_model import CORPUS, build_tokenizer
+from streaming import IncrementalDetokenizer
+
+HISTORY_TOKENS = (256, 1024, 4096, 16384)
+
+
+def timed(fn, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def naive_stream(tokenizer, reply_ids):
+    text = ""
+    for i in range(1, len(reply_ids) + 1):
+        text = tokenizer.decode(reply_ids[:i], skip_special_tokens=True)
+    return text
+
+
+def incremental_stream(tokenizer, reply_ids):
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    text = "".join(detokenizer.push(token) for token in reply_ids)
+    return text + detokenizer.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reply-tokens", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    tokenizer = build_tokenizer()
+    corpus_ids = tokenizer("\n".join(CORPUS), add_special_tokens=False).input_ids
+    reply_ids = (corpus_ids * (args.reply_tokens // len(corpus_ids) + 1))[:args.reply_tokens]
+
+    print(f"{'history tok':>12}{'full+slice ms':>15}{'new ids ms':>12}{'same text':>11}")
+    for history in HISTORY_TOKENS:
+        prompt_ids = (corpus_ids * (history // len(corpus_ids) + 1))[:history]
+        prompt = tokenizer.decode(prompt_ids, skip_special_tokens=True)
+        output = prompt_ids + reply_ids
+        old = lambda: tokenizer.decode(output, skip_special_tokens=True)[len(prompt):]
+        new = lambda: tokenizer.decode(output[len(prompt_ids):], skip_special_tokens=True)
+        same = old() == new()
+        print(f"{history:>12}{timed(old, args.repeats):>15.3f}{timed(new, args.repeats):>12.3f}{str(same):>11}")
+
+    naive_ms = timed(lambda: naive_stream(tokenizer, reply_ids), max(1, args.repeats // 4))
+    incremental_ms = timed(lambda: incremental_stream(tokenizer, reply_ids), max(1, args.repeats // 4))
+    same = naive_stream(tokenizer, reply_ids) == incremental_stream(tokenizer, reply_ids)
+    print(
+        f"streaming {args.reply_tokens} tokens: re-decode {naive_ms:.2f}ms, "
+        f"incremental {incremental_ms:.2f}ms, same text {same}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Stress test for the launcher's log pipeline
+Pushes N lines (default 1M) from a child process through Worker -> LogBuffer ->
+timed flushes into the real Launcher window, then checks the GUI-thread time
+spent per flush, the capped view and the spilled log file. Runs headless.
+
+The reader thread competes with the GUI thread for the GIL, so single flushes
+can take a few switch intervals (5 ms each) longer; the check uses p95.
+
+Usage: python -m benchmarks.launcher_log [--lines 1000000] [--budget-ms 16]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    parser.add_argument("--budget-ms", type=float, default=16.0, help="Allowed p95 GUI time per flush (one 60 Hz frame)")
+    args = parser.parse_args()
+
+    from PyQt5.QtWidgets import QApplication
+
+    import launcher
+
+    app = QApplication(sys.argv)
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, "launcher.log")
+        window = launcher.Launcher(log_path=log_path)
+        window.show()
+
+        flush_times = []
+        flush = window.flush_log
+
+        def timed_flush():
+            started = time.perf_counter()
+            flush()
+            flush_times.append(time.perf_counter() - started)
+
+        window.log_timer.timeout.disconnect()
+        window.log_timer.timeout.connect(timed_flush)
+
+        command = (
+            f'{sys.executable} -c "import sys\n'
+            f'for i in range({args.lines}): sys.stdout.write(f\'line {{i}} of a chatty server log .........\\n\')"'
+        )
+        done = []
+        window.run_worker(command, "Log stress")
+        window.worker.finished_signal.connect(lambda: done.append(time.perf_counter()))
+
+        started = time.perf_counter()
+        while not done:
+            app.processEvents()
+            time.sleep(0.001)
+        app.processEvents()
+        timed_flush()
+        elapsed = done[0] - started
+
+        view_lines = window.log_text.blockCount()
+        last_line = window.log_text.toPlainText().rsplit("\n", 2)[-2:]
+        total = window.log_buffer.total
+        spilled = 0
+        for name in os.listdir(tmp):
+            with open(os.path.join(tmp, name), encoding="utf-8") as f:
+                spilled += sum(1 for line in f if line.startswith("line "))
+        window.close()
+
+    busy = [t for t in flush_times if t > 0.0001]
+    flush_times.sort()
+    p95 = flush_times[min(len(flush_times) - 1, int(0.95 * len(flush_times)))]
+    print(f"{args.lines} lines in {elapsed:.1f}s ({args.lines / elapsed:,.0f} lines/s), {total} pushed")
+    print(
+        f"flushes: {len(flush_times)} ({len(busy)} with output), GUI time per flush "
+        f"mean {statistics.mean(flush_times) * 1000:.2f}ms  p95 {p95 * 1000:.2f}ms  max {flush_times[-1] * 1000:.2f}ms"
+    )
+    print(f"view holds {view_lines} lines (cap {launcher.MAX_VIEW_LINES}), log files hold {spilled} lines")
+    print(f"view ends with: {last_line}")
+
+    failures = []
+    if p95 * 1000 > args.budget_ms:
+        failures.append(f"p95 flush {p95 * 1000:.1f}ms over {args.budget_ms}ms")
+    if view_lines > launcher.MAX_VIEW_LINES:
+        failures.append("view is over its line cap")
+    if spilled != args.lines:
+        failures.append(f"log files hold {spilled} of {args.lines} lines")
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Multi-LoRA serving benchmark
+Runs one mixed workload (requests spread over several LoRA adapters plus the base
+model) three ways on a tiny CPU model: the base model alone (no adapters, the
+single-model baseline), adapters sharing one base model and one batch
+(adapters.AdapterCache), and one merged full model copy per adapter, which is
+what a process per fine-tune amounts to.
+
+Usage: python -m benchmarks.lora_adapters [--adapters 4] [--rank 16] [--clients 8]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import torch
+
+from adapters import AdapterCache
+from benchmarks.tiny_model import CORPUS, build_tiny_model
+from scheduler import BatchScheduler
+
+TARGET_MODULES = ["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"]
+
+
+def make_adapters(directory: str, count: int, rank: int, hidden_size: int, num_layers: int) -> List[str]:
+    """Save `count` random LoRA adapters for the tiny model into `directory`"""
+    from peft import LoraConfig, get_peft_model
+
+    names = []
+    for i in range(count):
+        base, _ = build_tiny_model(hidden_size=hidden_size, num_layers=num_layers)
+        peft_model = get_peft_model(base, LoraConfig(r=rank, lora_alpha=2 * rank, target_modules=TARGET_MODULES))
+        torch.manual_seed(100 + i)
+        for name, param in peft_model.named_parameters():
+            if "lora_B" in name:
+                torch.nn.init.normal_(param, std=0.02)
+        names.append(f"team-{i}")
+        peft_model.save_pretrained(os.path.join(directory, names[-1]))
+    return names
+
+
+def param_bytes(model) -> int:
+    return sum(p.numel() * p.element_size() for p in model.parameters())
+
+
+def run(workload: List[Tuple[List[int], Optional[str]]], clients: int, call: Callable) -> Tuple[float, float, list]:
+    """Send the workload from `clients` threads; returns (tokens/s, wall seconds, outputs in workload order)"""
+    outputs: list = [None] * len(workload)
+
+    def client(index: int):
+        for i in range(index, len(workload), clients):
+            outputs[i] = call(*workload[i])
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    return sum(len(o) for o in outputs) / wall, wall, outputs
+
+
+def main():
+    from peft import PeftModel
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--adapters", type=int, default=4)
+    parser.add_argument("--rank", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=48)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--base-share", type=float, default=0.25, help="Fraction of requests without an adapter")
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    args = parser.parse_args()
+
+    model, tokenizer = build_tiny_model(hidden_size=args.hidden_size, num_layers=args.layers)
+    # Random weights rarely emit EOS; make every request run to max_new_tokens
+    model.generation_config.eos_token_id = None
+    prompts = [tokenizer(p).input_ids for p in CORPUS]
+    base_bytes = param_bytes(model)
+
+    with tempfile.TemporaryDirectory() as adapter_dir:
+        names = make_adapters(adapter_dir, args.adapters, args.rank, args.hidden_size, args.layers)
+        rng = random.Random(0)
+        workload = [
+            (rng.choice(prompts), None if rng.random() < args.base_share else rng.choice(names))
+            for _ in range(args.requests)
+        ]
+        params = dict(max_new_tokens=args.max_new_tokens)
+        results = {}
+
+        # 1. Single-model baseline: the same prompts, all on the base model
+        scheduler = BatchScheduler(model, tokenizer, max_batch_size=args.max_batch_size)
+        results["base only"] = run(workload, args.clients, lambda ids, adapter: scheduler.generate(ids, **params))
+        scheduler.close()
+
+        # 2. Adapters on the shared base model, mixed in one batch
+        cache = AdapterCache(model, adapter_dir, max_loaded=args.adapters)
+        scheduler = BatchScheduler(model, tokenizer, max_batch_size=args.max_batch_size, adapters=cache)
+        results["shared base"] = run(
+            workload, args.clients, lambda ids, adapter: scheduler.generate(ids, adapter=adapter, **params)
+        )
+        adapter_stats = scheduler.stats()["adapters"]
+        scheduler.close()
+
+        # 3. One merged model per adapter, each with its own scheduler
+        separate = {None: BatchScheduler(model, tokenizer, max_batch_size=args.max_batch_size)}
+        for name in names:
+            clone, _ = build_tiny_model(hidden_size=args.hidden_size, num_layers=args.layers)
+            merged = PeftModel.from_pretrained(clone, os.path.join(adapter_dir, name)).merge_and_unload().eval()
+            merged.generation_config.eos_token_id = None
+            separate[name] = BatchScheduler(merged, tokenizer, max_batch_size=args.max_batch_size)
+        results["model per adapter"] = run(
+            workload, args.clients, lambda ids, adapter: separate[adapter].generate(ids, **params)
+        )
+        for each in separate.values():
+            each.close()
+
+    shared_out, merged_out = results["shared base"][2], results["model per adapter"][2]
+    same = sum(a == b for a, b in zip(shared_out, merged_out))
+    extra = {
+        "base only": 0,
+        "shared base": adapter_stats["bytes"],
+        "model per adapter": base_bytes * args.adapters,
+    }
+    mix = f"{args.adapters} adapters (rank {args.rank}) + {args.base_share:.0%} base"
+    print(f"{args.requests} requests, {mix}, {args.clients} clients, {args.max_new_tokens} new tokens each")
+    print(f"{'mode':<20}{'tok/s':>10}{'wall s':>10}{'vs base':>10}{'extra MB':>12}")
+    baseline = results["base only"][0]
+    for mode, (tps, wall, _) in results.items():
+        print(f"{mode:<20}{tps:>10.1f}{wall:>10.2f}{tps / baseline:>9.0%}{extra[mode] / 1024 / 1024:>12.1f}")
+    print(f"base model {base_bytes / 1024 / 1024:.1f} MB; adapter loads: {adapter_stats['loads']}")
+    print(f"shared-base outputs identical to the merged per-adapter models: {same}/{len(workload)}")
+
+
+if __name__ == "__main__":
+    main()
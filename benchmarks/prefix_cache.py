@@ -0,0 +1,44 @@
+"""
+Prefill cost per chat turn with and without the per-session KV cache
+Replays one growing conversation through two schedulers on a tiny CPU model.
+
+Usage: python -m benchmarks.prefix_cache [--turns 8] [--reply-tokens 64]
+"""
+
+import argparse
+
+from benchmarks.tiny_model import build_tiny_model
+from prefix_cache import PrefixCache
+from scheduler import BatchScheduler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--reply-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    model, tokenizer = build_tiny_model(hidden_size=256, num_layers=4)
+    model.generation_config.eos_token_id = None
+    plain = BatchScheduler(model, tokenizer)
+    cached = BatchScheduler(model, tokenizer, prefix_cache=PrefixCache())
+
+    history = []
+    print(f"{'turn':>4}{'prompt tok':>12}{'plain ms':>10}{'cached ms':>11}{'saved (cum)':>12}")
+    for turn in range(args.turns):
+        message = f"Now refactor step {turn} of the function"
+        prompt = "".join(f"User: {u}\nAssistant: {r}\n\n" for u, r in history) + f"User: {message}\nAssistant:"
+        input_ids = tokenizer(prompt).input_ids
+        timings = []
+        for scheduler in (plain, cached):
+            before = scheduler.stats()["prefill_seconds"]
+            output_ids = scheduler.generate(input_ids, max_new_tokens=args.reply_tokens, session_id="bench")
+            timings.append((scheduler.stats()["prefill_seconds"] - before) * 1000)
+        saved = cached.stats()["prefix_cache"]["tokens_saved"]
+        print(f"{turn:>4}{len(input_ids):>12}{timings[0]:>10.2f}{timings[1]:>11.2f}{saved:>12}")
+        history.append((message, tokenizer.decode(output_ids, skip_special_tokens=True)))
+    print(f"prefix cache stats: {cached.stats()['prefix_cache']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Replay a recorded workload against the current code
+Reads a log written by the workload recorder (R2D2_RECORD_WORKLOAD), rebuilds
+each request with the recorded prompt length, parameters and completion length,
+and submits it to a BatchScheduler, at the original arrival times (optionally
+sped up) or all at once. The log only holds prompt hashes, so prompts are
+synthetic token ids. Consecutive turns of a session extend the previous prompt,
+so prefix reuse still shows. EOS is ignored so every request does its recorded
+amount of work.
+
+Usage:
+    python -m benchmarks.replay synth workload.jsonl [--requests 200] [--rate 4]
+    python -m benchmarks.replay run workload.jsonl --out run_a.jsonl --tiny [--asap | --speed 2]
+    python -m benchmarks.replay compare run_a.jsonl run_b.jsonl
+"""
+
+import argparse
+import json
+import random
+import statistics
+import time
+from typing import Dict, List
+
+from server_args import MODEL_PATH
+
+SKIPPED_STATUSES = ("unavailable",)
+
+
+def load_log(path: str, include_cached: bool = False, limit: int = 0) -> List[dict]:
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("status") in SKIPPED_STATUSES or (record.get("cached") and not include_cached):
+                continue
+            if not record.get("prompt_tokens") or not record.get("completion_tokens"):
+                continue
+            records.append(record)
+    records.sort(key=lambda r: r["t"])
+    return records[:limit] if limit else records
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+def summarize(records: List[dict]) -> Dict[str, float]:
+    """Latency/TTFT distributions and overall throughput; works on recorded logs and replay results alike"""
+    # Synthetic logs are schedules only and carry no timings
+    ok = [r for r in records if r.get("status", "ok") == "ok" and "latency" in r]
+    summary = {"requests": len(records), "ok": len(ok)}
+    if not ok:
+        return summary
+    span = max(r["t"] + r["latency"] for r in ok) - min(r["t"] for r in ok)
+    summary["requests_per_sec"] = len(ok) / span if span else 0.0
+    summary["tokens_per_sec"] = sum(r["completion_tokens"] for r in ok) / span if span else 0.0
+    series = {
+        "latency": [r["latency"] for r in ok],
+        "ttft": [r["ttft"] for r in ok if "ttft" in r],
+        "queue_wait": [r["queue_wait"] for r in ok if "queue_wait" in r],
+        "request_tok_s": [r["completion_tokens"] / r["latency"] for r in ok if r["latency"] > 0],
+    }
+    for name, values in series.items():
+        if values:
+            summary[f"{name}_mean"] = statistics.mean(values)
+            for q in (0.5, 0.95, 0.99):
+                summary[f"{name}_p{int(q * 100)}"] = percentile(values, q)
+    return summary
+
+
+def synthesize(path: str, requests: int, rate: float, sessions: int, seed: int):
+    """Write a plausible chat workload (Poisson arrivals, multi-turn sessions) in the recorder's format"""
+    rng = random.Random(seed)
+    now = time.time()
+    turns: Dict[int, int] = {}
+    tokens: Dict[int, int] = {}
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(requests):
+            now += rng.expovariate(rate)
+            session = rng.randrange(sessions)
+            turns[session] = turns.get(session, -1) + 1
+            completion = rng.randint(16, 160)
+            tokens[session] = tokens.get(session, 0) + rng.randint(12, 80)
+            record = {
+                "t": round(now, 4), "app": "chat", "prompt": f"{rng.getrandbits(64):016x}",
+                "history": turns[session], "session": f"{session:08x}",
+                "params": {"max_new_tokens": 512, "temperature": 0.2, "top_p": 0.95, "do_sample": True},
+                "prompt_tokens": min(tokens[session], 1536), "completion_tokens": completion, "status": "ok",
+            }
+            tokens[session] += completion
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+    print(f"Wrote {requests} requests over {sessions} sessions at ~{rate}/s to {path}")
+
+
+def build_prompts(records: List[dict], vocab: List[int]) -> List[List[int]]:
+    """Synthetic prompt ids per record; a session's next turn extends its previous prompt"""
+    last: Dict[str, List[int]] = {}
+    prompts = []
+    for record in records:
+        rng = random.Random(record["prompt"])
+        length = record["prompt_tokens"]
+        previous = last.get(record.get("session"), []) if record.get("session") else []
+        prefix = previous[:length] if len(previous) < length else []
+        ids = prefix + [rng.choice(vocab) for _ in range(length - len(prefix))]
+        if record.get("session"):
+            last[record["session"]] = ids
+        prompts.append(ids)
+    return prompts
+
+
+def replay(records: List[dict], scheduler, prompts: List[List[int]], speed: float) -> List[dict]:
+    """Submit every record (at its arrival offset / speed, or at once if speed is 0) and collect timings"""
+    t0 = records[0]["t"]
+    started = time.perf_counter()
+    submitted = []
+    for record, ids in zip(records, prompts):
+        if speed > 0:
+            delay = (record["t"] - t0) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        params = dict(record.get("params", {}), max_new_tokens=record["completion_tokens"])
+        handle = scheduler.submit(ids, session_id=record.get("session"), **params)
+        submitted.append((record, handle))
+
+    results = []
+    for record, handle in submitted:
+        try:
+            handle.result()
+            status = "ok"
+        except Exception:
+            status = "error"
+        result = {
+            "t": handle.submitted_at - started,
+            "prompt_tokens": len(handle.request.input_ids),
+            "completion_tokens": len(handle.output_ids),
+            "latency": handle.finished_at - handle.submitted_at,
+            "status": status,
+        }
+        if handle.first_token_at is not None:
+            result["ttft"] = handle.first_token_at - handle.submitted_at
+        results.append(result)
+    return results
+
+
+def run(args):
+    from prefix_cache import PrefixCache
+    from scheduler import BatchScheduler
+
+    records = load_log(args.log, include_cached=args.include_cached, limit=args.limit)
+    if not records:
+        raise SystemExit(f"No replayable requests in {args.log}")
+    if args.tiny:
+        from benchmarks.tiny_model import build_tiny_model
+
+        model, tokenizer = build_tiny_model(hidden_size=256, num_layers=4)
+    else:
+        from transformers import AutoTokenizer
+
+        from device import load_causal_lm, select_device
+
+        tokenizer = AutoTokenizer.from_pretrained(args.model, trust_remote_code=True)
+        model = load_causal_lm(args.model, select_device())
+    # No id matches -1, so generation runs to the recorded completion length
+    model.generation_config.eos_token_id = -1
+    special = set(tokenizer.all_special_ids)
+    vocab = [i for i in range(len(tokenizer)) if i not in special]
+    max_positions = getattr(model.config, "max_position_embeddings", 4096)
+    for record in records:
+        record["prompt_tokens"] = min(record["prompt_tokens"], max_positions - record["completion_tokens"] - 1)
+
+    prefix_cache = PrefixCache(max_bytes=args.prefix_cache_mb * 1024 * 1024) if args.prefix_cache_mb else None
+    scheduler = BatchScheduler(model, tokenizer, max_batch_size=args.batch_size, prefix_cache=prefix_cache)
+    speed = 0.0 if args.asap else args.speed
+    span = records[-1]["t"] - records[0]["t"]
+    mode = "as fast as possible" if speed == 0 else f"original timing x{speed:g} ({span / speed:.0f}s)"
+    print(f"Replaying {len(records)} requests, {mode}")
+    try:
+        results = replay(records, scheduler, build_prompts(records, vocab), speed)
+    finally:
+        scheduler.close()
+    with open(args.out, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, separators=(",", ":")) + "\n")
+    print_summary(args.out, summarize(results))
+
+
+def print_summary(name: str, summary: Dict[str, float]):
+    print(f"{name}: {summary['ok']}/{summary['requests']} ok, {summary.get('requests_per_sec', 0):.2f} req/s, "
+          f"{summary.get('tokens_per_sec', 0):.1f} tok/s")
+    for metric in ("latency", "ttft", "queue_wait"):
+        if f"{metric}_p50" in summary:
+            print(f"  {metric:<10} p50 {summary[f'{metric}_p50'] * 1000:8.0f}ms  p95 {summary[f'{metric}_p95'] * 1000:8.0f}ms"
+                  f"  p99 {summary[f'{metric}_p99'] * 1000:8.0f}ms")
+
+
+def compare(args):
+    a, b = summarize(load_log(args.a, include_cached=True)), summarize(load_log(args.b, include_cached=True))
+    print(f"{'metric':<22}{'A':>12}{'B':>12}{'change':>10}")
+    for key in sorted(set(a) & set(b), key=lambda k: (k.split("_")[0], k)):
+        if key in ("requests", "ok"):
+            continue
+        scale = 1000 if key.split("_")[0] in ("latency", "ttft", "queue") else 1
+        unit = "ms" if scale == 1000 else ""
+        change = (b[key] - a[key]) / a[key] * 100 if a[key] else float("nan")
+        print(f"{key + (' (' + unit + ')' if unit else ''):<22}{a[key] * scale:>12.1f}{b[key] * scale:>12.1f}{change:>+9.1f}%")
+    print(f"{'requests ok':<22}{a['ok']:>12}{b['ok']:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    synth = commands.add_parser("synth", help="Write a synthetic workload log")
+    synth.add_argument("log")
+    synth.add_argument("--requests", type=int, default=200)
+    synth.add_argument("--rate", type=float, default=4.0, help="Mean arrivals per second")
+    synth.add_argument("--sessions", type=int, default=20)
+    synth.add_argument("--seed", type=int, default=0)
+
+    run_parser = commands.add_parser("run", help="Replay a log against the current code")
+    run_parser.add_argument("log")
+    run_parser.add_argument("--out", required=True, help="Per-request results (JSONL, comparable with 'compare')")
+    run_parser.add_argument("--tiny", action="store_true", help="Tiny random model on CPU")
+    run_parser.add_argument("--model", default=MODEL_PATH)
+    run_parser.add_argument("--asap", action="store_true", help="Submit everything at once")
+    run_parser.add_argument("--speed", type=float, default=1.0, help="Compress the original timeline by this factor")
+    run_parser.add_argument("--batch-size", type=int, default=8)
+    run_parser.add_argument("--prefix-cache-mb", type=int, default=0)
+    run_parser.add_argument("--limit", type=int, default=0)
+    run_parser.add_argument("--include-cached", action="store_true", help="Also replay cache hits through the model")
+
+    compare_parser = commands.add_parser("compare", help="Compare two runs (or a recorded log and a run)")
+    compare_parser.add_argument("a")
+    compare_parser.add_argument("b")
+
+    args = parser.parse_args()
+    if args.command == "synth":
+        synthesize(args.log, args.requests, args.rate, args.sessions, args.seed)
+    elif args.command == "run":
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
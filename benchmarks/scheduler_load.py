@@ -0,0 +1,96 @@
+"""
+Load benchmark for the continuous-batching scheduler
+Compares serialized model.generate calls (one request at a time, as the apps did)
+against BatchScheduler at several client concurrencies, on a tiny CPU model.
+
+Usage: python -m benchmarks.scheduler_load [--requests 8] [--max-new-tokens 32]
+"""
+
+import argparse
+import random
+import threading
+import time
+from typing import Callable, List
+
+import torch
+
+from benchmarks.tiny_model import CORPUS, build_tiny_model
+from scheduler import BatchScheduler
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_clients(clients: int, requests_per_client: int, call: Callable[[List[int]], int], prompts: List[List[int]]):
+    """Fire requests from `clients` threads and collect per-request latency"""
+    latencies: List[float] = []
+    tokens = [0]
+    lock = threading.Lock()
+
+    def client(seed: int):
+        rng = random.Random(seed)
+        for _ in range(requests_per_client):
+            prompt = rng.choice(prompts)
+            start = time.perf_counter()
+            generated = call(prompt)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                tokens[0] += generated
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    return tokens[0] / wall, percentile(latencies, 50), percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=8, help="Requests per client")
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+
+    torch.set_num_threads(max(1, torch.get_num_threads()))
+    model, tokenizer = build_tiny_model(hidden_size=256, num_layers=4)
+    prompts = [tokenizer(p).input_ids for p in CORPUS]
+    # Random weights rarely emit EOS; make every request run to max_new_tokens
+    model.generation_config.eos_token_id = None
+
+    generate_lock = threading.Lock()
+
+    def serialized(prompt: List[int]) -> int:
+        with generate_lock, torch.no_grad():
+            output = model.generate(
+                torch.tensor([prompt]),
+                max_new_tokens=args.max_new_tokens,
+                min_new_tokens=args.max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+        return output.shape[1] - len(prompt)
+
+    scheduler = BatchScheduler(model, tokenizer, max_batch_size=args.max_batch_size)
+
+    def batched(prompt: List[int]) -> int:
+        return len(scheduler.generate(prompt, max_new_tokens=args.max_new_tokens))
+
+    print(f"{'mode':<12}{'clients':>8}{'tok/s':>10}{'p50 s':>10}{'p99 s':>10}")
+    for clients in args.concurrency:
+        for name, call in (("serialized", serialized), ("batched", batched)):
+            tps, p50, p99 = run_clients(clients, args.requests, call, prompts)
+            print(f"{name:<12}{clients:>8}{tps:>10.1f}{p50:>10.3f}{p99:>10.3f}")
+    print(f"scheduler stats: {scheduler.stats()}")
+    scheduler.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Speculative decoding on a canned code-edit workload (CPU)
+Each reply rewrites a snippet from the prompt with a small fix, the way real
+"fix/refactor this" answers do. The main model is forced to follow the script,
+so greedy output is identical in every mode and only the number of main-model
+forward passes changes. transformers applies the same logits processors to the
+draft model, so it follows the script too and the draft row is a ceiling.
+
+Usage: python -m benchmarks.speculative [--hidden-size 512] [--layers 6]
+"""
+
+import argparse
+import time
+
+import torch
+from transformers import LogitsProcessorList
+
+from benchmarks.stop_sequences import ForceScript
+from benchmarks.tiny_model import build_tiny_model
+from speculative import MODES, speculative_kwargs
+
+SNIPPETS = [
+    (
+        "def average(xs):\n    total = 0\n    for x in xs:\n        total += x\n    return total / len(xs)\n",
+        "def average(xs):\n    if not xs:\n        return 0.0\n    total = 0\n    for x in xs:\n        total += x\n    return total / len(xs)\n",
+    ),
+    (
+        "def quick_sort(xs):\n    if len(xs) <= 1:\n        return xs\n    pivot = xs[0]\n"
+        "    left = [x for x in xs if x < pivot]\n    right = [x for x in xs if x > pivot]\n"
+        "    return quick_sort(left) + [pivot] + quick_sort(right)\n",
+        "def quick_sort(xs):\n    if len(xs) <= 1:\n        return xs\n    pivot = xs[0]\n"
+        "    left = [x for x in xs[1:] if x < pivot]\n    right = [x for x in xs[1:] if x >= pivot]\n"
+        "    return quick_sort(left) + [pivot] + quick_sort(right)\n",
+    ),
+    (
+        "async function load(url) {\n    const res = fetch(url);\n    return res.json();\n}\n",
+        "async function load(url) {\n    const res = await fetch(url);\n    return res.json();\n}\n",
+    ),
+    (
+        "@app.route('/items', methods=['GET'])\ndef list_items():\n    return items\n",
+        "@app.route('/items', methods=['GET'])\ndef list_items():\n    return jsonify(items)\n",
+    ),
+]
+
+
+def run(model, tokenizer, prompt, script, mode, draft_model):
+    input_ids = tokenizer(prompt, return_tensors="pt").input_ids
+    calls = [0]
+    hook = model.register_forward_hook(lambda *_: calls.__setitem__(0, calls[0] + 1))
+    start = time.perf_counter()
+    try:
+        with torch.inference_mode():
+            output = model.generate(
+                input_ids,
+                max_new_tokens=len(script),
+                do_sample=False,
+                logits_processor=LogitsProcessorList([ForceScript(script, input_ids.shape[1])]),
+                pad_token_id=tokenizer.pad_token_id,
+                **speculative_kwargs(mode, draft_model),
+            )
+    finally:
+        hook.remove()
+    elapsed = time.perf_counter() - start
+    new_ids = output[0, input_ids.shape[1]:].tolist()
+    return new_ids, calls[0], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hidden-size", type=int, default=512)
+    parser.add_argument("--layers", type=int, default=6)
+    parser.add_argument("--draft-layers", type=int, default=1)
+    args = parser.parse_args()
+
+    model, tokenizer = build_tiny_model(hidden_size=args.hidden_size, num_layers=args.layers)
+    draft_model, _ = build_tiny_model(hidden_size=64, num_layers=args.draft_layers, seed=1)
+    for m in (model, draft_model):
+        m.generation_config.eos_token_id = None
+
+    totals = {mode: [0, 0, 0.0] for mode in MODES}
+    reference = {}
+    for before, after in SNIPPETS:
+        prompt = f"User: fix this code\n```\n{before}```\nAssistant: Here is the fixed version:\n```\n"
+        script = tokenizer(after + "```\n", add_special_tokens=False).input_ids
+        run(model, tokenizer, prompt, script, "off", None)  # Warm the kernels for this length
+        for mode in MODES:
+            new_ids, steps, elapsed = run(model, tokenizer, prompt, script, mode, draft_model)
+            reference.setdefault(before, new_ids)
+            assert new_ids == reference[before], f"{mode} changed the greedy output"
+            totals[mode][0] += len(new_ids)
+            totals[mode][1] += steps
+            totals[mode][2] += elapsed
+
+    base_time = totals["off"][2]
+    print(f"{'mode':<8}{'tokens':>8}{'forward passes':>16}{'tokens/pass':>13}{'seconds':>10}{'speedup':>9}")
+    for mode, (tokens, steps, elapsed) in totals.items():
+        print(f"{mode:<8}{tokens:>8}{steps:>16}{tokens / steps:>13.2f}{elapsed:>10.2f}{base_time / elapsed:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Tokens saved by stopping on the chat turn delimiter
+Replays canned assistant replies (which run on into an invented next user turn,
+as real models do) through a tiny CPU model whose logits are forced to follow
+the script. Compares the old behaviour, run to max_new_tokens then split on
+the delimiter, with StopSequenceCriteria halting each row as soon as it finishes.
+
+Usage: python -m benchmarks.stop_sequences [--max-new-tokens 256]
+"""
+
+import argparse
+import time
+from typing import Sequence
+
+import torch
+from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteriaList
+
+from benchmarks.tiny_model import build_tiny_model
+from stopping import StopSequenceCriteria, with_eos_text
+
+CONVERSATIONS = [
+    (
+        "User: Write a Python function to reverse a string\nAssistant:",
+        " Here you go:\n```python\ndef reverse(s: str) -> str:\n    return s[::-1]\n```\n"
+        "\nUser: Now make it handle None\nAssistant: Sure:\n```python\ndef reverse(s):\n    return None if s is None else s[::-1]\n```\n",
+    ),
+    (
+        "User: Write a SQL query to find duplicates\nAssistant:",
+        " SELECT name, COUNT(*) FROM users GROUP BY name HAVING COUNT(*) > 1;\n"
+        "\nUser: And delete them?\nAssistant: DELETE FROM users WHERE id NOT IN (SELECT MIN(id) FROM users GROUP BY name);\n",
+    ),
+    (
+        "User: Explain async/await in JavaScript\nAssistant:",
+        " An async function returns a promise, and await pauses it until the promise settles:\n"
+        "```javascript\nasync function load() {\n    const res = await fetch(url);\n    return res.json();\n}\n```\n"
+        "\nUser: What about errors?\nAssistant: Wrap the await in try/catch.\n",
+    ),
+    (
+        "User: Write a quick sort algorithm in Python\nAssistant:",
+        " ```python\ndef quick_sort(xs):\n    if len(xs) <= 1:\n        return xs\n    pivot = xs[0]\n"
+        "    return quick_sort([x for x in xs[1:] if x < pivot]) + [pivot] + quick_sort([x for x in xs[1:] if x >= pivot])\n```\n"
+        "\nUser: Is it stable?\nAssistant: No, this version is not stable.\n",
+    ),
+]
+
+
+class ForceScript(LogitsProcessor):
+    """Make generation follow a fixed token script (then repeat its tail)"""
+
+    def __init__(self, script, prompt_length):
+        self.script = script
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores):
+        step = input_ids.shape[1] - self.prompt_length
+        token = self.script[step % len(self.script)]
+        forced = torch.full_like(scores, float("-inf"))
+        forced[:, token] = 0
+        return forced
+
+
+def truncate_at_stop(text: str, stop_sequences: Sequence[str]) -> str:
+    """Cut `text` at the earliest stop sequence it contains"""
+    cut = min((i for i in (text.find(s) for s in stop_sequences if s) if i >= 0), default=len(text))
+    return text[:cut]
+
+
+def run(model, tokenizer, prompt, script, max_new_tokens, stops, early_stop):
+    input_ids = tokenizer(prompt, return_tensors="pt").input_ids
+    criteria = StoppingCriteriaList()
+    if early_stop:
+        criteria.append(StopSequenceCriteria(tokenizer, stops, prompt_length=input_ids.shape[1]))
+    start = time.perf_counter()
+    with torch.inference_mode():
+        output = model.generate(
+            input_ids,
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            logits_processor=LogitsProcessorList([ForceScript(script, input_ids.shape[1])]),
+            stopping_criteria=criteria,
+            pad_token_id=tokenizer.pad_token_id,
+        )
+    elapsed = time.perf_counter() - start
+    new_ids = output[0, input_ids.shape[1]:]
+    text = truncate_at_stop(tokenizer.decode(new_ids, skip_special_tokens=True), stops)
+    return len(new_ids), text, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    args = parser.parse_args()
+
+    model, tokenizer = build_tiny_model(hidden_size=256, num_layers=4)
+    model.generation_config.eos_token_id = None
+    stops = with_eos_text(tokenizer, ("\nUser:",))
+
+    totals = {False: [0, 0.0], True: [0, 0.0]}
+    print(f"{'conversation':<14}{'full tok':>10}{'early tok':>11}{'saved':>8}{'same reply':>12}")
+    for i, (prompt, reply) in enumerate(CONVERSATIONS):
+        script = tokenizer(reply, add_special_tokens=False).input_ids
+        full = run(model, tokenizer, prompt, script, args.max_new_tokens, stops, early_stop=False)
+        early = run(model, tokenizer, prompt, script, args.max_new_tokens, stops, early_stop=True)
+        for flag, result in ((False, full), (True, early)):
+            totals[flag][0] += result[0]
+            totals[flag][1] += result[2]
+        saved = 1 - early[0] / full[0]
+        print(f"{i:<14}{full[0]:>10}{early[0]:>11}{saved:>8.0%}{str(full[1] == early[1]):>12}")
+    print(
+        f"total: {totals[False][0]} -> {totals[True][0]} tokens "
+        f"({1 - totals[True][0] / totals[False][0]:.0%} saved), "
+        f"{totals[False][1]:.2f}s -> {totals[True][1]:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
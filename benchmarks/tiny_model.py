@@ -0,0 +1,62 @@
+"""
+Tiny randomly-initialized model for CPU benchmarks
+Llama architecture (same family as DeepSeek Coder) with a small byte-level BPE tokenizer
+"""
+
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+CORPUS = [
+    "Write a Python function to reverse a string",
+    "def reverse(s: str) -> str:\n    return s[::-1]\n",
+    "Create a REST API endpoint in Flask",
+    "@app.route('/items', methods=['GET'])\ndef list_items():\n    return jsonify(items)\n",
+    "Explain async/await in JavaScript",
+    "async function load() {\n    const res = await fetch(url);\n    return res.json();\n}\n",
+    "Write a SQL query to find duplicates",
+    "SELECT name, COUNT(*) FROM users GROUP BY name HAVING COUNT(*) > 1;",
+    "Write a quick sort algorithm in Python",
+    "def quick_sort(xs):\n    if len(xs) <= 1:\n        return xs\n    pivot = xs[0]\n",
+    "User: fix this code\nAssistant: Here is the fixed version:\n```python\n```\n",
+]
+
+
+def build_tokenizer(vocab_size: int = 512) -> PreTrainedTokenizerFast:
+    """Train a byte-level BPE tokenizer on a small built-in corpus"""
+    tok = Tokenizer(models.BPE())
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tok.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size,
+        special_tokens=["<s>", "</s>", "<pad>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+        show_progress=False,
+    )
+    tok.train_from_iterator(CORPUS * 8, trainer)
+    return PreTrainedTokenizerFast(tokenizer_object=tok, bos_token="<s>", eos_token="</s>", pad_token="<pad>")
+
+
+def build_tiny_model(hidden_size: int = 64, num_layers: int = 2, seed: int = 0, vocab_size: int = 512):
+    """
+    Build a randomly-initialized Llama model and tokenizer on CPU.
+
+    Returns:
+        (model, tokenizer) tuple, model in eval mode
+    """
+    tokenizer = build_tokenizer(vocab_size)
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=4,
+        max_position_embeddings=4096,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    model = LlamaForCausalLM(config).eval()
+    return model, tokenizer
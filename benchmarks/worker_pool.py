@@ -0,0 +1,98 @@
+"""
+Throughput of the CPU worker pool as replicas are added
+Serves a tiny model from 1..N pinned worker processes, keeps every replica's batch
+full with concurrent requests, and reports tokens/s plus per-worker memory
+(RssAnon is private, RssFile is the shared mmap of the weights).
+
+Usage: python -m benchmarks.worker_pool [--max-workers 4] [--requests 32] [--max-new-tokens 64]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import torch
+
+from benchmarks.tiny_model import build_tiny_model
+from device import DeviceConfig, allowed_cores
+from model_cache import WEIGHTS, export_weights
+from worker_pool import WorkerPool
+
+PROMPTS = [
+    "Write a Python function to reverse a string",
+    "Write a SQL query to find duplicates",
+    "Explain async/await in JavaScript",
+    "Write a quick sort algorithm in Python",
+]
+
+
+def rss_kb(pid: int) -> dict:
+    fields = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("RssAnon", "RssFile"):
+                fields[name] = int(value.split()[0])
+    return fields
+
+
+def run(model_dir: str, workers: int, cores, requests: int, max_new_tokens: int, batch: int, tokenizer):
+    pool = WorkerPool(
+        model_dir, DeviceConfig("cpu", torch.float32), num_workers=workers, max_batch_size=batch, cores=cores
+    ).start()
+    prompts = [tokenizer(f"User: {PROMPTS[i % len(PROMPTS)]}\nAssistant:").input_ids for i in range(requests)]
+    # Untimed pass so every worker has its kernels warm
+    for handle in [pool.submit(prompts[0], max_new_tokens=4) for _ in range(workers)]:
+        handle.result()
+
+    start = time.perf_counter()
+    handles = [pool.submit(ids, max_new_tokens=max_new_tokens, session_id=i) for i, ids in enumerate(prompts)]
+    tokens = sum(len(h.result()) for h in handles)
+    elapsed = time.perf_counter() - start
+
+    memory = [rss_kb(w.process.pid) for w in pool._workers]
+    pool.close()
+    return tokens / elapsed, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=4, help="Batch size of each worker")
+    parser.add_argument("--hidden-size", type=int, default=512)
+    parser.add_argument("--layers", type=int, default=8)
+    args = parser.parse_args()
+
+    cores = allowed_cores()
+    model, tokenizer = build_tiny_model(hidden_size=args.hidden_size, num_layers=args.layers)
+    weights_mb = sum(p.numel() * p.element_size() for p in model.parameters()) / 2**20
+    print(f"{len(cores)} cores available, model weights {weights_mb:.0f} MB")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model.config.save_pretrained(tmp)
+        tokenizer.save_pretrained(tmp)
+        export_weights(model, os.path.join(tmp, WEIGHTS))
+        del model
+
+        baseline = None
+        for workers in range(1, args.max_workers + 1):
+            if workers > len(cores):
+                print(f"{workers} workers: skipped, only {len(cores)} cores")
+                continue
+            throughput, memory = run(
+                tmp, workers, cores, args.requests, args.max_new_tokens, args.batch_size, tokenizer
+            )
+            baseline = baseline or throughput
+            anon = sum(m["RssAnon"] for m in memory) / 1024
+            shared = max(m["RssFile"] for m in memory) / 1024
+            print(
+                f"{workers} workers: {throughput:8.1f} tok/s  x{throughput / baseline:.2f}  "
+                f"private {anon:6.0f} MB total, mapped {shared:5.0f} MB per worker"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Cancellation of abandoned chat replies
+Each chat session has at most one reply in flight. Clearing the chat, sending a
+new message or closing the tab cancels it, and generation stops at the next
+token boundary instead of running on to max_new_tokens.
+"""
+
+import logging
+import threading
+from typing import Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger("deepseek_cancellation")
+
+# Why a reply was abandoned
+CLEARED = "cleared"
+SUPERSEDED = "superseded"
+DISCONNECTED = "disconnected"
+
+
+class CancelToken:
+    """Cancellation state of one reply; whoever generates it registers how to stop"""
+
+    def __init__(self):
+        self.reason: Optional[str] = None
+        self._callbacks: List[Callable[[str], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def on_cancel(self, callback: Callable[[str], None]):
+        """Call `callback(reason)` on cancellation, right away if it already happened"""
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+                return
+        callback(self.reason)
+
+    def cancel(self, reason: str):
+        """Cancel with `reason`; later calls are ignored"""
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(reason)
+
+
+class SessionReplies:
+    """The reply each chat session is currently waiting for"""
+
+    def __init__(self):
+        self._tokens: Dict[Hashable, CancelToken] = {}
+        self._lock = threading.Lock()
+
+    def start(self, session_id: Optional[Hashable]) -> CancelToken:
+        """Token for a new reply in `session_id`; a reply still running there is superseded"""
+        token = CancelToken()
+        if session_id is None:
+            return token
+        with self._lock:
+            previous = self._tokens.get(session_id)
+            self._tokens[session_id] = token
+        if previous is not None and not previous.cancelled:
+            logger.info("Cancelling a reply superseded by a new message")
+            previous.cancel(SUPERSEDED)
+        return token
+
+    def finish(self, session_id: Optional[Hashable], token: CancelToken):
+        with self._lock:
+            if self._tokens.get(session_id) is token:
+                del self._tokens[session_id]
+
+    def cancel(self, session_id: Optional[Hashable], reason: str) -> bool:
+        """Cancel the session's reply in flight, if any; returns whether there was one"""
+        with self._lock:
+            token = self._tokens.pop(session_id, None)
+        if token is None or token.cancelled:
+            return False
+        logger.info(f"Cancelling a reply: {reason}")
+        token.cancel(reason)
+        return True
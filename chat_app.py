@@ -5,11 +5,35 @@ Cursor-inspired design with dark theme and advanced features
 
 import gradio as gr
 import logging
+import os
 import torch
 import json
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from typing import List, Tuple
+import threading
+from contextlib import nullcontext
+from functools import partial
+from transformers import AutoTokenizer
+from typing import Callable, Iterator, List, Optional, Tuple
 import re
+from adapters import adapters_from_env, list_adapters
+from admission import ServerBusy, controller_from_env
+from api_server import ApiServer, CompletionRequest, Unavailable
+from cancellation import CLEARED, DISCONNECTED, CancelToken, SessionReplies
+from coalescing import Coalescer
+from context_builder import ContextBuilder
+from device import load_causal_lm, select_device
+from metrics import POSTPROCESS, PROMPT_TOKENS, TOKENIZE, record_cancelled, start_http_server, track_request
+from model_loader import ModelHolder
+from paged_kv import PagedKVCache
+from prefix_cache import PrefixCache
+from response_cache import cache_from_env, is_cacheable, make_key, normalize_prompt
+from scheduler import BatchScheduler
+from server_args import MODEL_PATH, server_arg_parser
+from speculative import MODES as SPECULATIVE_MODES, load_draft_model, speculative_kwargs
+from stopping import stop_sequences_from_env, with_eos_text
+from streaming import EventStoppingCriteria, stream_generate, stream_handle
+from warmup import warm_up
+from worker_pool import WorkerPool, load_pool_model
+from workload import RequestRecord, recorder_from_env
 
 # Setup logging
 logging.basicConfig(
@@ -18,22 +42,147 @@ logging.basicConfig(
 )
 logger = logging.getLogger("deepseek_chat")
 
-# Load the model
-logger.info("Loading DeepSeek Coder model...")
-try:
-    model_path = "models/DeepSeek-Coder-1.3b-instruct"
+# Continuous batching lets concurrent users share each forward pass
+USE_BATCHING = os.environ.get("R2D2_BATCHING", "1") != "0"
+MAX_BATCH_SIZE = int(os.environ.get("R2D2_MAX_BATCH_SIZE", "8"))
+# Long prompts are prefilled this many tokens at a time between decode steps (0: all at once)
+PREFILL_CHUNK = int(os.environ.get("R2D2_PREFILL_CHUNK", "512"))
+# Paged KV cache: blocks of R2D2_KV_BLOCK_SIZE tokens in one preallocated pool; requests wait for free
+# blocks instead of growing memory without bound (0: each batch keeps its own contiguous cache)
+KV_BLOCKS = int(os.environ.get("R2D2_KV_BLOCKS", "0"))
+KV_BLOCK_SIZE = int(os.environ.get("R2D2_KV_BLOCK_SIZE", "16"))
+# CPU only: model replicas in separate processes, each pinned to its own cores (weights shared via mmap)
+WORKERS = int(os.environ.get("R2D2_WORKERS", "1"))
+# KV cache kept per chat session so a new turn only prefills the new message
+PREFIX_CACHE_MB = int(os.environ.get("R2D2_PREFIX_CACHE_MB", "512"))
+# Token budget for history + new message; the rest of the context is left for the reply
+MAX_PROMPT_TOKENS = int(os.environ.get("R2D2_MAX_PROMPT_TOKENS", "2048"))
+
+# LoRA adapters (one subdirectory each) served on the shared base model, and how many stay loaded
+ADAPTER_DIR = os.environ.get("R2D2_ADAPTER_DIR", "adapters")
+MAX_ADAPTERS = int(os.environ.get("R2D2_MAX_ADAPTERS", "8"))
+BASE_MODEL_CHOICE = "(base model)"
+
+# Speculative decoding default: "off", "ngram" (prompt lookup) or "draft" (needs R2D2_DRAFT_MODEL)
+SPECULATIVE_MODE = os.environ.get("R2D2_SPECULATIVE", "off")
+# Small model sharing the main tokenizer, used by the "draft" mode
+DRAFT_MODEL_PATH = os.environ.get("R2D2_DRAFT_MODEL", "")
+
+# Admission: requests generating at once, requests allowed to wait, and the longest wait
+admission = controller_from_env(
+    os.environ, default_active=MAX_BATCH_SIZE * max(1, WORKERS) if USE_BATCHING else 1
+)
+
+# OpenAI-compatible HTTP API served next to the UI; port 0 disables it
+API_PORT = int(os.environ.get("R2D2_API_PORT", "8000"))
+
+# Prometheus metrics port (0 disables); R2D2_PROFILER=1 also serves /debug/profile there
+METRICS_PORT = int(os.environ.get("R2D2_METRICS_PORT", "9100"))
+PROFILER_ENDPOINT = os.environ.get("R2D2_PROFILER", "0") == "1"
+
+# Run dummy generations and precompute example answers after the model loads
+USE_WARMUP = os.environ.get("R2D2_WARMUP", "0") == "1"
+# Defaults of the parameter sliders
+DEFAULT_TEMPERATURE = 0.2
+DEFAULT_MAX_TOKENS = 256
+# Seconds a request waits for a model that is still loading
+MODEL_WAIT_SECONDS = float(os.environ.get("R2D2_MODEL_WAIT", "30"))
+
+# Sampled replies are only cached with a fixed seed, unless the operator opts in here
+CACHE_SAMPLED = os.environ.get("R2D2_CACHE_SAMPLED", "0") == "1"
+response_cache = cache_from_env(os.environ)
+# Identical deterministic requests arriving while one is generating share that generation
+coalescer = Coalescer() if os.environ.get("R2D2_COALESCE", "1") != "0" else None
+# R2D2_RECORD_WORKLOAD=<path> logs every request's shape and timings for benchmarks/replay.py
+workload = recorder_from_env(os.environ)
+
+def load_model():
+    """Load tokenizer and model; runs on the background loader thread"""
+    global draft_model, pool_setup
+    logger.info("Loading DeepSeek Coder model...")
+    model_path = MODEL_PATH
+    device_config = select_device()
+    logger.info(f"Loading on {device_config.describe()}")
     tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
-    model = AutoModelForCausalLM.from_pretrained(
-        model_path, 
-        trust_remote_code=True, 
-        torch_dtype=torch.float16
-    ).to('cuda')
+    if USE_BATCHING and WORKERS > 1 and device_config.device == "cpu":
+        model, prepared_dir = load_pool_model(model_path, device_config)
+        pool_setup = (prepared_dir, device_config)
+    else:
+        if WORKERS > 1:
+            logger.warning("R2D2_WORKERS applies to CPU serving with batching; using one in-process model")
+        model = load_causal_lm(model_path, device_config)
+    if DRAFT_MODEL_PATH:
+        draft_model = load_draft_model(DRAFT_MODEL_PATH, device_config, main_model=model)
     logger.info(f"Model device after loading: {model.device}")
     logger.info(f"CUDA available: {torch.cuda.is_available()}")
     logger.info("Model loaded successfully.")
-except Exception as e:
-    logger.error(f"Failed to load model: {e}")
-    model = None
+    return model, tokenizer
+
+model = None
+tokenizer = None
+draft_model = None
+context_builder = None
+scheduler = None
+adapter_cache = None
+pool_setup = None  # (prepared model dir, DeviceConfig) when serving from a worker pool
+# The paged KV cache shares session prefixes through its own blocks
+prefix_cache = PrefixCache(max_bytes=PREFIX_CACHE_MB * 1024 * 1024) if PREFIX_CACHE_MB > 0 and not KV_BLOCKS else None
+# Reply each chat session is waiting for; cancelled on clear, a new message or a closed tab
+in_flight = SessionReplies()
+
+def _on_model_ready(loaded_model, loaded_tokenizer):
+    global model, tokenizer, context_builder, scheduler, adapter_cache
+    context_builder = ContextBuilder(loaded_tokenizer, max_prompt_tokens=MAX_PROMPT_TOKENS)
+    if pool_setup is not None:
+        # Sessions stick to one worker, so each keeps its share of the prefix cache
+        prepared_dir, device_config = pool_setup
+        scheduler = WorkerPool(
+            prepared_dir, device_config, num_workers=WORKERS,
+            max_batch_size=MAX_BATCH_SIZE, prefix_cache_mb=PREFIX_CACHE_MB // WORKERS, prefill_chunk=PREFILL_CHUNK,
+            adapter_dir=ADAPTER_DIR, max_adapters=MAX_ADAPTERS, kv_blocks=KV_BLOCKS, kv_block_size=KV_BLOCK_SIZE,
+        ).start()
+    else:
+        adapter_cache = adapters_from_env(loaded_model, os.environ)
+        if USE_BATCHING:
+            scheduler = BatchScheduler(
+                loaded_model, loaded_tokenizer, max_batch_size=MAX_BATCH_SIZE,
+                prefix_cache=prefix_cache, adapters=adapter_cache, prefill_chunk=PREFILL_CHUNK,
+                kv_cache=PagedKVCache.for_model(loaded_model, KV_BLOCKS, KV_BLOCK_SIZE) if KV_BLOCKS else None,
+            )
+    tokenizer = loaded_tokenizer
+    model = loaded_model  # Set last: handlers treat a model as "ready"
+
+def _on_model_failed(error):
+    """Unpublish what _on_model_ready set up, so a retry starts from scratch"""
+    global model, tokenizer, context_builder, scheduler, adapter_cache
+    model = None  # First: handlers stop treating the app as ready
+    if scheduler is not None:
+        scheduler.close()
+    scheduler = tokenizer = adapter_cache = context_builder = None
+
+def _warm_up(loaded_model, loaded_tokenizer):
+    """Warm kernels per prompt-length bucket and precompute the example answers"""
+    if not USE_WARMUP:
+        return
+    answer_example = None
+    if response_cache is not None:
+        def answer_example(prompt):
+            params = example_params(DEFAULT_MAX_TOKENS)
+            key = request_key(prompt, [], params, None)
+            for _ in stream_reply(prompt, [], params, key):
+                pass
+            if response_cache.get(key) is not None:
+                _warm_example_keys.add(key)
+    warm_up(
+        loaded_model,
+        loaded_tokenizer,
+        scheduler=scheduler,
+        max_prompt_tokens=MAX_PROMPT_TOKENS,
+        examples=EXAMPLE_PROMPTS,
+        answer_example=answer_example,
+    )
+
+model_holder = ModelHolder(load_model, on_ready=[_on_model_ready, _warm_up], on_failure=_on_model_failed)
 
 # Example prompts for users
 EXAMPLE_PROMPTS = [
@@ -46,59 +195,362 @@ EXAMPLE_PROMPTS = [
     "Explain what a closure is with examples",
     "Write a quick sort algorithm in Python",
 ]
+_EXAMPLE_KEYS = {normalize_prompt(prompt) for prompt in EXAMPLE_PROMPTS}
+# Response-cache keys of the greedy example answers warm-up precomputed
+_warm_example_keys = set()
 
-def generate_code(message: str, history: List[Tuple[str, str]], temperature: float = 0.2, max_tokens: int = 512) -> str:
+# Text that marks the model starting the next user turn, plus any R2D2_STOP_SEQUENCES
+STOP_SEQUENCES = stop_sequences_from_env(os.environ, ("\nUser:",))
+
+def generation_params_for(temperature: float, max_tokens: int) -> dict:
+    """Generation settings for one request; temperature 0 decodes greedily"""
+    if temperature <= 0:
+        return example_params(max_tokens)
+    return dict(
+        max_new_tokens=min(max_tokens, 512),
+        temperature=temperature,
+        top_p=0.95,
+        repetition_penalty=1.2,  # Reduce repetition
+        do_sample=True,
+    )
+
+def example_params(max_tokens: int) -> dict:
+    """Greedy settings warm-up answers the example prompts with"""
+    return dict(max_new_tokens=min(max_tokens, 512), repetition_penalty=1.2, do_sample=False)
+
+def warm_example_reply(
+    message: str, history: List[Tuple[str, str]], generation_params: dict, adapter: Optional[str]
+) -> Optional[str]:
+    """Warm-up's answer when `message` is a fresh example prompt asked with warm-up's greedy settings, else None"""
+    if history or adapter or response_cache is None or normalize_prompt(message) not in _EXAMPLE_KEYS:
+        return None
+    if generation_params != example_params(generation_params["max_new_tokens"]):
+        return None
+    key = request_key(message, history, generation_params, None)
+    if key not in _warm_example_keys:
+        return None
+    return response_cache.get(key)
+
+def request_key(
+    message: str,
+    history: List[Tuple[str, str]],
+    generation_params: dict,
+    seed: Optional[int],
+    adapter: Optional[str] = None,
+) -> str:
+    """Identity of a reply, shared by the response cache and in-flight coalescing"""
+    model_id = f"{MODEL_PATH}+{adapter}" if adapter else MODEL_PATH
+    return make_key(message, history, dict(generation_params, seed=seed, model=model_id))
+
+def shared_reply(
+    reply: Callable[..., Iterator[str]],
+    key: Optional[str],
+    cancel: Optional[CancelToken] = None,
+) -> Tuple[Iterator[str], bool]:
+    """
+    Run reply(cancel=...), or join the identical generation already running for `key`.
+    
+    Args:
+        reply: stream_reply with every argument but `cancel` bound
+        key: request_key of a deterministic request; None never shares
+        cancel: This caller's token; the shared generation only stops once all its callers are gone
+    
+    Returns:
+        (stream, joined) tuple; joined is True when another request's generation is being shared
+    """
+    if coalescer is None or key is None:
+        return reply(cancel=cancel), False
+    flight, started = coalescer.join(key, lambda shared: reply(cancel=shared))
+    return flight.stream(cancel), not started
+
+def cached_reply(
+    message: str,
+    history: List[Tuple[str, str]],
+    generation_params: dict,
+    seed: Optional[int],
+    cache_sampled: bool,
+    adapter: Optional[str] = None,
+):
+    """
+    Look up a repeated prompt in the response cache.
+    
+    Returns:
+        (cache_key, cached reply) tuple; the key is None when the request is not cacheable
+    """
+    if response_cache is None or not is_cacheable(dict(generation_params, seed=seed), opt_in=cache_sampled):
+        return None, None
+    cache_key = request_key(message, history, generation_params, seed, adapter)
+    return cache_key, response_cache.get(cache_key)
+
+def stream_reply(
+    message: str,
+    history: List[Tuple[str, str]],
+    generation_params: dict,
+    cache_key: Optional[str] = None,
+    session_id: Optional[str] = None,
+    seed: Optional[int] = None,
+    speculative: Optional[str] = None,
+    client_id: Optional[str] = None,
+    record: Optional[RequestRecord] = None,
+    adapter: Optional[str] = None,
+    cancel: Optional[CancelToken] = None,
+) -> Iterator[str]:
+    """
+    Generation path shared by the chat UI and the HTTP API; the model must be loaded.
+    
+    The request waits for an admission slot after its prompt is built, since
+    the prompt length is part of its cost.
+    
+    Args:
+        record: Workload record of this request; gets its token counts and timings
+        adapter: LoRA adapter to answer with (None: the base model)
+        cancel: Stops generation at the next token when cancelled; the partial reply is not cached
+    
+    Yields:
+        The generated response so far (errors are raised, not rendered)
+    
+    Raises:
+        ServerBusy: The admission queue turned the request away
+    """
+    record = record or RequestRecord(None, {})
+    with track_request(ignore=(ServerBusy,)):
+        # Build context from as much recent history as fits the prompt budget
+        max_new_tokens = generation_params["max_new_tokens"]
+        context_window = getattr(model.config, "max_position_embeddings", None) or MAX_PROMPT_TOKENS + max_new_tokens
+        with TOKENIZE.time():
+            prompt_ids = context_builder.build(
+                message,
+                history,
+                session_id=session_id,
+                max_prompt_tokens=min(MAX_PROMPT_TOKENS, context_window - max_new_tokens),
+            )
+        PROMPT_TOKENS.inc(len(prompt_ids))
+        record.prompt_tokens = len(prompt_ids)
+        
+        # Generation starts once admitted; the time before that is reported as queue wait
+        cost = len(prompt_ids) + max_new_tokens
+        with admission.admit(client_id or session_id, cost):
+            record.admitted()
+            if cancel is not None and cancel.cancelled:
+                # Abandoned while waiting for a slot: nothing was computed yet
+                record_cancelled(len(prompt_ids), max_new_tokens)
+                return
+            # Generate with temperature control, stopping once the next user turn starts
+            stop_sequences = with_eos_text(tokenizer, STOP_SEQUENCES)
+            speculative = speculative or SPECULATIVE_MODE
+            active_adapter = nullcontext()
+            # Adapter requests always go through the scheduler, where they share the batch, and so
+            # do long prompts, which it prefills in chunks instead of stalling everyone else's replies
+            long_prompt = PREFILL_CHUNK and len(prompt_ids) > PREFILL_CHUNK
+            if scheduler is not None and (speculative == "off" or adapter or long_prompt):
+                handle = scheduler.submit(
+                    prompt_ids, session_id=session_id, seed=seed, stop_sequences=stop_sequences,
+                    adapter=adapter, **generation_params,
+                )
+                if cancel is not None:
+                    cancel.on_cancel(handle.cancel)
+                stream = stream_handle(handle, tokenizer, stop_sequences)
+            else:
+                handle = None
+                if adapter:
+                    if adapter_cache is None:
+                        raise ValueError(f"No LoRA adapters are served (looked in {ADAPTER_DIR})")
+                    active_adapter = adapter_cache.active(adapter)
+                if seed is not None:
+                    torch.manual_seed(seed)
+                stopped = threading.Event()
+                if cancel is not None:
+                    cancel.on_cancel(lambda reason: stopped.set())
+                # Speculative requests run on their own: drafts are verified one sequence at a time.
+                # They hold the scheduler's model lock, so batch steps wait instead of overlapping them
+                input_ids = torch.tensor([prompt_ids], device=model.device)
+                stream = stream_generate(
+                    model,
+                    tokenizer,
+                    input_ids,
+                    stop_sequences=stop_sequences,
+                    lock=getattr(scheduler, "model_lock", None),
+                    stopping_criteria=[EventStoppingCriteria(stopped)],
+                    **generation_params,
+                    **speculative_kwargs(speculative, draft_model),
+                )
+            
+            response = ""
+            with active_adapter:
+                for response in stream:
+                    if response.strip():
+                        model_holder.mark_first_token()
+                        record.first_token()
+                        yield response.strip()
+        
+        cancelled = cancel is not None and cancel.cancelled
+        if handle is not None:
+            record.completion_tokens = len(handle.output_ids)
+        elif workload.enabled or cancelled:
+            record.completion_tokens = len(tokenizer(response, add_special_tokens=False).input_ids)
+        if cancelled:
+            # The scheduler accounts for its own rows; model.generate stopped here
+            if handle is None:
+                record_cancelled(0, max(0, max_new_tokens - record.completion_tokens))
+            return
+        with POSTPROCESS.time():
+            reply = response.strip()
+            if reply and cache_key is not None:
+                response_cache.put(cache_key, reply)
+
+def generate_code(
+    message: str,
+    history: List[Tuple[str, str]],
+    temperature: float = 0.2,
+    max_tokens: int = 512,
+    session_id: Optional[str] = None,
+    seed: Optional[int] = None,
+    cache_sampled: bool = CACHE_SAMPLED,
+    speculative: Optional[str] = None,
+    adapter: Optional[str] = None,
+    cancel: Optional[CancelToken] = None,
+) -> Iterator[str]:
     """
     Generate code or text response with temperature and token control.
     
+    Tokens are streamed from a background generation thread, so the first
+    partial reply is available after a single forward pass.
+    
     Args:
         message: User's input message
         history: Chat history for context
         temperature: Sampling temperature (0.2 for focused output)
         max_tokens: Maximum tokens to generate (up to 512)
+        session_id: Chat session, lets the scheduler reuse the KV cache of the previous turn
+        seed: Fixed sampling seed; makes the reply reproducible and therefore cacheable
+        cache_sampled: Cache the sampled reply even without a seed
+        speculative: Speculative decoding mode for this request (defaults to R2D2_SPECULATIVE)
+        adapter: LoRA adapter from R2D2_ADAPTER_DIR to answer with (None: the base model)
+        cancel: Token the UI cancels when the reply is no longer wanted; the stream then just ends
     
-    Returns:
-        Generated text response
+    Yields:
+        The generated response so far
     """
+    generation_params = generation_params_for(temperature, max_tokens)
+    adapter = None if adapter in (None, "", BASE_MODEL_CHOICE) else adapter
+    record = workload.request(
+        "chat", message, len(history), generation_params, session_id, speculative=speculative, adapter=adapter
+    )
+    
+    # Repeated prompts are answered from the response cache, example prompts from warm-up's answers
+    cache_key, cached = cached_reply(message, history, generation_params, seed, cache_sampled, adapter)
+    if cached is None:
+        cached = warm_example_reply(message, history, generation_params, adapter)
+    if cached is not None:
+        record.finish(cached=True)
+        yield cached
+        return
+    
     if model is None:
-        return "❌ **Model not loaded.** Error during initialization. Please check the logs."
+        if model_holder.loading:
+            yield "⏳ **Model is warming up...** Your message will be answered as soon as it is loaded."
+        if not model_holder.wait(MODEL_WAIT_SECONDS):
+            record.finish("unavailable")
+            if model_holder.loading:
+                yield "⏳ **Model is still warming up.** Please resend your message in a few seconds."
+            else:
+                model_holder.retry()
+                yield "❌ **Model not loaded.** Error during initialization. A reload has been scheduled, please check the logs."
+            return
     
+    status = "cancelled"  # Kept if the client goes away mid-stream or the reply is cancelled
+    joined = False
     try:
-        # Build context from history
-        context = ""
-        for user_msg, bot_msg in history[-5:]:  # Keep last 5 exchanges for context
-            context += f"User: {user_msg}\n"
-            context += f"Assistant: {bot_msg}\n\n"
-        
-        # Prepare full prompt
-        full_prompt = context + f"User: {message}\nAssistant:"
-        
-        # Tokenize
-        input_ids = tokenizer(full_prompt, return_tensors="pt").input_ids.to(model.device)
-        
-        # Generate with temperature control
-        with torch.no_grad():
-            output = model.generate(
-                input_ids,
-                max_new_tokens=min(max_tokens, 512),
-                temperature=temperature,
-                top_p=0.95,
-                repetition_penalty=1.2,  # Reduce repetition
-                do_sample=True,
-            )
-        
-        # Decode
-        generated_text = tokenizer.decode(output[0], skip_special_tokens=True)
-        response = generated_text[len(full_prompt):].strip()
-        
-        # Clean up response
-        response = response.split('\n\nUser:')[0]  # Remove next user prompt if included
+        response = ""
+        # Deterministic requests identical to one in flight share its generation
+        key = request_key(message, history, generation_params, seed, adapter)
+        replies, joined = shared_reply(
+            partial(
+                stream_reply, message, history, generation_params, cache_key,
+                session_id=session_id, seed=seed, speculative=speculative, record=record, adapter=adapter,
+            ),
+            key if is_cacheable(dict(generation_params, seed=seed)) else None,
+            cancel,
+        )
+        for response in replies:
+            if joined:
+                record.first_token()
+            yield response
+        if cancel is not None and cancel.cancelled:
+            return
+        status = "ok"
         
-        return response if response else "I'm having trouble generating a response. Try rephrasing your question."
+        if not response:
+            yield "I'm having trouble generating a response. Try rephrasing your question."
         
+    except ServerBusy as e:
+        status = "busy"
+        yield f"🚦 **Server busy.** {e}. Please retry in {e.retry_after:.0f} s."
     except Exception as e:
+        status = "error"
         logger.error(f"Error during inference: {e}", exc_info=True)
-        return f"❌ **Error during generation:** {str(e)[:200]}"
+        yield f"❌ **Error during generation:** {str(e)[:200]}"
+    finally:
+        record.finish(status, coalesced=joined)
+
+def api_backend(request: CompletionRequest) -> Iterator[str]:
+    """HTTP API entry point: same cache and generation path as generate_code, with errors raised instead of rendered"""
+    generation_params = generation_params_for(request.temperature, request.max_tokens)
+    if request.temperature <= 0:
+        generation_params = dict(max_new_tokens=generation_params["max_new_tokens"], repetition_penalty=1.2, do_sample=False)
+    record = workload.request(
+        "api", request.message, len(request.history), generation_params, request.session_id, adapter=request.adapter
+    )
+    cache_key, cached = cached_reply(
+        request.message, request.history, generation_params, request.seed, CACHE_SAMPLED, request.adapter
+    )
+    if cached is not None:
+        record.finish(cached=True)
+        if tokenizer is not None and len(tokenizer(cached, add_special_tokens=False).input_ids) >= generation_params["max_new_tokens"]:
+            request.finish_reason = "length"
+        yield cached
+        return
+    if model is None and not model_holder.wait(MODEL_WAIT_SECONDS):
+        record.finish("unavailable")
+        if model_holder.loading:
+            raise Unavailable("Model is still loading", retry_after=MODEL_WAIT_SECONDS)
+        model_holder.retry()
+        raise Unavailable("Model failed to load; a reload has been scheduled", retry_after=model_holder.retry_interval)
+    status = "cancelled"
+    joined = False
+    try:
+        key = request_key(request.message, request.history, generation_params, request.seed, request.adapter)
+        replies, joined = shared_reply(
+            partial(
+                stream_reply,
+                request.message,
+                request.history,
+                generation_params,
+                cache_key,
+                session_id=request.session_id,
+                seed=request.seed,
+                client_id=request.client_id,
+                record=record,
+                adapter=request.adapter,
+            ),
+            key if is_cacheable(dict(generation_params, seed=request.seed)) else None,
+        )
+        reply = ""
+        for reply in replies:
+            yield reply
+        status = "ok"
+        # Exact for this request's own scheduler rows; joined or model.generate replies are re-tokenized
+        tokens = record.completion_tokens or len(tokenizer(reply, add_special_tokens=False).input_ids)
+        if tokens >= generation_params["max_new_tokens"]:
+            request.finish_reason = "length"
+    except ServerBusy as e:
+        status = "busy"
+        raise Unavailable(str(e), retry_after=e.retry_after)
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        record.finish(status, coalesced=joined)
 
 # Create custom CSS for Cursor-inspired dark theme
 custom_css = """
@@ -244,9 +696,9 @@ p {
 """
 
 # Create the Gradio chat interface
-def chat_interface(message: str, history: List[Tuple[str, str]]) -> str:
+def chat_interface(message: str, history: List[Tuple[str, str]]) -> Iterator[str]:
     """Wrapper function for Gradio chatbot"""
-    return generate_code(message, history)
+    yield from generate_code(message, history)
 
 # Build the app with custom theme
 with gr.Blocks(css=custom_css, theme=gr.themes.Soft(primary_hue="blue")) as demo:
@@ -317,34 +769,67 @@ with gr.Blocks(css=custom_css, theme=gr.themes.Soft(primary_hue="blue")) as demo
     with gr.Accordion("⚙️ Model Parameters", open=False):
         with gr.Row():
             temperature = gr.Slider(
-                minimum=0.1,
+                minimum=0.0,
                 maximum=1.0,
-                value=0.2,
+                value=DEFAULT_TEMPERATURE,
                 step=0.1,
-                label="Temperature (Lower = More Focused)",
+                label="Temperature (Lower = More Focused, 0 = Greedy)",
             )
             max_tokens = gr.Slider(
                 minimum=64,
                 maximum=512,
-                value=256,
+                value=DEFAULT_MAX_TOKENS,
                 step=32,
                 label="Max Tokens",
             )
+            speculative = gr.Dropdown(
+                choices=list(SPECULATIVE_MODES),
+                value=SPECULATIVE_MODE,
+                label="Speculative Decoding (ngram = copy spans from the prompt)",
+            )
+            adapter_choice = gr.Dropdown(
+                choices=[BASE_MODEL_CHOICE] + list_adapters(ADAPTER_DIR),
+                value=BASE_MODEL_CHOICE,
+                label="Adapter (LoRA fine-tune)",
+                visible=bool(list_adapters(ADAPTER_DIR)),
+            )
     
     # Chat functionality
-    def process_message(message: str, history: List[Tuple[str, str]], temp: float, tokens: int):
-        """Process user message and generate response"""
+    def process_message(
+        message: str,
+        history: List[Tuple[str, str]],
+        temp: float,
+        tokens: int,
+        spec_mode: str = SPECULATIVE_MODE,
+        adapter: str = BASE_MODEL_CHOICE,
+        request: gr.Request = None,
+    ):
+        """Process user message and stream the response into the chat history"""
         if not message.strip():
-            return history
+            yield history
+            return
         
-        response = generate_code(message, history, temperature=temp, max_tokens=tokens)
-        history.append((message, response))
-        return history
+        context = list(history)
+        history.append((message, ""))
+        session_id = request.session_hash if request is not None else None
+        # A reply this session is still waiting for is superseded by this message
+        cancel = in_flight.start(session_id)
+        try:
+            for response in generate_code(
+                message, context, temperature=temp, max_tokens=tokens, session_id=session_id,
+                speculative=spec_mode, adapter=adapter, cancel=cancel,
+            ):
+                if cancel.cancelled:
+                    break  # Cleared or superseded: this history is stale
+                history[-1] = (message, response)
+                yield history
+        finally:
+            in_flight.finish(session_id, cancel)
     
     # Event handlers
     send_button.click(
         process_message,
-        inputs=[message_input, chatbot, temperature, max_tokens],
+        inputs=[message_input, chatbot, temperature, max_tokens, speculative, adapter_choice],
         outputs=[chatbot],
     ).then(
         lambda: "",
@@ -353,14 +838,37 @@ with gr.Blocks(css=custom_css, theme=gr.themes.Soft(primary_hue="blue")) as demo
     
     message_input.submit(
         process_message,
-        inputs=[message_input, chatbot, temperature, max_tokens],
+        inputs=[message_input, chatbot, temperature, max_tokens, speculative, adapter_choice],
         outputs=[chatbot],
     ).then(
         lambda: "",
         outputs=[message_input],
     )
     
-    clear_button.click(lambda: [], outputs=[chatbot])
+    def release_session(session_id: str, reason: str):
+        """Stop the session's reply in flight, then release its cached KV"""
+        # Cancel first, so the finishing row cannot store its KV again after the drop
+        in_flight.cancel(session_id, reason)
+        if prefix_cache is not None:
+            prefix_cache.drop(session_id)
+        if isinstance(scheduler, WorkerPool):
+            # The session's KV lives in the prefix cache of the worker it was routed to
+            scheduler.release(session_id)
+        if context_builder is not None:
+            context_builder.reset(session_id)
+    
+    def clear_chat(request: gr.Request = None):
+        """Clear the chat, stopping the reply still being generated"""
+        if request is not None:
+            release_session(request.session_hash, CLEARED)
+        return []
+    
+    def close_session(request: gr.Request):
+        """The tab was closed or reloaded: nobody will read the reply"""
+        release_session(request.session_hash, DISCONNECTED)
+    
+    clear_button.click(clear_chat, outputs=[chatbot])
+    demo.unload(close_session)
     
     # Copy functionality (note: Gradio has limited clipboard access)
     copy_button.click(
@@ -375,11 +883,32 @@ with gr.Blocks(css=custom_css, theme=gr.themes.Soft(primary_hue="blue")) as demo
     </div>
     """)
 
+# Start loading only now: the on_ready callbacks use everything defined above
+model_holder.start()
+
 if __name__ == "__main__":
-    logger.info("Starting Gradio chat interface on 0.0.0.0:7860 with share=True")
+    parser = server_arg_parser("DeepSeek Coder chat interface", default_port=7860, metrics_port=METRICS_PORT)
+    parser.add_argument("--api-port", type=int, default=API_PORT, help="OpenAI-compatible API port (R2D2_API_PORT, 0 disables)")
+    args = parser.parse_args()
+    if args.metrics_port:
+        start_http_server(args.metrics_port, profiling=PROFILER_ENDPOINT, health=model_holder.health)
+    if args.api_port:
+        ApiServer(
+            api_backend,
+            model_name=os.path.basename(MODEL_PATH),
+            port=args.api_port,
+            max_concurrency=admission.max_active + admission.max_queued,
+            adapter_names=lambda: list_adapters(ADAPTER_DIR),
+        ).start()
+    logger.info(f"Starting Gradio chat interface on {args.host}:{args.port} with share={args.share}")
+    # Handlers run as soon as a worker is free; admission decides who waits and who is turned away
+    demo.queue(default_concurrency_limit=admission.max_active + admission.max_queued, max_size=admission.max_queued)
     demo.launch(
-        server_name="0.0.0.0",
-        server_port=7860,
-        share=True,
+        server_name=args.host,
+        server_port=args.port,
+        share=args.share,
         show_error=True,
+        prevent_thread_lock=True,
     )
+    model_holder.mark_bound()
+    demo.block_thread()
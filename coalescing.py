@@ -0,0 +1,156 @@
+"""
+In-flight request coalescing (singleflight)
+Identical deterministic requests that arrive while one is already generating
+attach to it instead of starting their own: one generation runs, and every
+caller gets its text stream and final reply.
+"""
+
+import logging
+import threading
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from cancellation import DISCONNECTED, CancelToken
+from metrics import counter
+
+logger = logging.getLogger("deepseek_coalescing")
+
+COALESCED = counter("r2d2_coalesced_total", "Requests answered by an identical generation already in flight")
+
+
+class Flight:
+    """
+    One shared generation; each caller reads it with stream() or result().
+
+    The generation is cancelled (through `cancel`) only once every caller has
+    given up on it.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.cancel = CancelToken()
+        self.text = ""
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.callers = 1
+        self._version = 0
+        self._abandoned = False
+        self._cond = threading.Condition()
+
+    def stream(self, cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        """
+        The reply so far, each time it grows, until the generation ends.
+
+        Args:
+            cancel: This caller's token; cancelling it (or closing the
+                iterator early) detaches the caller without affecting the others
+        """
+        caller = cancel or CancelToken()
+        caller.on_cancel(self._leave)
+        seen = 0
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._version != seen or self.done or caller.cancelled)
+                    version, text, done = self._version, self.text, self.done
+                if caller.cancelled:
+                    return
+                if version != seen:
+                    seen = version
+                    yield text
+                if done:
+                    break
+        finally:
+            if not self.done:
+                caller.cancel(DISCONNECTED)
+        if self.error is not None:
+            raise self.error
+
+    def result(self) -> str:
+        """Block until the generation ends and return the full reply"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+    def _attach(self) -> bool:
+        with self._cond:
+            if self._abandoned or self.done:
+                return False
+            self.callers += 1
+            return True
+
+    def _leave(self, reason: str):
+        with self._cond:
+            self.callers -= 1
+            last = self.callers == 0 and not self.done
+            self._abandoned = self._abandoned or last
+            self._cond.notify_all()
+        if last:
+            self.cancel.cancel(reason)
+
+    def _publish(self, text: str):
+        with self._cond:
+            self.text = text
+            self._version += 1
+            self._cond.notify_all()
+
+    def _finish(self, error: Optional[BaseException]):
+        with self._cond:
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+
+
+class Coalescer:
+    """Runs at most one generation per request key; later identical requests share it"""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self._stats = {"generations": 0, "coalesced": 0}
+
+    def join(self, key: str, generate: Callable[[CancelToken], Iterator[str]]) -> Tuple[Flight, bool]:
+        """
+        Attach to the generation running for `key`, or start one.
+
+        Args:
+            key: Identity of the request; only deterministic requests may share one
+            generate: Called as generate(cancel) on a new thread when no generation
+                is running; yields the reply so far and stops once cancel is cancelled
+
+        Returns:
+            (flight, started) tuple; started is False when the caller joined a running generation
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight._attach():
+                self._stats["coalesced"] += 1
+                COALESCED.inc()
+                return flight, False
+            flight = Flight(key)
+            self._flights[key] = flight
+            self._stats["generations"] += 1
+        threading.Thread(target=self._run, args=(flight, generate), name="coalesced-generation", daemon=True).start()
+        return flight, True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._flights))
+
+    def _run(self, flight: Flight, generate: Callable[[CancelToken], Iterator[str]]):
+        error = None
+        replies = generate(flight.cancel)
+        try:
+            for text in replies:
+                flight._publish(text)
+                if flight.cancel.cancelled:
+                    break
+        except Exception as e:
+            error = e
+        finally:
+            replies.close()
+            with self._lock:
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+            flight._finish(error)
@@ -0,0 +1,138 @@
+"""
+Token-budget-aware chat context builder
+Replaces the fixed history[-5:] slice with a window measured in tokens.
+Each rendered turn is tokenized once and cached, and the window start only
+moves when it has to, so the prompt prefix stays stable for the KV cache.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Tuple
+
+
+def render_turn(user_msg: str, bot_msg: str) -> str:
+    return f"User: {user_msg}\nAssistant: {bot_msg}\n\n"
+
+
+def render_message(message: str) -> str:
+    return f"User: {message}\nAssistant:"
+
+
+class ContextBuilder:
+    """
+    Build prompt token ids from chat history under a token budget.
+
+    Args:
+        tokenizer: Tokenizer used for the prompt
+        max_prompt_tokens: Default prompt budget (history + new message)
+        low_water: When the window has to move, history is trimmed to this
+            fraction of the budget so the next few turns keep the same prefix
+        max_cached_turns: LRU bound on cached per-turn token ids
+        max_sessions: LRU bound on remembered per-session window starts
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        max_prompt_tokens: int = 2048,
+        low_water: float = 0.75,
+        max_cached_turns: int = 4096,
+        max_sessions: int = 1024,
+    ):
+        self.tokenizer = tokenizer
+        self.max_prompt_tokens = max_prompt_tokens
+        self.low_water = low_water
+        self.max_cached_turns = max_cached_turns
+        self.max_sessions = max_sessions
+        # Special tokens the tokenizer puts in front of a prompt (usually BOS)
+        self._prefix_ids = tokenizer("").input_ids
+        self._turn_ids: "OrderedDict[str, List[int]]" = OrderedDict()
+        self._window_start: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"turns_tokenized": 0, "turn_cache_hits": 0, "window_moves": 0}
+
+    def _encode(self, text: str) -> List[int]:
+        return self.tokenizer(text, add_special_tokens=False).input_ids
+
+    def _turn_tokens(self, text: str) -> List[int]:
+        with self._lock:
+            ids = self._turn_ids.get(text)
+            if ids is not None:
+                self._turn_ids.move_to_end(text)
+                self._stats["turn_cache_hits"] += 1
+                return ids
+        ids = self._encode(text)
+        with self._lock:
+            self._turn_ids[text] = ids
+            self._stats["turns_tokenized"] += 1
+            while len(self._turn_ids) > self.max_cached_turns:
+                self._turn_ids.popitem(last=False)
+        return ids
+
+    def build(
+        self,
+        message: str,
+        history: List[Tuple[str, str]],
+        session_id: Optional[Hashable] = None,
+        max_prompt_tokens: Optional[int] = None,
+    ) -> List[int]:
+        """
+        Assemble prompt token ids for `message` after as much history as fits.
+
+        Without a session the newest turns that fit are kept. With a session the
+        previous window start is reused while the prompt still fits, and moved
+        forward past several turns at once when it does not.
+
+        Returns:
+            Prompt token ids, including the tokenizer's leading special tokens
+        """
+        budget = max_prompt_tokens or self.max_prompt_tokens
+        message_ids = self._encode(render_message(message))
+        # A single oversized message keeps its most recent tokens
+        room = budget - len(self._prefix_ids)
+        if len(message_ids) >= room:
+            return self._prefix_ids + message_ids[-room:]
+
+        turns = [self._turn_tokens(render_turn(u, b)) for u, b in history]
+        room -= len(message_ids)
+
+        # Newest-first fill: earliest turn index whose suffix still fits in `limit`
+        def earliest_fitting(limit: int) -> int:
+            used, start = 0, len(turns)
+            while start > 0 and used + len(turns[start - 1]) <= limit:
+                start -= 1
+                used += len(turns[start])
+            return start
+
+        start = earliest_fitting(room)
+        if session_id is not None:
+            with self._lock:
+                previous = self._window_start.get(session_id, 0)
+            if previous > len(turns):
+                previous = 0  # History was cleared or replaced
+            if previous >= start:
+                start = previous
+            else:
+                start = earliest_fitting(int(room * self.low_water))
+                with self._lock:
+                    self._stats["window_moves"] += 1
+            with self._lock:
+                self._window_start[session_id] = start
+                self._window_start.move_to_end(session_id)
+                while len(self._window_start) > self.max_sessions:
+                    self._window_start.popitem(last=False)
+
+        ids = list(self._prefix_ids)
+        for turn in turns[start:]:
+            ids.extend(turn)
+        ids.extend(message_ids)
+        return ids
+
+    def reset(self, session_id: Hashable):
+        """Forget a session's window, e.g. when its chat is cleared"""
+        with self._lock:
+            self._window_start.pop(session_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, cached_turns=len(self._turn_ids), sessions=len(self._window_start))
@@ -0,0 +1,223 @@
+"""
+Device and precision selection shared by app.py and chat_app.py
+Uses CUDA in float16 when available, otherwise a CPU path in bfloat16/float32
+with optional dynamic int8 quantization of the Linear layers.
+"""
+
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import torch
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("deepseek_device")
+
+_DTYPES = {"fp16": torch.float16, "bf16": torch.bfloat16, "fp32": torch.float32}
+
+
+@dataclass
+class DeviceConfig:
+    """Where and in what precision the model runs"""
+    device: str
+    dtype: torch.dtype
+    quantize_int8: bool = False
+    threads: Optional[int] = None
+
+    def describe(self) -> str:
+        precision = "int8 (dynamic)" if self.quantize_int8 else str(self.dtype).replace("torch.", "")
+        threads = f", {self.threads} threads" if self.threads else ""
+        return f"{self.device} / {precision}{threads}"
+
+
+def allowed_cores() -> List[int]:
+    """IDs of the CPU cores this process may run on (respects affinity masks and cgroup pinning)"""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS/Windows
+        return list(range(os.cpu_count() or 1))
+
+
+def available_cores() -> int:
+    """CPU cores this process may actually run on"""
+    return len(allowed_cores())
+
+
+def cpu_supports_bf16() -> bool:
+    """True when the CPU has native bfloat16 matmul support (AVX512-BF16 or AMX)"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def select_device(
+    device: Optional[str] = None,
+    cpu_dtype: Optional[str] = None,
+    quantize_int8: Optional[bool] = None,
+) -> DeviceConfig:
+    """
+    Pick device and precision from arguments, environment and hardware.
+
+    Args:
+        device: "cuda", "cpu" or "auto" (default: R2D2_DEVICE or auto)
+        cpu_dtype: "bf16", "fp32" or "auto" for the CPU path (default: R2D2_CPU_DTYPE or auto)
+        quantize_int8: Dynamic int8 Linear layers on CPU (default: R2D2_CPU_INT8=1)
+
+    Returns:
+        DeviceConfig for load_causal_lm()
+    """
+    device = (device or os.environ.get("R2D2_DEVICE", "auto")).lower()
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if device.startswith("cuda"):
+        return DeviceConfig(device=device, dtype=torch.float16)
+
+    if quantize_int8 is None:
+        quantize_int8 = os.environ.get("R2D2_CPU_INT8", "0") == "1"
+    cpu_dtype = (cpu_dtype or os.environ.get("R2D2_CPU_DTYPE", "auto")).lower()
+    if quantize_int8:
+        dtype = torch.float32  # quantize_dynamic expects float32 weights
+    elif cpu_dtype == "auto":
+        dtype = torch.bfloat16 if cpu_supports_bf16() else torch.float32
+    else:
+        dtype = _DTYPES[cpu_dtype]
+    threads = int(os.environ.get("R2D2_CPU_THREADS", "0")) or available_cores()
+    return DeviceConfig(device="cpu", dtype=dtype, quantize_int8=quantize_int8, threads=threads)
+
+
+def configure_threads(config: DeviceConfig):
+    """Size torch's intra-op pool to the cores we really have"""
+    if config.threads:
+        torch.set_num_threads(config.threads)
+
+
+def prepare_model(model, config: DeviceConfig):
+    """Cast, move and optionally quantize an already-built model"""
+    model = model.to(device=config.device, dtype=config.dtype)
+    if config.quantize_int8:
+        try:
+            from torch.ao.quantization import quantize_dynamic
+        except ImportError:
+            logger.warning("Dynamic quantization is not available in this torch build; using float32")
+        else:
+            model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model.eval()
+
+
+def _rss_mb() -> float:
+    """Current resident memory; 0.0 where there is no /proc (macOS/Windows)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return 0.0
+
+
+def _peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024  # Bytes on macOS, KB on Linux
+
+
+class LoadReport:
+    """Wall time, RSS after and peak RSS of each model-loading stage, logged as one line"""
+
+    def __init__(self):
+        self.stages: List[Tuple[str, float, float, float]] = []
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        yield
+        self.stages.append((name, time.perf_counter() - started, _rss_mb(), _peak_rss_mb()))
+
+    def log(self, source: str):
+        parts = [
+            f"{name} {seconds:.2f}s (rss {rss:.0f} MB, peak {peak:.0f} MB)" for name, seconds, rss, peak in self.stages
+        ]
+        total = sum(stage[1] for stage in self.stages)
+        gpu = ""
+        if torch.cuda.is_available():
+            gpu = f", gpu peak {torch.cuda.max_memory_allocated() / 2**20:.0f} MB"
+        logger.info(f"Loaded {source} in {total:.2f}s: " + "; ".join(parts) + gpu)
+
+
+def load_causal_lm(model_path: str, config: DeviceConfig):
+    """
+    Load a causal LM for the given device config.
+
+    Uses the pre-converted copy from model_cache when one is current for this
+    dtype: its weights are memory-mapped as stored, with no cast or host copy.
+    """
+    from transformers import AutoModelForCausalLM
+
+    from model_cache import find_prepared
+
+    configure_threads(config)
+    report = LoadReport()
+    prepared = find_prepared(model_path, config.dtype) if os.path.isdir(model_path) else None
+    source = prepared or model_path
+    kwargs = {"trust_remote_code": True, "torch_dtype": config.dtype, "low_cpu_mem_usage": True}
+    if config.device.startswith("cuda"):
+        # Tensors go from the mapped file straight to the GPU
+        kwargs["device_map"] = config.device
+    with report.stage("weights"):
+        model = AutoModelForCausalLM.from_pretrained(source, **kwargs)
+    with report.stage("prepare"):
+        model = prepare_model(model, config)
+    report.log(source if prepared else f"{model_path} (not prepared, see python -m model_cache)")
+    return model
+
+
+def load_mmap_causal_lm(model_path: str, weights_path: str, config: DeviceConfig):
+    """
+    Build the model from its config and point its parameters at a memory-mapped
+    safetensors file (see model_cache.prepare).
+
+    The weights stay in the page cache, shared by every process that maps the
+    same file; only int8 quantization (if enabled) makes a private copy.
+    """
+    from safetensors.torch import load_file
+    from transformers import AutoConfig, AutoModelForCausalLM
+
+    try:
+        from transformers.modeling_utils import no_init_weights
+    except ImportError:  # transformers >= 5
+        from transformers.initialization import no_init_weights
+
+    configure_threads(config)
+    report = LoadReport()
+    model_config = AutoConfig.from_pretrained(model_path, trust_remote_code=True)
+    # Skipping init leaves the placeholder tensors untouched, so they never become resident
+    with report.stage("weights"):
+        with no_init_weights():
+            model = AutoModelForCausalLM.from_config(model_config, trust_remote_code=True, torch_dtype=config.dtype)
+        state = load_file(weights_path)
+    # Tied parameters (e.g. embeddings / lm_head) are stored once; give every alias the same tensor
+    aliases = {}
+    for name, param in model.named_parameters(remove_duplicate=False):
+        aliases.setdefault(id(param), []).append(name)
+    for names in aliases.values():
+        stored = next((state[name] for name in names if name in state), None)
+        if stored is not None:
+            for name in names:
+                state.setdefault(name, stored)
+    missing, unexpected = model.load_state_dict(state, strict=False, assign=True)
+    if missing or unexpected:
+        logger.warning(f"Shared weights mismatch: missing {missing[:5]}, unexpected {unexpected[:5]}")
+    with report.stage("prepare"):
+        model = prepare_model(model, config)
+    report.log(weights_path)
+    return model
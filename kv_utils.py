@@ -0,0 +1,71 @@
+"""
+KV-cache helpers shared by the inference scheduler
+Works on the legacy ((key, value), ...) layout so batches can be padded, merged and split
+"""
+
+from typing import Optional, Sequence, Tuple
+
+import torch
+
+# One (key, value) pair per layer, each shaped [batch, heads, seq_len, head_dim]
+LegacyCache = Tuple[Tuple[torch.Tensor, torch.Tensor], ...]
+
+try:
+    from transformers import DynamicCache
+except ImportError:  # transformers < 4.36 only understands tuples
+    DynamicCache = None
+
+
+def to_legacy(past) -> Optional[LegacyCache]:
+    """Convert whatever the model returned as past_key_values into legacy tuples"""
+    if past is None:
+        return None
+    if isinstance(past, (tuple, list)):
+        return tuple((layer[0], layer[1]) for layer in past)
+    layers = getattr(past, "layers", None)
+    if layers is not None:
+        return tuple((layer.keys, layer.values) for layer in layers)
+    return past.to_legacy_cache()
+
+
+def from_legacy(cache: Optional[LegacyCache]):
+    """Wrap legacy tuples in the cache object the installed transformers expects"""
+    if cache is None or DynamicCache is None:
+        return cache
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(cache)
+    return DynamicCache(cache)
+
+
+def cache_length(cache: LegacyCache) -> int:
+    return cache[0][0].shape[2]
+
+
+def left_pad(cache: LegacyCache, length: int) -> LegacyCache:
+    """Pad the sequence dimension on the left with zeros up to `length`"""
+    pad = length - cache_length(cache)
+    if pad <= 0:
+        return cache
+    return tuple(
+        (torch.nn.functional.pad(k, (0, 0, pad, 0)), torch.nn.functional.pad(v, (0, 0, pad, 0)))
+        for k, v in cache
+    )
+
+
+def cat_batch(caches: Sequence[LegacyCache]) -> LegacyCache:
+    """Concatenate equally long caches along the batch dimension"""
+    return tuple(
+        (torch.cat([c[i][0] for c in caches]), torch.cat([c[i][1] for c in caches]))
+        for i in range(len(caches[0]))
+    )
+
+
+def select_rows(cache: LegacyCache, rows: torch.LongTensor, trim: int = 0) -> LegacyCache:
+    """Keep the given batch rows and drop `trim` leading positions"""
+    return tuple((k[rows, :, trim:], v[rows, :, trim:]) for k, v in cache)
+
+
+def cache_bytes(cache: Optional[LegacyCache]) -> int:
+    if cache is None:
+        return 0
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in cache)
@@ -6,14 +6,16 @@ Supports both simple and chat-based interfaces
 
 import sys
 import os
+import shlex
 import subprocess
 import threading
+from collections import deque
 from pathlib import Path
 
 try:
     from PyQt5.QtWidgets import (
         QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-        QPushButton, QTextEdit, QLabel, QComboBox, QSpinBox, QCheckBox,
+        QPushButton, QPlainTextEdit, QLabel, QComboBox, QSpinBox, QCheckBox,
         QProgressBar, QGroupBox, QFileDialog, QMessageBox
     )
     from PyQt5.QtCore import Qt, pyqtSignal, QThread, QTimer
@@ -22,22 +24,108 @@ except ImportError:
     print("❌ PyQt5 not installed. Install it with: pip install PyQt5")
     sys.exit(1)
 
+from server_args import MODEL_PATH
+from supervisor import Supervisor, format_stats
+
+
+# Lines kept in the log view; the full output is spilled to LOG_FILE
+MAX_VIEW_LINES = 5000
+LOG_FILE = "logs/launcher.log"
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+# The view is refreshed at most this often (~30 frames per second), however fast lines arrive
+LOG_FLUSH_MS = 33
+# Newest lines appended per refresh; appending costs GUI time per line, so floods are thinned
+MAX_LINES_PER_FLUSH = 250
+
+
+class RotatingLogFile:
+    """Append-only text log that rolls over to .1 ... .N when it grows past max_bytes"""
+
+    def __init__(self, path, max_bytes=LOG_FILE_MAX_BYTES, backups=LOG_FILE_BACKUPS):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8", errors="replace")
+        self._size = self._file.tell()
+
+    def write(self, line):
+        self._file.write(line + "\n")
+        self._size += len(line) + 1
+        if self._size >= self.max_bytes:
+            self._rotate()
+
+    def flush(self):
+        self._file.flush()
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{index}")
+            if older.exists():
+                older.replace(self.path.with_name(f"{self.path.name}.{index + 1}"))
+        if self.backups > 0:
+            self.path.replace(self.path.with_name(f"{self.path.name}.1"))
+        self._file = open(self.path, "w", encoding="utf-8", errors="replace")
+        self._size = 0
+
+
+class LogBuffer:
+    """
+    Thread-safe ring buffer between the command threads and the log view.
+
+    Producers push lines at any rate; the GUI drains whatever accumulated once
+    per frame. Lines that fall out of the ring before a drain are only counted
+    for the view, but every line reaches the spill file.
+    """
+
+    def __init__(self, capacity=MAX_LINES_PER_FLUSH, spill=None):
+        self._lines = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._dropped = 0
+        self.spill = spill
+        self.total = 0
+
+    def push(self, line):
+        with self._lock:
+            if len(self._lines) == self._lines.maxlen:
+                self._dropped += 1
+            self._lines.append(line)
+            self.total += 1
+            if self.spill is not None:
+                self.spill.write(line)
+
+    def drain(self):
+        """Return (lines, dropped) accumulated since the last drain"""
+        with self._lock:
+            lines, dropped = list(self._lines), self._dropped
+            self._lines.clear()
+            self._dropped = 0
+        return lines, dropped
+
+    def flush_spill(self):
+        with self._lock:
+            if self.spill is not None:
+                self.spill.flush()
+
 
 class Worker(QThread):
-    """Thread worker for running commands without blocking UI"""
-    log_signal = pyqtSignal(str)
+    """Thread worker for running commands without blocking UI; output goes to a LogBuffer"""
     error_signal = pyqtSignal(str)
     finished_signal = pyqtSignal()
     progress_signal = pyqtSignal(int)
 
-    def __init__(self, command, description=""):
+    def __init__(self, command, description="", log_buffer=None):
         super().__init__()
         self.command = command
         self.description = description
+        self.log_buffer = log_buffer or LogBuffer()
 
     def run(self):
+        log = self.log_buffer.push
         try:
-            self.log_signal.emit(f"\n{'='*60}\n🚀 {self.description}\n{'='*60}\n")
+            log(f"\n{'='*60}\n🚀 {self.description}\n{'='*60}\n")
             
             process = subprocess.Popen(
                 self.command,
@@ -45,15 +133,17 @@ class Worker(QThread):
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
                 text=True,
+                errors="replace",
             )
             
             for line in process.stdout:
-                self.log_signal.emit(line.rstrip('\n'))
+                log(line.rstrip('\n'))
             
             process.wait()
+            self.log_buffer.flush_spill()
             
             if process.returncode == 0:
-                self.log_signal.emit(f"\n✅ {self.description} completed successfully!")
+                log(f"\n✅ {self.description} completed successfully!")
             else:
                 self.error_signal.emit(f"❌ {self.description} failed with code {process.returncode}")
             
@@ -66,11 +156,23 @@ class Worker(QThread):
 class Launcher(QMainWindow):
     """Main launcher GUI"""
 
-    def __init__(self):
+    # Emitted from the supervisor thread; Qt queues it onto the GUI thread
+    server_stats_signal = pyqtSignal(dict)
+
+    def __init__(self, log_path=LOG_FILE):
         super().__init__()
         self.worker = None
+        self.supervisor = None
+        self.log_buffer = LogBuffer(spill=RotatingLogFile(log_path))
+        self.log_path = log_path
         self.init_ui()
         self.setStyleSheet(self._get_stylesheet())
+        # Coalesce log output: one view update per frame instead of one per line
+        self.log_timer = QTimer(self)
+        self.log_timer.setInterval(LOG_FLUSH_MS)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start()
+        self.server_stats_signal.connect(self.update_server_stats)
 
     def init_ui(self):
         """Initialize UI components"""
@@ -114,6 +216,10 @@ class Launcher(QMainWindow):
         self.install_deps_btn.clicked.connect(self.install_dependencies)
         setup_layout.addWidget(self.install_deps_btn)
 
+        self.prepare_model_btn = QPushButton("⚡ Prepare Model (fast start)")
+        self.prepare_model_btn.clicked.connect(self.prepare_model)
+        setup_layout.addWidget(self.prepare_model_btn)
+
         setup_group.setLayout(setup_layout)
         main_layout.addWidget(setup_group)
 
@@ -135,9 +241,19 @@ class Launcher(QMainWindow):
         self.port_spin.setMinimum(1024)
         self.port_spin.setMaximum(65535)
         port_layout.addWidget(self.port_spin)
+        port_layout.addWidget(QLabel("Health/metrics port:"))
+        self.health_port_spin = QSpinBox()
+        self.health_port_spin.setMinimum(1024)
+        self.health_port_spin.setMaximum(65535)
+        self.health_port_spin.setValue(9100)
+        port_layout.addWidget(self.health_port_spin)
         port_layout.addStretch()
         launch_layout.addLayout(port_layout)
 
+        self.supervise_checkbox = QCheckBox("Supervise: health checks, live stats, auto-restart with backoff")
+        self.supervise_checkbox.setChecked(True)
+        launch_layout.addWidget(self.supervise_checkbox)
+
         self.launch_btn = QPushButton("▶️ Launch Application")
         self.launch_btn.setStyleSheet("""
             QPushButton {
@@ -155,16 +271,25 @@ class Launcher(QMainWindow):
         self.launch_btn.clicked.connect(self.launch_app)
         launch_layout.addWidget(self.launch_btn)
 
+        self.stop_btn = QPushButton("⏹️ Stop Server")
+        self.stop_btn.clicked.connect(self.stop_server)
+        self.stop_btn.setEnabled(False)
+        launch_layout.addWidget(self.stop_btn)
+
+        self.server_label = QLabel(format_stats({}))
+        launch_layout.addWidget(self.server_label)
+
         launch_group.setLayout(launch_layout)
         main_layout.addWidget(launch_group)
 
         # Log window
         log_group = QGroupBox("📋 Log Output")
         log_layout = QVBoxLayout()
-        self.log_text = QTextEdit()
+        self.log_text = QPlainTextEdit()
         self.log_text.setReadOnly(True)
+        self.log_text.setMaximumBlockCount(MAX_VIEW_LINES)
         self.log_text.setStyleSheet("""
-            QTextEdit {
+            QPlainTextEdit {
                 background-color: #0d1117;
                 color: #c9d1d9;
                 border: 1px solid #30363d;
@@ -219,7 +344,7 @@ class Launcher(QMainWindow):
         QPushButton:pressed {
             background-color: #388bfd;
         }
-        QTextEdit {
+        QPlainTextEdit {
             background-color: #0d1117;
             color: #c9d1d9;
             border: 1px solid #30363d;
@@ -250,16 +375,27 @@ class Launcher(QMainWindow):
         """
 
     def log(self, message):
-        """Add message to log window"""
-        self.log_text.append(message)
-        # Auto-scroll to bottom
+        """Add message to log window (shown on the next flush)"""
+        self.log_buffer.push(message)
+
+    def flush_log(self):
+        """Append everything buffered since the last frame in one update"""
+        lines, dropped = self.log_buffer.drain()
+        if not lines:
+            return
+        if dropped:
+            lines.insert(0, f"… {dropped} lines skipped in the view, full output in {self.log_path}")
         scrollbar = self.log_text.verticalScrollBar()
-        scrollbar.setValue(scrollbar.maximum())
+        # Follow the output only if the user has not scrolled up to read something
+        at_bottom = scrollbar.value() >= scrollbar.maximum() - 2
+        self.log_text.appendPlainText("\n".join(lines))
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
 
     def download_model(self):
         """Download DeepSeek Coder model"""
         self.disable_buttons()
-        cmd = "huggingface-cli download deepseek-ai/deepseek-coder-1.3b-instruct --local-dir models/deepseek-coder-1.3b-instruct"
+        cmd = f"huggingface-cli download deepseek-ai/deepseek-coder-1.3b-instruct --local-dir {MODEL_PATH}"
         self.run_worker(cmd, "Downloading DeepSeek Coder model...")
 
     def install_dependencies(self):
@@ -268,29 +404,69 @@ class Launcher(QMainWindow):
         cmd = f"{sys.executable} -m pip install -r requirements.txt"
         self.run_worker(cmd, "Installing dependencies...")
 
+    def prepare_model(self):
+        """Convert the downloaded model once into the memory-mapped layout the apps load fastest"""
+        self.disable_buttons()
+        cmd = f"{sys.executable} -m model_cache --model {MODEL_PATH} --dtype auto"
+        self.run_worker(cmd, "Preparing model for fast loading...")
+
     def launch_app(self):
         """Launch the application"""
-        self.disable_buttons()
-        
         mode_index = self.mode_combo.currentIndex()
-        port = self.port_spin.value()
-        share = "--share" if self.share_checkbox.isChecked() else ""
+        health_port = self.health_port_spin.value()
+        args = [
+            "--port", str(self.port_spin.value()),
+            "--share" if self.share_checkbox.isChecked() else "--no-share",
+            "--metrics-port", str(health_port),
+        ]
         
         if mode_index == 0:
             # Modern chat interface
-            cmd = f"{sys.executable} chat_app.py --port {port} {share}"
+            command = [sys.executable, "chat_app.py"] + args
             description = "Launching Modern Chat Interface..."
         else:
             # Simple interface
-            cmd = f"{sys.executable} app.py --port {port} {share}"
+            command = [sys.executable, "app.py"] + args
             description = "Launching Simple Interface..."
         
-        self.run_worker(cmd, description)
+        if not self.supervise_checkbox.isChecked():
+            self.disable_buttons()
+            self.run_worker(" ".join(shlex.quote(part) for part in command), description)
+            return
+        
+        self.log(f"\n{'='*60}\n🚀 {description} (supervised)\n{'='*60}\n")
+        self.supervisor = Supervisor(
+            command,
+            f"http://127.0.0.1:{health_port}/health",
+            on_line=self.log_buffer.push,
+            on_stats=self.server_stats_signal.emit,
+        ).start()
+        self.launch_btn.setEnabled(False)
+        self.stop_btn.setEnabled(True)
+
+    def stop_server(self):
+        """Stop the supervised server (off the GUI thread; shutdown can take a few seconds)"""
+        if self.supervisor is not None:
+            self.stop_btn.setEnabled(False)
+            self.log("⏹️ Stopping server...")
+            threading.Thread(target=self.supervisor.stop, daemon=True).start()
+
+    def update_server_stats(self, stats):
+        """Show the supervisor's latest state: readiness, cold start, live request and token rates"""
+        self.server_label.setText(format_stats(stats))
+        if stats.get("state") == "stopped":
+            self.supervisor = None
+            self.launch_btn.setEnabled(True)
+            self.stop_btn.setEnabled(False)
+
+    def closeEvent(self, event):
+        if self.supervisor is not None:
+            self.supervisor.stop()
+        super().closeEvent(event)
 
     def run_worker(self, command, description):
         """Run a command in a worker thread"""
-        self.worker = Worker(command, description)
-        self.worker.log_signal.connect(self.log)
+        self.worker = Worker(command, description, self.log_buffer)
         self.worker.error_signal.connect(self.show_error)
         self.worker.finished_signal.connect(self.enable_buttons)
         self.worker.start()
@@ -299,6 +475,7 @@ class Launcher(QMainWindow):
         """Disable all action buttons"""
         self.download_model_btn.setEnabled(False)
         self.install_deps_btn.setEnabled(False)
+        self.prepare_model_btn.setEnabled(False)
         self.launch_btn.setEnabled(False)
         self.progress.setVisible(True)
         self.progress.setMaximum(0)  # Indeterminate progress
@@ -308,7 +485,8 @@ class Launcher(QMainWindow):
         """Enable all action buttons"""
         self.download_model_btn.setEnabled(True)
         self.install_deps_btn.setEnabled(True)
-        self.launch_btn.setEnabled(True)
+        self.prepare_model_btn.setEnabled(True)
+        self.launch_btn.setEnabled(self.supervisor is None)
         self.progress.setVisible(False)
         self.status_label.setText("✅ Ready")
 
@@ -0,0 +1,310 @@
+"""
+Prometheus-style metrics for the inference hot paths
+Counters, gauges and histograms in the text exposition format, served on
+/metrics from a small stdlib HTTP server next to /health and /ready probes.
+Recording is a lock and a few adds.
+"""
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence
+from urllib.parse import parse_qs, urlparse
+
+import torch
+
+from profiler import SamplingProfiler
+
+logger = logging.getLogger("deepseek_metrics")
+
+_STARTED = time.time()
+
+# Seconds; covers sub-millisecond tokenizer calls up to long generations
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {_format(self._value)}"]
+
+
+class Gauge(_Metric):
+    """Set directly, or computed at scrape time from `fn`"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help_text)
+        self._value = 0.0
+        self.fn = fn
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        self._value = value
+
+    @property
+    def value(self) -> float:
+        return self.fn() if self.fn is not None else self._value
+
+    @contextmanager
+    def track(self):
+        """Count the enclosed block as in flight"""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def samples(self) -> List[str]:
+        try:
+            return [f"{self.name} {_format(self.value)}"]
+        except Exception as e:
+            logger.debug(f"Gauge {self.name} failed: {e}")
+            return []
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format(total)}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help_text: str) -> Counter:
+    return REGISTRY.register(Counter(name, help_text))
+
+
+def gauge(name: str, help_text: str, fn: Optional[Callable[[], float]] = None) -> Gauge:
+    return REGISTRY.register(Gauge(name, help_text, fn))
+
+
+def histogram(name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help_text, buckets))
+
+
+def device_memory_bytes() -> float:
+    """Memory allocated on the GPU, or the process resident set size on CPU"""
+    if torch.cuda.is_available():
+        return float(torch.cuda.memory_allocated())
+    try:
+        with open("/proc/self/statm") as f:
+            return float(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE"))
+    except OSError:  # No /proc on macOS/Windows
+        return 0.0
+
+
+# Hot-path metrics shared by both apps, the scheduler and the streaming helpers
+QUEUE_WAIT = histogram("r2d2_queue_wait_seconds", "Time a request waited for an admission slot")
+TOKENIZE = histogram("r2d2_tokenize_seconds", "Prompt building and tokenization per request")
+PREFILL = histogram("r2d2_prefill_seconds", "Prompt forward pass per prefill batch, up to the first sampled token")
+DECODE_STEP = histogram("r2d2_decode_step_seconds", "One decode step (one new token for every running sequence)")
+DETOKENIZE = histogram("r2d2_detokenize_seconds", "Token-to-text decoding per request")
+POSTPROCESS = histogram("r2d2_postprocess_seconds", "Trimming, stop handling and caching of a finished reply")
+REQUEST_LATENCY = histogram("r2d2_request_seconds", "End-to-end request time, queue wait included")
+PROMPT_TOKENS = counter("r2d2_prompt_tokens_total", "Prompt tokens sent to the model")
+GENERATED_TOKENS = counter("r2d2_generated_tokens_total", "Tokens generated by the model")
+REQUESTS = counter("r2d2_requests_total", "Generation requests handled")
+ERRORS = counter("r2d2_errors_total", "Generation requests that failed")
+REJECTED = counter("r2d2_rejected_total", "Requests turned away by admission control")
+IN_FLIGHT = gauge("r2d2_in_flight_requests", "Requests currently queued or generating")
+DEVICE_MEMORY = gauge("r2d2_device_memory_bytes", "GPU memory allocated, or process RSS on CPU", device_memory_bytes)
+CANCELLED = counter("r2d2_cancelled_total", "Requests abandoned mid-generation (chat cleared, new message sent or client gone)")
+RECLAIMED_PREFILL_TOKENS = counter(
+    "r2d2_reclaimed_prefill_tokens_total", "Prompt tokens never prefilled because their request was abandoned first"
+)
+RECLAIMED_DECODE_TOKENS = counter(
+    "r2d2_reclaimed_decode_tokens_total", "Unused generation budget (max_new_tokens not decoded) of abandoned requests"
+)
+
+
+@contextmanager
+def track_request(ignore: tuple = ()):
+    """Count a request, keep it in the in-flight gauge and time it; exceptions in `ignore` are not errors"""
+    REQUESTS.inc()
+    IN_FLIGHT.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    except ignore:
+        raise
+    except Exception:
+        ERRORS.inc()
+        raise
+    finally:
+        IN_FLIGHT.dec()
+        REQUEST_LATENCY.observe(time.perf_counter() - started)
+
+
+def record_cancelled(prefill_tokens: int, decode_tokens: int):
+    """Count one abandoned request and the tokens its cancellation saved computing"""
+    CANCELLED.inc()
+    RECLAIMED_PREFILL_TOKENS.inc(prefill_tokens)
+    RECLAIMED_DECODE_TOKENS.inc(decode_tokens)
+
+
+def health_snapshot(health: Optional[Callable[[], dict]] = None) -> dict:
+    """App state from `health` plus the counters a supervisor needs for live rates"""
+    state = dict(health() if health is not None else {"ready": True})
+    state.update(
+        uptime_seconds=time.time() - _STARTED,
+        requests_total=REQUESTS.value,
+        errors_total=ERRORS.value,
+        generated_tokens_total=GENERATED_TOKENS.value,
+        in_flight=IN_FLIGHT.value,
+    )
+    return state
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+    profiling = False
+    health: Optional[Callable[[], dict]] = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/metrics":
+            self._reply(200, self.registry.render(), "text/plain; version=0.0.4")
+        elif url.path in ("/health", "/ready"):
+            # /health answers whenever the process does; /ready only once the model serves
+            state = health_snapshot(self.health)
+            status = 200 if url.path == "/health" or state.get("ready") else 503
+            self._reply(status, json.dumps(state), "application/json")
+        elif url.path == "/debug/profile" and self.profiling:
+            query = parse_qs(url.query)
+            seconds = min(float(query.get("seconds", ["10"])[0]), 120.0)
+            interval = max(float(query.get("interval", ["0.005"])[0]), 0.001)
+            stacks = SamplingProfiler(interval=interval).run(seconds)
+            self._reply(200, stacks, "text/plain")
+        else:
+            self._reply(404, "Not found\n", "text/plain")
+
+    def _reply(self, status: int, text: str, content_type: str):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(
+    port: int,
+    host: str = "0.0.0.0",
+    profiling: bool = False,
+    health: Optional[Callable[[], dict]] = None,
+) -> Optional[ThreadingHTTPServer]:
+    """
+    Serve /metrics, /health, /ready (and /debug/profile when `profiling` is set) on a daemon thread.
+
+    Args:
+        health: Returns the app state for the probes; its "ready" key decides /ready
+
+    Returns:
+        The server, or None if the port could not be bound
+    """
+    attributes = {"profiling": profiling, "health": staticmethod(health) if health is not None else None}
+    handler = type("MetricsHandler", (_Handler,), attributes)
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        logger.error(f"Could not start the metrics server on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Metrics on http://{host}:{port}/metrics" + (", profiler on /debug/profile" if profiling else ""))
+    return server
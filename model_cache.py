@@ -0,0 +1,154 @@
+"""
+Pre-converted model cache for fast cold starts
+Converts a downloaded model once into a single dtype-matched safetensors file
+plus config, tokenizer and a manifest, so later loads can memory-map the
+weights as they are instead of reading, casting and copying the checkpoint.
+
+Usage: python -m model_cache [--model models/deepseek-coder-1.3b-instruct] [--dtype auto]
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Optional
+
+import torch
+
+from server_args import MODEL_PATH
+
+logger = logging.getLogger("deepseek_model_cache")
+
+MANIFEST = "manifest.json"
+WEIGHTS = "model.safetensors"
+# Bump when the prepared layout changes; older caches are then rebuilt
+FORMAT_VERSION = 1
+
+_DTYPE_NAMES = {torch.float16: "fp16", torch.bfloat16: "bf16", torch.float32: "fp32"}
+
+
+def prepared_dir(model_path: str, dtype: torch.dtype) -> str:
+    """models/<name> -> models/.prepared/<name>-<dtype>"""
+    model_path = os.path.normpath(model_path)
+    name = f"{os.path.basename(model_path)}-{_DTYPE_NAMES[dtype]}"
+    return os.path.join(os.path.dirname(model_path), ".prepared", name)
+
+
+def source_fingerprint(model_path: str) -> dict:
+    """Size and mtime of every file in the source model; any change invalidates the cache"""
+    files = {}
+    for name in sorted(os.listdir(model_path)):
+        path = os.path.join(model_path, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            files[name] = [stat.st_size, int(stat.st_mtime)]
+    return files
+
+
+def find_prepared(model_path: str, dtype: torch.dtype) -> Optional[str]:
+    """Directory of an up-to-date prepared copy, or None"""
+    target = prepared_dir(model_path, dtype)
+    try:
+        with open(os.path.join(target, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("format") != FORMAT_VERSION or manifest.get("dtype") != _DTYPE_NAMES[dtype]:
+        return None
+    if not os.path.isdir(model_path) or manifest.get("source_files") != source_fingerprint(model_path):
+        logger.info(f"Prepared model in {target} is stale; loading from {model_path}")
+        return None
+    return target
+
+
+def export_weights(model, path: str) -> str:
+    """Write the model weights as one safetensors file (atomically); tied tensors are stored once"""
+    from safetensors.torch import save_model
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial = path + ".partial"
+    save_model(model, partial)
+    os.replace(partial, path)
+    return path
+
+
+def prepare(model_path: str, dtype: torch.dtype, force: bool = False) -> str:
+    """
+    Convert `model_path` into the prepared layout for `dtype` (no-op if already current).
+
+    Returns:
+        Directory of the prepared model
+    """
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    if not force:
+        existing = find_prepared(model_path, dtype)
+        if existing is not None:
+            logger.info(f"Prepared model is up to date: {existing}")
+            return existing
+
+    target = prepared_dir(model_path, dtype)
+    staging = target + ".partial"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    started = time.perf_counter()
+    logger.info(f"Converting {model_path} to {_DTYPE_NAMES[dtype]}...")
+    model = AutoModelForCausalLM.from_pretrained(
+        model_path, trust_remote_code=True, torch_dtype=dtype, low_cpu_mem_usage=True
+    )
+    export_weights(model, os.path.join(staging, WEIGHTS))
+    model.config.save_pretrained(staging)
+    if model.generation_config is not None:
+        model.generation_config.save_pretrained(staging)
+    AutoTokenizer.from_pretrained(model_path, trust_remote_code=True).save_pretrained(staging)
+    # Custom modeling code (trust_remote_code models) has to travel with the config
+    for name in os.listdir(model_path):
+        if name.endswith(".py"):
+            shutil.copy2(os.path.join(model_path, name), staging)
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "source": os.path.abspath(model_path),
+        "source_files": source_fingerprint(model_path),
+        "dtype": _DTYPE_NAMES[dtype],
+        "tensors": len(model.state_dict()),
+        "weight_bytes": os.path.getsize(os.path.join(staging, WEIGHTS)),
+        "torch": torch.__version__,
+        "transformers": __import__("transformers").__version__,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(staging, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    del model
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(staging, target)
+    logger.info(
+        f"Prepared {target} ({manifest['weight_bytes'] / 2**20:.0f} MB) in {time.perf_counter() - started:.1f}s"
+    )
+    return target
+
+
+def main():
+    from device import _DTYPES, select_device
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    parser = argparse.ArgumentParser(description="Pre-convert a model for fast, memory-mapped loading")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument(
+        "--dtype", action="append", choices=["auto", *_DTYPES],
+        help="Precision to prepare; repeatable (default: auto, what this machine would serve with)",
+    )
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the prepared copy is current")
+    args = parser.parse_args()
+
+    for name in args.dtype or ["auto"]:
+        dtype = select_device().dtype if name == "auto" else _DTYPES[name]
+        prepare(args.model, dtype, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Background model loading
+Loads the model on a worker thread so the Gradio server can bind right away.
+Requests can wait on readiness, and a failed load can be retried.
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger("deepseek_loader")
+
+# Reference point for startup timings; set when the app first imports this module
+PROCESS_START = time.perf_counter()
+
+
+class ModelHolder:
+    """
+    Owns the (model, tokenizer) pair and the thread that loads it.
+
+    Args:
+        load_fn: Returns (model, tokenizer); runs on the loader thread
+        on_ready: Callbacks run on the loader thread with (model, tokenizer) after a successful load
+        on_failure: Run on the loader thread with the error when the load or an on_ready callback
+            raises; undoes whatever the earlier callbacks published
+        retry_interval: Minimum seconds between load attempts triggered by retry()
+    """
+
+    def __init__(
+        self,
+        load_fn: Callable[[], Tuple[Any, Any]],
+        on_ready: Optional[List[Callable[[Any, Any], None]]] = None,
+        on_failure: Optional[Callable[[BaseException], None]] = None,
+        retry_interval: float = 30.0,
+    ):
+        self.load_fn = load_fn
+        self.on_ready = list(on_ready or [])
+        self.on_failure = on_failure
+        self.retry_interval = retry_interval
+        self.model = None
+        self.tokenizer = None
+        self.error: Optional[BaseException] = None
+        self.attempts = 0
+        self.timings = {}
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._last_attempt = 0.0
+        self._first_token_logged = False
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    @property
+    def loading(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> "ModelHolder":
+        """Begin loading in the background; no-op while loading or once loaded"""
+        with self._lock:
+            if self.ready or self.loading:
+                return self
+            self.attempts += 1
+            self._last_attempt = time.perf_counter()
+            self.error = None
+            self._thread = threading.Thread(target=self._load, name="model-loader", daemon=True)
+            self._thread.start()
+        return self
+
+    def retry(self) -> bool:
+        """Start another attempt after a failed load; returns True if one was started"""
+        if self.ready or self.loading or self.error is None:
+            return False
+        if time.perf_counter() - self._last_attempt < self.retry_interval:
+            return False
+        logger.info(f"Retrying model load (attempt {self.attempts + 1})")
+        self.start()
+        return True
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the model is ready, it failed, or the timeout passed; returns readiness"""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while not self.ready:
+            thread = self._thread
+            if thread is None or not thread.is_alive():
+                return self.ready
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if remaining is not None and remaining <= 0:
+                return False
+            self._ready.wait(0.1 if remaining is None else min(remaining, 0.1))
+        return True
+
+    def status(self) -> str:
+        if self.ready:
+            return "ready"
+        if self.loading:
+            return "loading"
+        return "failed" if self.error is not None else "idle"
+
+    def health(self) -> dict:
+        """State for the /health and /ready probes"""
+        state = {"ready": self.ready, "status": self.status(), "attempts": self.attempts}
+        state.update(self.timings)
+        if self.error is not None:
+            state["error"] = str(self.error)
+        return state
+
+    def mark_bound(self):
+        """Record the moment the web server is accepting connections"""
+        self.timings["time_to_bind"] = time.perf_counter() - PROCESS_START
+        logger.info(f"Server bound {self.timings['time_to_bind']:.2f}s after start (model {self.status()})")
+
+    def mark_first_token(self, at: Optional[float] = None):
+        """Record the first generated token after startup (logged once); `at` is a perf_counter() value"""
+        # Generations from on_ready callbacks (warm-up) happen before ready and do not count
+        if self._first_token_logged or not self.ready:
+            return
+        self._first_token_logged = True
+        self.timings["time_to_first_token"] = (at or time.perf_counter()) - PROCESS_START
+        logger.info(f"First token {self.timings['time_to_first_token']:.2f}s after start")
+
+    def _load(self):
+        started = time.perf_counter()
+        try:
+            model, tokenizer = self.load_fn()
+            for callback in self.on_ready:
+                callback(model, tokenizer)
+        except Exception as e:
+            logger.error(f"Failed to load model: {e}")
+            if self.on_failure is not None:
+                try:
+                    self.on_failure(e)
+                except Exception as cleanup_error:
+                    logger.error(f"Cleanup after the failed load failed: {cleanup_error}", exc_info=True)
+            self.error = e
+            return
+        self.model, self.tokenizer = model, tokenizer
+        self.timings["load_seconds"] = time.perf_counter() - started
+        self.timings["time_to_ready"] = time.perf_counter() - PROCESS_START
+        logger.info(
+            f"Model ready in {self.timings['load_seconds']:.2f}s "
+            f"({self.timings['time_to_ready']:.2f}s after start)"
+        )
+        self._ready.set()
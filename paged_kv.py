@@ -0,0 +1,376 @@
+"""
+Paged KV cache for the batch scheduler
+KV lives in one preallocated pool of fixed-size blocks handed out from a free
+list; each sequence keeps a block table. Full blocks are shared between
+sequences with the same token prefix (a common system prompt) and copied on
+write. Admission reserves a request's worst case up front, so a running
+sequence never runs out of blocks.
+"""
+
+import hashlib
+import logging
+import math
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import torch
+
+from kv_utils import LegacyCache, cache_bytes, from_legacy, to_legacy
+from metrics import gauge
+
+logger = logging.getLogger("deepseek_paged_kv")
+
+KV_BLOCKS_USED = gauge("r2d2_kv_blocks_used", "KV-cache blocks held by running sequences")
+KV_BLOCKS_RESERVED = gauge("r2d2_kv_blocks_reserved", "KV-cache blocks promised to admitted sequences, not yet filled")
+KV_BLOCK_UTILISATION = gauge("r2d2_kv_block_utilisation", "Fraction of the KV-cache block pool in use")
+
+
+class BlockAllocator:
+    """
+    Free list and reference counts of a pool of KV blocks.
+
+    Freed blocks that hold a registered prefix stay findable until the free
+    list hands them out again; blocks with nothing worth keeping are reused first.
+
+    Args:
+        num_blocks: Blocks in the pool
+    """
+
+    def __init__(self, num_blocks: int):
+        self.num_blocks = num_blocks
+        self.refcount = [0] * num_blocks
+        self.reserved = 0
+        self._free: "OrderedDict[int, None]" = OrderedDict.fromkeys(range(num_blocks))
+        self._by_hash: Dict[bytes, int] = {}
+        self._hash_of: Dict[int, bytes] = {}
+
+    @property
+    def free(self) -> int:
+        return len(self._free)
+
+    @property
+    def available(self) -> int:
+        """Free blocks not promised to an admitted sequence"""
+        return len(self._free) - self.reserved
+
+    def allocate(self) -> int:
+        if not self._free:
+            raise RuntimeError("KV cache has no free blocks")
+        block, _ = self._free.popitem(last=False)
+        self.unregister(block)
+        self.refcount[block] = 1
+        return block
+
+    def share(self, block: int):
+        if self.refcount[block] == 0:
+            del self._free[block]
+        self.refcount[block] += 1
+
+    def release(self, block: int):
+        self.refcount[block] -= 1
+        if self.refcount[block] == 0:
+            self._free[block] = None
+            if block not in self._hash_of:
+                self._free.move_to_end(block, last=False)
+
+    def lookup(self, block_hash: bytes) -> Optional[int]:
+        return self._by_hash.get(block_hash)
+
+    def register(self, block: int, block_hash: bytes):
+        """Make a full block findable by its prefix hash (the first block with that content wins)"""
+        if block_hash not in self._by_hash and block not in self._hash_of:
+            self._by_hash[block_hash] = block
+            self._hash_of[block] = block_hash
+
+    def unregister(self, block: int):
+        block_hash = self._hash_of.pop(block, None)
+        if block_hash is not None:
+            del self._by_hash[block_hash]
+
+    def cached(self) -> int:
+        """Free blocks still holding a registered prefix"""
+        return sum(1 for block in self._free if block in self._hash_of)
+
+
+class BlockTable:
+    """Blocks of one sequence, in order, and the tokens stored in them"""
+
+    def __init__(self, salt: bytes):
+        self.blocks: List[int] = []
+        self.token_ids: List[int] = []
+        self.hashes: List[bytes] = []  # Prefix hash of each full block
+        self.reserved = 0  # Blocks this sequence may still allocate
+        self.salt = salt
+
+    @property
+    def length(self) -> int:
+        return len(self.token_ids)
+
+
+class PagedBatch:
+    """Model inputs for rows of a paged cache; commit() stores the new KV the forward produced"""
+
+    def __init__(self, kv: "PagedKVCache", tables: List[BlockTable], token_ids: List[List[int]], inputs: dict, past_length: int):
+        self.kv = kv
+        self.tables = tables
+        self.token_ids = token_ids
+        self.inputs = inputs
+        self.past_length = past_length
+
+    def commit(self, past):
+        """Write the KV of the real new tokens (columns after the gathered past) into each row's blocks"""
+        self.kv._commit(self, to_legacy(past))
+
+
+class PagedKVCache:
+    """
+    Block-paged KV storage shared by every sequence in a BatchScheduler.
+
+    Each forward gathers the rows' blocks into a left-padded legacy cache and
+    writes the new tokens' keys and values back, so the model itself is unchanged.
+    The gathered copy only lives for that forward: KV memory is the pool plus
+    one batch-sized buffer while the model runs (stats()["peak_gather_bytes"]).
+
+    Args:
+        num_layers: Decoder layers of the model
+        num_heads: Key/value heads per layer
+        head_dim: Size of each head
+        num_blocks: Blocks in the pool; sets the memory budget
+        block_size: Tokens per block
+        dtype: Pool dtype, normally the model's
+        device: Pool device, normally the model's
+    """
+
+    def __init__(
+        self,
+        num_layers: int,
+        num_heads: int,
+        head_dim: int,
+        num_blocks: int,
+        block_size: int = 16,
+        dtype: torch.dtype = torch.float32,
+        device="cpu",
+    ):
+        self.block_size = block_size
+        self.allocator = BlockAllocator(num_blocks)
+        self.device = torch.device(device)
+        slots = num_blocks * block_size
+        # Head-major, so a sequence's positions gather into contiguous runs per head
+        self.keys = [torch.zeros(num_heads, slots, head_dim, dtype=dtype, device=device) for _ in range(num_layers)]
+        self.values = [torch.zeros(num_heads, slots, head_dim, dtype=dtype, device=device) for _ in range(num_layers)]
+        self.nbytes = 2 * num_layers * slots * num_heads * head_dim * self.keys[0].element_size()
+        self._stats = {"admitted": 0, "shared_tokens": 0, "copied_blocks": 0, "peak_gather_bytes": 0}
+        logger.info(f"Paged KV cache: {num_blocks} blocks x {block_size} tokens, {self.nbytes / 2**20:.1f} MB")
+        self._publish()
+
+    @classmethod
+    def for_model(cls, model, num_blocks: int, block_size: int = 16) -> "PagedKVCache":
+        """Pool shaped for `model`'s attention layers, on its device and in its dtype"""
+        config = model.config
+        num_heads = getattr(config, "num_key_value_heads", None) or config.num_attention_heads
+        head_dim = getattr(config, "head_dim", None) or config.hidden_size // config.num_attention_heads
+        return cls(config.num_hidden_layers, num_heads, head_dim, num_blocks, block_size, model.dtype, model.device)
+
+    def blocks_for(self, tokens: int) -> int:
+        return math.ceil(tokens / self.block_size)
+
+    def admit(self, token_ids: List[int], max_new_tokens: int, adapter: Optional[str] = None) -> Optional[BlockTable]:
+        """
+        Reserve room for a request, sharing the blocks of any known prefix.
+
+        Args:
+            token_ids: Prompt tokens
+            max_new_tokens: Generation budget; the reservation covers prompt plus budget
+            adapter: LoRA adapter the KV is computed under (blocks are only shared within one)
+
+        Returns:
+            Block table with the shared prefix already in it (table.length tokens), or
+            None when the free blocks cannot cover the request yet
+
+        Raises:
+            ValueError: The request needs more blocks than the whole pool
+        """
+        allocator = self.allocator
+        needed = self.blocks_for(len(token_ids) + max_new_tokens)
+        if needed > allocator.num_blocks:
+            raise ValueError(
+                f"Request needs {needed} KV blocks ({len(token_ids)} prompt + {max_new_tokens} new tokens) "
+                f"but the cache only has {allocator.num_blocks}"
+            )
+        table = BlockTable(salt=(adapter or "").encode())
+        matched = self._match(table, token_ids)
+        # The last prompt token is always recomputed for its logits; if it sits in a
+        # shared block, that block is copied before the write
+        shared = min(len(matched) * self.block_size, len(token_ids) - 1)
+        copy = 1 if len(matched) * self.block_size > shared else 0
+        live = sum(1 for block in matched if allocator.refcount[block] > 0)
+        if needed - live + copy > allocator.available:
+            return None
+        for block in matched:
+            allocator.share(block)
+        table.blocks = matched
+        table.token_ids = list(token_ids[:shared])
+        table.hashes = table.hashes[:shared // self.block_size]
+        table.reserved = needed - len(matched) + copy
+        allocator.reserved += table.reserved
+        self._stats["admitted"] += 1
+        self._stats["shared_tokens"] += shared
+        self._publish()
+        return table
+
+    def release(self, table: BlockTable, keep: bool = True):
+        """
+        Return a finished sequence's blocks and unused reservation.
+
+        Args:
+            keep: Leave its full blocks findable for later requests with the same prefix;
+                False drops those no other sequence holds (abandoned replies)
+        """
+        allocator = self.allocator
+        for block in table.blocks:
+            if not keep and allocator.refcount[block] == 1:
+                allocator.unregister(block)
+            allocator.release(block)
+        allocator.reserved -= table.reserved
+        table.blocks, table.reserved = [], 0
+        self._publish()
+
+    def batch(self, tables: List[BlockTable], token_ids: List[List[int]], pad_token_id: int) -> PagedBatch:
+        """
+        Model inputs for feeding `token_ids[i]` to the sequence of `tables[i]`.
+
+        Past tokens are gathered left-padded to the longest row and new tokens
+        are left-padded after them; attention_mask and position_ids skip both pads.
+        """
+        past_length = max(table.length for table in tables)
+        width = max(len(ids) for ids in token_ids)
+        input_ids = torch.full((len(tables), width), pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(tables), past_length + width), dtype=torch.long)
+        position_ids = torch.zeros((len(tables), width), dtype=torch.long)
+        slots = torch.zeros((len(tables), past_length), dtype=torch.long)
+        for row, (table, ids) in enumerate(zip(tables, token_ids)):
+            self._grow(table, table.length + len(ids))
+            input_ids[row, width - len(ids):] = torch.tensor(ids)
+            attention_mask[row, past_length - table.length:past_length] = 1
+            attention_mask[row, past_length + width - len(ids):] = 1
+            position_ids[row, width - len(ids):] = torch.arange(table.length, table.length + len(ids))
+            if table.length:
+                slots[row, past_length - table.length:] = self._slots(table, 0, table.length)
+        inputs = dict(
+            input_ids=input_ids.to(self.device),
+            attention_mask=attention_mask.to(self.device),
+            position_ids=position_ids.to(self.device),
+        )
+        if past_length:
+            past = self._gather(slots.to(self.device))
+            self._stats["peak_gather_bytes"] = max(self._stats["peak_gather_bytes"], cache_bytes(past))
+            inputs["past_key_values"] = from_legacy(past)
+        self._publish()
+        return PagedBatch(self, tables, token_ids, inputs, past_length)
+
+    def stats(self) -> dict:
+        allocator = self.allocator
+        used = allocator.num_blocks - allocator.free
+        return dict(
+            self._stats,
+            blocks=allocator.num_blocks,
+            block_size=self.block_size,
+            used_blocks=used,
+            free_blocks=allocator.free,
+            reserved_blocks=allocator.reserved,
+            cached_blocks=allocator.cached(),
+            shared_blocks=sum(1 for count in allocator.refcount if count > 1),
+            utilisation=used / allocator.num_blocks,
+            bytes=self.nbytes,
+        )
+
+    # Internals
+    def _match(self, table: BlockTable, token_ids: List[int]) -> List[int]:
+        """Blocks already holding the leading full blocks of `token_ids`; fills table.hashes as it goes"""
+        matched = []
+        parent = table.salt
+        for start in range(0, len(token_ids) - self.block_size + 1, self.block_size):
+            parent = self._hash(parent, token_ids[start:start + self.block_size])
+            table.hashes.append(parent)
+            block = self.allocator.lookup(parent)
+            if block is None:
+                break
+            matched.append(block)
+        return matched
+
+    @staticmethod
+    def _hash(parent: bytes, token_ids: Sequence[int]) -> bytes:
+        return hashlib.blake2b(parent + array("q", token_ids).tobytes(), digest_size=16).digest()
+
+    def _grow(self, table: BlockTable, length: int):
+        """Give `table` blocks for `length` tokens, copying a shared block before it is written into"""
+        allocator = self.allocator
+        first = table.length // self.block_size
+        if first < len(table.blocks) and allocator.refcount[table.blocks[first]] > 1:
+            old = table.blocks[first]
+            table.blocks[first] = self._allocate(table)
+            rows = slice(old * self.block_size, (old + 1) * self.block_size)
+            new = slice(table.blocks[first] * self.block_size, (table.blocks[first] + 1) * self.block_size)
+            for keys, values in zip(self.keys, self.values):
+                keys[:, new] = keys[:, rows]
+                values[:, new] = values[:, rows]
+            allocator.release(old)
+            self._stats["copied_blocks"] += 1
+        while len(table.blocks) < self.blocks_for(length):
+            table.blocks.append(self._allocate(table))
+
+    def _allocate(self, table: BlockTable) -> int:
+        if table.reserved > 0:
+            table.reserved -= 1
+            self.allocator.reserved -= 1
+        elif self.allocator.available <= 0:
+            raise RuntimeError("Sequence outgrew its KV-cache reservation")
+        return self.allocator.allocate()
+
+    def _slots(self, table: BlockTable, start: int, end: int) -> torch.LongTensor:
+        positions = torch.arange(start, end)
+        blocks = torch.tensor(table.blocks, dtype=torch.long)[positions // self.block_size]
+        return blocks * self.block_size + positions % self.block_size
+
+    def _gather(self, slots: torch.LongTensor) -> LegacyCache:
+        rows, length = slots.shape
+        flat = slots.reshape(-1)
+        return tuple(
+            (
+                keys.index_select(1, flat).view(keys.shape[0], rows, length, -1).transpose(0, 1),
+                values.index_select(1, flat).view(values.shape[0], rows, length, -1).transpose(0, 1),
+            )
+            for keys, values in zip(self.keys, self.values)
+        )
+
+    def _commit(self, batch: PagedBatch, past: LegacyCache):
+        width = max(len(ids) for ids in batch.token_ids)
+        real = batch.inputs["attention_mask"][:, batch.past_length:].bool()
+        slots = torch.cat([
+            self._slots(table, table.length, table.length + len(ids)) for table, ids in zip(batch.tables, batch.token_ids)
+        ]).to(self.device)
+        for (keys, values), pool_keys, pool_values in zip(past, self.keys, self.values):
+            new_keys = keys[:, :, -width:].transpose(1, 2)[real].transpose(0, 1)
+            new_values = values[:, :, -width:].transpose(1, 2)[real].transpose(0, 1)
+            pool_keys.index_copy_(1, slots, new_keys.to(pool_keys.dtype))
+            pool_values.index_copy_(1, slots, new_values.to(pool_values.dtype))
+        for table, ids in zip(batch.tables, batch.token_ids):
+            table.token_ids.extend(ids)
+            self._register(table)
+
+    def _register(self, table: BlockTable):
+        """Hash and register the blocks `table` has filled since the last call"""
+        parent = table.hashes[-1] if table.hashes else table.salt
+        for index in range(len(table.hashes), table.length // self.block_size):
+            start = index * self.block_size
+            parent = self._hash(parent, table.token_ids[start:start + self.block_size])
+            table.hashes.append(parent)
+            self.allocator.register(table.blocks[index], parent)
+
+    def _publish(self):
+        allocator = self.allocator
+        used = allocator.num_blocks - allocator.free
+        KV_BLOCKS_USED.set(used)
+        KV_BLOCKS_RESERVED.set(allocator.reserved)
+        KV_BLOCK_UTILISATION.set(used / allocator.num_blocks)
@@ -0,0 +1,108 @@
+"""
+Per-session prompt/KV-cache store
+Keeps the KV cache of each chat session's last turn so the next turn only
+prefills the tokens that were not seen before.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable, List, Optional, Tuple
+
+from kv_utils import LegacyCache, cache_bytes
+
+logger = logging.getLogger("deepseek_prefix_cache")
+
+
+@dataclass
+class _Entry:
+    token_ids: List[int]
+    cache: LegacyCache
+    nbytes: int
+    adapter: Optional[str] = None
+
+
+def common_prefix_length(a: List[int], b: List[int]) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class PrefixCache:
+    """
+    LRU store of batch-1 KV caches keyed by session and token prefix.
+
+    Args:
+        max_bytes: Memory cap for all stored caches together
+        min_reuse_tokens: Shorter shared prefixes are not worth a separate prefill
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024, min_reuse_tokens: int = 16):
+        self.max_bytes = max_bytes
+        self.min_reuse_tokens = min_reuse_tokens
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "tokens_saved": 0, "tokens_prefilled": 0, "evictions": 0}
+
+    def lookup(
+        self, session_id: Hashable, input_ids: List[int], adapter: Optional[str] = None
+    ) -> Tuple[int, Optional[LegacyCache]]:
+        """
+        Find the cached KV for the longest prefix of `input_ids`.
+
+        At least one prompt token is always left over so the caller still gets
+        logits for the next position. KV computed under another LoRA adapter
+        (or without one) does not match.
+
+        Returns:
+            (reused_length, cache cropped to that length) or (0, None)
+        """
+        with self._lock:
+            self._stats["lookups"] += 1
+            entry = self._entries.get(session_id)
+            reused = 0
+            if entry is not None and entry.adapter == adapter:
+                reused = min(common_prefix_length(entry.token_ids, input_ids), len(input_ids) - 1)
+            if reused < self.min_reuse_tokens:
+                self._stats["tokens_prefilled"] += len(input_ids)
+                return 0, None
+            self._entries.move_to_end(session_id)
+            self._stats["hits"] += 1
+            self._stats["tokens_saved"] += reused
+            self._stats["tokens_prefilled"] += len(input_ids) - reused
+            return reused, tuple((k[:, :, :reused], v[:, :, :reused]) for k, v in entry.cache)
+
+    def store(self, session_id: Hashable, token_ids: List[int], cache: LegacyCache, adapter: Optional[str] = None):
+        """Remember the KV cache for `token_ids`, replacing the session's previous turn"""
+        nbytes = cache_bytes(cache)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(session_id, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[session_id] = _Entry(list(token_ids), cache, nbytes, adapter)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self._stats["evictions"] += 1
+
+    def drop(self, session_id: Hashable):
+        """Forget a session, e.g. when its chat is cleared"""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self._bytes -= entry.nbytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            return stats
@@ -0,0 +1,57 @@
+"""
+Sampling profiler for a running server
+Snapshots every thread's Python stack at a fixed interval and returns the
+counts in collapsed-stack format (one line per stack), ready for flamegraph.pl
+or speedscope. Nothing runs until a profile is requested.
+"""
+
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional, Set
+
+
+def _frame_stack(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """
+    Args:
+        interval: Seconds between samples
+        include_idle: Keep samples of threads parked in wait/select calls
+    """
+
+    _IDLE = {"wait", "select", "poll", "accept", "get", "_wait_for_tstate_lock", "readinto", "sleep"}
+
+    def __init__(self, interval: float = 0.005, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+
+    def run(self, seconds: float, thread_names: Optional[Set[str]] = None) -> str:
+        """Sample for `seconds` and return collapsed stacks, heaviest first"""
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        counts: Counter = Counter()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                name = names.get(ident)
+                if name is None:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                    name = names.get(ident, str(ident))
+                if thread_names is not None and name not in thread_names:
+                    continue
+                if not self.include_idle and frame.f_code.co_name in self._IDLE:
+                    continue
+                counts[f"{name};{_frame_stack(frame)}"] += 1
+            time.sleep(self.interval)
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
@@ -0,0 +1,154 @@
+"""
+Response cache for repeated prompts
+Keys on the normalized prompt, a digest of the chat history and the generation
+parameters. Bounded in memory (LRU + TTL) with an optional SQLite file that
+survives restarts.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger("deepseek_response_cache")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Unicode-normalize, trim and collapse runs of whitespace; case is kept (code is case sensitive)"""
+    return " ".join(unicodedata.normalize("NFC", prompt).split())
+
+
+def history_digest(history: Sequence[Tuple[str, str]]) -> str:
+    return hashlib.sha256(json.dumps([list(turn) for turn in history]).encode()).hexdigest()
+
+
+def is_cacheable(params: Dict[str, Any], opt_in: bool = False) -> bool:
+    """Greedy output is deterministic; sampled output only with a fixed seed or an explicit opt-in"""
+    if not params.get("do_sample", False):
+        return True
+    return opt_in or params.get("seed") is not None
+
+
+def make_key(prompt: str, history: Sequence[Tuple[str, str]] = (), params: Optional[Dict[str, Any]] = None) -> str:
+    payload = {
+        "prompt": normalize_prompt(prompt),
+        "history": history_digest(history),
+        "params": params or {},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU/TTL cache of finished responses.
+
+    Args:
+        max_entries: Maximum number of in-memory entries
+        max_bytes: Maximum total size of in-memory responses
+        ttl: Seconds an entry stays valid (0 = forever)
+        db_path: Optional SQLite file used as a persistent second level
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 3600.0,
+        db_path: Optional[str] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "disk_hits": 0, "stores": 0, "evictions": 0}
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def _expired(self, created: float) -> bool:
+        return bool(self.ttl) and time.time() - created > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[1]):
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[0]
+                self._remove(key)
+            if self._db is not None:
+                row = self._db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self._expired(row[1]):
+                    self._insert(key, row[0], row[1])
+                    self._stats["hits"] += 1
+                    self._stats["disk_hits"] += 1
+                    return row[0]
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: str, response: str):
+        created = time.time()
+        with self._lock:
+            self._insert(key, response, created)
+            self._stats["stores"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                    (key, response, created),
+                )
+                if self.ttl:
+                    self._db.execute("DELETE FROM responses WHERE created < ?", (created - self.ttl,))
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(
+                self._stats,
+                hit_rate=self._stats["hits"] / lookups if lookups else 0.0,
+                entries=len(self._entries),
+                bytes=self._bytes,
+            )
+
+    # Callers hold the lock
+    def _insert(self, key: str, response: str, created: float):
+        size = len(response.encode())
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (response, created)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats["evictions"] += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0].encode())
+
+
+def cache_from_env(environ: Dict[str, str]) -> Optional[ResponseCache]:
+    """Build the cache from R2D2_RESPONSE_CACHE_* settings; size 0 disables it"""
+    size = int(environ.get("R2D2_RESPONSE_CACHE_SIZE", "1024"))
+    if size <= 0:
+        return None
+    return ResponseCache(
+        max_entries=size,
+        max_bytes=int(environ.get("R2D2_RESPONSE_CACHE_MB", "64")) * 1024 * 1024,
+        ttl=float(environ.get("R2D2_RESPONSE_CACHE_TTL", "3600")),
+        db_path=environ.get("R2D2_RESPONSE_CACHE_DB") or None,
+    )
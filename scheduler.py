@@ -0,0 +1,657 @@
+"""
+Continuous-batching inference scheduler
+Collects concurrent generation requests into one padded batch and decodes them together.
+New requests join the batch at token boundaries and finished ones leave it immediately.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Hashable, Iterator, List, Optional, Tuple
+
+import torch
+
+from adapters import AdapterCache
+from kv_utils import cache_length, cat_batch, from_legacy, left_pad, select_rows, to_legacy
+from metrics import DECODE_STEP, GENERATED_TOKENS, PREFILL, record_cancelled
+from paged_kv import BlockTable, PagedKVCache
+from prefix_cache import PrefixCache
+from stopping import StopSequenceCriteria
+
+logger = logging.getLogger("deepseek_scheduler")
+
+
+@dataclass
+class GenerationRequest:
+    """Prompt plus the sampling parameters that apply to it alone"""
+    input_ids: List[int]
+    max_new_tokens: int = 256
+    temperature: float = 1.0
+    top_p: float = 1.0
+    repetition_penalty: float = 1.0
+    do_sample: bool = False
+    session_id: Optional[Hashable] = None
+    seed: Optional[int] = None
+    stop_sequences: Tuple[str, ...] = ()
+    adapter: Optional[str] = None
+
+
+class GenerationHandle:
+    """Caller-side view of a submitted request: iterate it for token ids or call result()"""
+
+    _END = object()
+
+    def __init__(self, request: GenerationRequest):
+        self.request = request
+        self.output_ids: List[int] = []
+        self.error: Optional[BaseException] = None
+        self.submitted_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_reason: Optional[str] = None
+        self._tokens: "queue.Queue" = queue.Queue()
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def cancel(self, reason: Optional[str] = None):
+        """
+        Ask the scheduler to drop this request at the next token boundary.
+
+        Args:
+            reason: Why the client abandoned the request ("cleared", "superseded",
+                "disconnected"); None when it simply has all the reply it needs.
+                Abandoned requests count as reclaimed compute and leave nothing
+                in the prefix cache.
+        """
+        if not self._cancelled.is_set() and not self.done:
+            self.cancel_reason = reason
+        self._cancelled.set()
+
+    def __iter__(self) -> Iterator[int]:
+        while True:
+            token = self._tokens.get()
+            if token is self._END:
+                break
+            yield token
+        if self.error is not None:
+            raise self.error
+
+    def result(self, timeout: Optional[float] = None) -> List[int]:
+        """Block until generation finishes and return the generated token ids"""
+        if not self._done.wait(timeout):
+            raise TimeoutError("Generation did not finish in time")
+        if self.error is not None:
+            raise self.error
+        return list(self.output_ids)
+
+    # Scheduler side
+    def _emit(self, token: int):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.output_ids.append(token)
+        self._tokens.put(token)
+
+    def _finish(self, error: Optional[BaseException] = None):
+        self.error = error
+        self.finished_at = time.perf_counter()
+        self._done.set()
+        self._tokens.put(self._END)
+
+
+class _Sequence:
+    """Per-row decoding state kept by the scheduler"""
+
+    def __init__(self, handle: GenerationHandle, vocab_size: int, device, tokenizer):
+        self.handle = handle
+        self.request = handle.request
+        self.stop = None
+        if self.request.stop_sequences:
+            self.stop = StopSequenceCriteria(tokenizer, self.request.stop_sequences)
+        self.seen = None
+        if self.request.repetition_penalty != 1.0:
+            self.seen = torch.zeros(vocab_size, dtype=torch.bool, device=device)
+            self.seen[torch.tensor(self.request.input_ids, device=device)] = True
+        self.generator = None
+        if self.request.seed is not None:
+            self.generator = torch.Generator(device=device).manual_seed(self.request.seed)
+
+
+class _Prefill:
+    """A long prompt being prefilled one chunk per scheduler iteration"""
+
+    def __init__(self, handle: GenerationHandle, done: int = 0, cache=None):
+        self.handle = handle
+        self.done = done  # Prompt tokens already in `cache`
+        self.cache = cache  # Legacy cache, or the request's BlockTable with a paged KV cache
+
+
+class BatchScheduler:
+    """
+    Single background thread that owns the model and steps every active request.
+
+    Args:
+        model: Loaded causal LM; other threads that call it must hold model_lock
+        tokenizer: Matching tokenizer, used for eos/pad ids
+        max_batch_size: Maximum number of sequences decoded together
+        prefix_cache: Optional store that lets a session's next turn skip re-prefilling its history
+        adapters: Optional LoRA adapters on the same model; requests name theirs and still share a batch
+        prefill_chunk: Prompt tokens prefilled per iteration (0: whole prompts at once). Longer prompts
+            are prefilled in chunks of this size between decode steps, so one long prompt cannot
+            stall every running sequence for its whole prefill
+        kv_cache: Optional paged KV cache. Rows then keep their KV in its blocks, share
+            blocks of common prompt prefixes (it replaces prefix_cache), and a request
+            only starts once free blocks cover its prompt plus max_new_tokens
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        max_batch_size: int = 8,
+        prefix_cache: Optional[PrefixCache] = None,
+        adapters: Optional[AdapterCache] = None,
+        prefill_chunk: int = 0,
+        kv_cache: Optional[PagedKVCache] = None,
+    ):
+        if kv_cache is not None and prefix_cache is not None:
+            raise ValueError("A paged KV cache shares prompt prefixes itself; pass prefix_cache=None")
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prefix_cache = prefix_cache
+        self.adapters = adapters
+        self.device = model.device
+        self.max_batch_size = max_batch_size
+        self.prefill_chunk = max(0, prefill_chunk)
+        self.kv_cache = kv_cache
+        eos = getattr(model.generation_config, "eos_token_id", None)
+        if eos is None:
+            eos = tokenizer.eos_token_id
+        self.eos_token_ids = set(eos if isinstance(eos, (list, tuple)) else [eos]) - {None}
+        self.pad_token_id = tokenizer.pad_token_id
+        if self.pad_token_id is None:
+            self.pad_token_id = min(self.eos_token_ids) if self.eos_token_ids else 0
+        # Held for every model call and adapter swap; speculative decoding's model.generate takes it too
+        self.model_lock = threading.Lock()
+        self._pending: "queue.Queue[GenerationHandle]" = queue.Queue()
+        self._deferred: Deque[GenerationHandle] = deque()  # Waiting, in order, for KV blocks
+        self._tables: Dict[GenerationHandle, BlockTable] = {}
+        self._running: List[_Sequence] = []
+        self._prefilling: List[_Prefill] = []
+        self._past = None
+        self._attention_mask: Optional[torch.Tensor] = None
+        self._next_tokens: Optional[torch.Tensor] = None
+        self._closed = False
+        self._stats = {"requests": 0, "steps": 0, "prefills": 0, "generated_tokens": 0, "errors": 0, "stopped_early": 0, "prefill_seconds": 0.0, "prefill_chunks": 0, "cancelled": 0, "reclaimed_tokens": 0}
+        self._thread = threading.Thread(target=self._loop, name="batch-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, input_ids: List[int], **params) -> GenerationHandle:
+        """Queue a prompt for generation; returns immediately"""
+        if self._closed:
+            raise RuntimeError("Scheduler is closed")
+        handle = GenerationHandle(GenerationRequest(input_ids=list(input_ids), **params))
+        self._pending.put(handle)
+        return handle
+
+    def generate(self, input_ids: List[int], **params) -> List[int]:
+        """Blocking convenience wrapper around submit()"""
+        return self.submit(input_ids, **params).result()
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["running"] = len(self._running)
+        stats["prefilling"] = len(self._prefilling)
+        stats["pending"] = self._pending.qsize() + len(self._deferred)
+        if self.kv_cache is not None:
+            stats["deferred"] = len(self._deferred)
+            stats["kv_cache"] = self.kv_cache.stats()
+        if self.prefix_cache is not None:
+            stats["prefix_cache"] = self.prefix_cache.stats()
+        if self.adapters is not None:
+            stats["adapters"] = self.adapters.stats()
+        return stats
+
+    def close(self):
+        self._closed = True
+        self._thread.join(timeout=5)
+
+    # Scheduler loop
+    def _loop(self):
+        with torch.inference_mode():
+            while not self._closed:
+                try:
+                    self._admit(block=not self._running and not self._prefilling)
+                    if self._prefilling:
+                        self._prefill_next()
+                    if self._running:
+                        self._step()
+                except Exception as e:
+                    logger.error(f"Batch step failed: {e}", exc_info=True)
+                    self._stats["errors"] += 1
+                    self._fail_running(e)
+                if self.kv_cache is not None:
+                    self._release_tables()
+
+    def _admit(self, block: bool):
+        """Move pending requests into the running batch, prefilling them together"""
+        new: List[GenerationHandle] = []
+        if block:
+            handle = self._take(timeout=0.1)
+            if handle is None:
+                return
+            new.append(handle)
+        while len(self._running) + len(self._prefilling) + len(new) < self.max_batch_size:
+            handle = self._take()
+            if handle is None:
+                break
+            new.append(handle)
+        admitted = []
+        for index, handle in enumerate(new):
+            if handle.cancelled:
+                if handle.cancel_reason is not None:
+                    self._count_cancelled(handle, prefill_tokens=len(handle.request.input_ids))
+                handle._finish()
+            elif not handle.request.input_ids or handle.request.max_new_tokens <= 0:
+                handle._finish()
+            elif handle.request.adapter is not None and not self._load_adapter(handle, admitted):
+                continue
+            elif self.kv_cache is not None and not self._reserve(handle):
+                if handle.done:
+                    continue
+                # Not enough free blocks yet; keep arrival order so long prompts are not starved
+                self._deferred.extendleft(reversed(new[index:]))
+                break
+            else:
+                admitted.append(handle)
+        if not admitted:
+            return
+        if self.prefill_chunk:
+            self._queue_prefill(admitted)
+            return
+        try:
+            self._prefill(admitted)
+        except Exception as e:
+            logger.error(f"Prefill failed: {e}", exc_info=True)
+            self._stats["errors"] += 1
+            running = {id(seq.handle) for seq in self._running}
+            for handle in admitted:
+                if not handle.done and id(handle) not in running:
+                    handle._finish(e)
+
+    def _take(self, timeout: Optional[float] = None) -> Optional[GenerationHandle]:
+        """Next request to admit: one waiting for KV blocks first, then the queue"""
+        if self._deferred:
+            return self._deferred.popleft()
+        try:
+            return self._pending.get(timeout=timeout) if timeout else self._pending.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _reserve(self, handle: GenerationHandle) -> bool:
+        """Reserve KV blocks for the prompt plus max_new_tokens; False if the request must wait (or failed)"""
+        request = handle.request
+        try:
+            table = self.kv_cache.admit(request.input_ids, request.max_new_tokens, adapter=request.adapter)
+        except ValueError as e:
+            logger.warning(f"Request rejected: {e}")
+            handle._finish(e)
+            return False
+        if table is None:
+            return False
+        self._tables[handle] = table
+        return True
+
+    def _release_tables(self):
+        """Return the KV blocks of finished requests; abandoned ones leave no prefix behind"""
+        for handle in [h for h in self._tables if h.done]:
+            self.kv_cache.release(self._tables.pop(handle), keep=handle.cancel_reason is None)
+
+    def _load_adapter(self, handle: GenerationHandle, admitted: List[GenerationHandle]) -> bool:
+        """Make the request's adapter available, keeping those of running and admitted rows; fails the request if it cannot"""
+        try:
+            if self.adapters is None:
+                raise ValueError("This server has no LoRA adapters")
+            in_use = {seq.request.adapter for seq in self._running} | {h.request.adapter for h in admitted}
+            with self.model_lock:
+                self.adapters.ensure(handle.request.adapter, in_use=in_use - {None})
+            return True
+        except Exception as e:
+            logger.warning(f"Adapter '{handle.request.adapter}' unavailable: {e}")
+            handle._finish(e)
+            return False
+
+    def _forward(self, adapters: List[Optional[str]], **inputs):
+        """One model call; rows run under their own adapter when any row has one"""
+        with self.model_lock:
+            if self.adapters is not None:
+                return self.adapters.forward(adapters, **inputs)
+            return self.model(**inputs)
+
+    def _paged_forward(self, handles: List[GenerationHandle], token_ids: List[List[int]], **kwargs):
+        """Feed `token_ids[i]` to request i on top of its KV blocks, storing the new KV in them"""
+        batch = self.kv_cache.batch([self._tables[h] for h in handles], token_ids, self.pad_token_id)
+        out = self._forward([h.request.adapter for h in handles], **batch.inputs, use_cache=True, **kwargs)
+        batch.commit(out.past_key_values)
+        # The KV now lives in the blocks; free the gathered copy before sampling
+        out.past_key_values = None
+        return out
+
+    def _lookup(self, handle: GenerationHandle) -> Tuple[int, Optional[object]]:
+        """Prompt tokens whose KV is already cached, and that cache (None when there is none)"""
+        if self.kv_cache is not None:
+            table = self._tables[handle]
+            return table.length, table if table.length else None
+        if self.prefix_cache is not None and handle.request.session_id is not None:
+            return self.prefix_cache.lookup(
+                handle.request.session_id, handle.request.input_ids, adapter=handle.request.adapter
+            )
+        return 0, None
+
+    def _prefill(self, handles: List[GenerationHandle]):
+        """Prefill new requests, reusing cached session prefixes where possible"""
+        fresh = []
+        for handle in handles:
+            reused, cache = self._lookup(handle)
+            if cache is None:
+                fresh.append(handle)
+            else:
+                self._prefill_suffix(handle, reused, cache)
+        if fresh:
+            self._prefill_batch(fresh)
+
+    def _queue_prefill(self, handles: List[GenerationHandle]):
+        """Line up admitted requests for chunked prefill, starting after any cached session prefix"""
+        for handle in handles:
+            reused, cache = self._lookup(handle)
+            self._prefilling.append(_Prefill(handle, reused, cache))
+
+    def _prefill_next(self):
+        """
+        Spend one iteration's prefill budget.
+
+        The oldest prompt gets its next chunk first when it is too long to
+        prefill whole (or resumes a cached prefix), so a stream of short
+        prompts cannot starve it. Fresh prompts that fit what is left of the
+        budget together are prefilled as one batch.
+        """
+        for part in [p for p in self._prefilling if p.handle.cancelled]:
+            self._prefilling.remove(part)
+            if part.handle.cancel_reason is not None:
+                self._count_cancelled(part.handle, prefill_tokens=len(part.handle.request.input_ids) - part.done)
+            part.handle._finish()
+        if not self._prefilling:
+            return
+        budget = self.prefill_chunk
+        head = self._prefilling[0]
+        if head.cache is not None or len(head.handle.request.input_ids) > budget:
+            budget -= min(budget, len(head.handle.request.input_ids) - head.done)
+            try:
+                if not self._prefill_part(head):
+                    self._prefilling.remove(head)
+            except Exception as e:
+                self._prefill_failed([head], e)
+        batch: List[_Prefill] = []
+        for part in self._prefilling:
+            if part.cache is not None:
+                continue
+            width = max(len(p.handle.request.input_ids) for p in batch + [part])
+            if width * (len(batch) + 1) <= budget:
+                batch.append(part)
+        if not batch:
+            return
+        try:
+            self._prefilling = [p for p in self._prefilling if p not in batch]
+            self._prefill_batch([p.handle for p in batch])
+        except Exception as e:
+            self._prefill_failed(batch, e)
+
+    def _prefill_failed(self, parts: List[_Prefill], error: Exception):
+        """Fail the prompts of a prefill that raised, except rows that already joined the batch"""
+        logger.error(f"Prefill failed: {error}", exc_info=True)
+        self._stats["errors"] += 1
+        running = {id(seq.handle) for seq in self._running}
+        for part in parts:
+            if part in self._prefilling:
+                self._prefilling.remove(part)
+            if not part.handle.done and id(part.handle) not in running:
+                part.handle._finish(error)
+
+    def _prefill_part(self, part: _Prefill) -> bool:
+        """Prefill the next chunk of a long prompt; returns whether any of it is left"""
+        started = time.perf_counter()
+        request = part.handle.request
+        end = min(len(request.input_ids), part.done + self.prefill_chunk)
+        if self.kv_cache is not None:
+            attention_mask = None
+            out = self._paged_forward([part.handle], [request.input_ids[part.done:end]], logits_to_keep=1)
+        else:
+            attention_mask = torch.ones((1, end), dtype=torch.long, device=self.device)
+            out = self._forward(
+                [request.adapter],
+                input_ids=torch.tensor([request.input_ids[part.done:end]], device=self.device),
+                attention_mask=attention_mask,
+                position_ids=torch.arange(part.done, end, device=self.device).unsqueeze(0),
+                past_key_values=from_legacy(part.cache) if part.cache is not None else None,
+                use_cache=True,
+                logits_to_keep=1,
+            )
+        self._stats["prefill_chunks"] += 1
+        if end == len(request.input_ids):
+            self._admit_rows([part.handle], out, attention_mask, started)
+            return False
+        part.done = end
+        part.cache = self._tables[part.handle] if self.kv_cache is not None else to_legacy(out.past_key_values)
+        elapsed = time.perf_counter() - started
+        self._stats["prefill_seconds"] += elapsed
+        PREFILL.observe(elapsed)
+        return True
+
+    def _prefill_batch(self, handles: List[GenerationHandle]):
+        started = time.perf_counter()
+        if self.kv_cache is not None:
+            out = self._paged_forward(handles, [h.request.input_ids for h in handles])
+            self._admit_rows(handles, out, None, started)
+            return
+        lengths = [len(h.request.input_ids) for h in handles]
+        width = max(lengths)
+        input_ids = torch.full((len(handles), width), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(handles), width), dtype=torch.long)
+        for row, (handle, length) in enumerate(zip(handles, lengths)):
+            input_ids[row, width - length:] = torch.tensor(handle.request.input_ids)
+            attention_mask[row, width - length:] = 1
+        input_ids = input_ids.to(self.device)
+        attention_mask = attention_mask.to(self.device)
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+
+        out = self._forward(
+            [h.request.adapter for h in handles],
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            use_cache=True,
+        )
+        self._admit_rows(handles, out, attention_mask, started)
+
+    def _prefill_suffix(self, handle: GenerationHandle, reused: int, cache):
+        """Prefill only the tokens after a cached prefix"""
+        started = time.perf_counter()
+        if self.kv_cache is not None:
+            out = self._paged_forward([handle], [handle.request.input_ids[reused:]])
+            self._admit_rows([handle], out, None, started)
+            return
+        length = len(handle.request.input_ids)
+        suffix = torch.tensor([handle.request.input_ids[reused:]], device=self.device)
+        attention_mask = torch.ones((1, length), dtype=torch.long, device=self.device)
+        out = self._forward(
+            [handle.request.adapter],
+            input_ids=suffix,
+            attention_mask=attention_mask,
+            position_ids=torch.arange(reused, length, device=self.device).unsqueeze(0),
+            past_key_values=from_legacy(cache),
+            use_cache=True,
+        )
+        self._admit_rows([handle], out, attention_mask, started)
+
+    def _admit_rows(self, handles: List[GenerationHandle], out, attention_mask: Optional[torch.Tensor], started: float):
+        """Sample the first token of freshly prefilled rows and merge them into the running batch"""
+        self._stats["prefills"] += 1
+        seqs = [_Sequence(h, out.logits.shape[-1], self.device, self.tokenizer) for h in handles]
+        next_tokens = self._sample(out.logits[:, -1, :], seqs)
+        elapsed = time.perf_counter() - started
+        self._stats["prefill_seconds"] += elapsed
+        PREFILL.observe(elapsed)
+
+        if self.kv_cache is not None:
+            # The rows' KV is already in their blocks
+            self._next_tokens = torch.cat([self._next_tokens, next_tokens]) if self._running else next_tokens
+        elif self._running:
+            past = to_legacy(out.past_key_values)
+            length = max(cache_length(self._past), cache_length(past))
+            self._past = cat_batch([left_pad(self._past, length), left_pad(past, length)])
+            self._attention_mask = torch.cat([
+                torch.nn.functional.pad(self._attention_mask, (length - self._attention_mask.shape[1], 0)),
+                torch.nn.functional.pad(attention_mask, (length - attention_mask.shape[1], 0)),
+            ])
+            self._next_tokens = torch.cat([self._next_tokens, next_tokens])
+        else:
+            self._past, self._attention_mask, self._next_tokens = to_legacy(out.past_key_values), attention_mask, next_tokens
+        start = len(self._running)
+        self._running.extend(seqs)
+        self._stats["requests"] += len(seqs)
+        self._record(next_tokens, start)
+
+    def _step(self):
+        """Feed each running sequence its last token and sample the next one"""
+        started = time.perf_counter()
+        if self.kv_cache is not None:
+            out = self._paged_forward([seq.handle for seq in self._running], [[t] for t in self._next_tokens.tolist()])
+        else:
+            attention_mask = torch.nn.functional.pad(self._attention_mask, (0, 1), value=1)
+            position_ids = attention_mask.sum(-1, keepdim=True) - 1
+            out = self._forward(
+                [seq.request.adapter for seq in self._running],
+                input_ids=self._next_tokens.unsqueeze(-1),
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=from_legacy(self._past),
+                use_cache=True,
+            )
+            self._past = to_legacy(out.past_key_values)
+            self._attention_mask = attention_mask
+        self._stats["steps"] += 1
+        self._next_tokens = self._sample(out.logits[:, -1, :], self._running)
+        DECODE_STEP.observe(time.perf_counter() - started)
+        self._record(self._next_tokens)
+
+    def _record(self, tokens: torch.Tensor, start: int = 0):
+        """Hand tokens sampled for rows start.. to their callers and evict finished rows"""
+        keep = list(range(start))
+        emitted = 0
+        for row, token in enumerate(tokens.tolist(), start):
+            seq = self._running[row]
+            handle = seq.handle
+            if handle.cancel_reason is not None:
+                self._count_cancelled(handle, prefill_tokens=0)
+                handle._finish()
+                continue
+            if token in self.eos_token_ids or handle.cancelled:
+                self._save_prefix(row)
+                handle._finish()
+                continue
+            handle._emit(token)
+            emitted += 1
+            if seq.stop is not None and seq.stop.matches(handle.output_ids):
+                self._stats["stopped_early"] += 1
+                self._save_prefix(row)
+                handle._finish()
+                continue
+            if len(handle.output_ids) >= seq.request.max_new_tokens:
+                self._save_prefix(row)
+                handle._finish()
+                continue
+            keep.append(row)
+        self._stats["generated_tokens"] += emitted
+        GENERATED_TOKENS.inc(emitted)
+        if len(keep) == len(self._running):
+            return
+        self._evict(keep)
+
+    def _count_cancelled(self, handle: GenerationHandle, prefill_tokens: int):
+        """Account for the compute an abandoned request no longer needs (`prefill_tokens` never prefilled)"""
+        request = handle.request
+        decode_tokens = max(0, request.max_new_tokens - len(handle.output_ids))
+        self._stats["cancelled"] += 1
+        self._stats["reclaimed_tokens"] += prefill_tokens + decode_tokens
+        record_cancelled(prefill_tokens, decode_tokens)
+        logger.debug(f"Dropped {handle.cancel_reason} request after {len(handle.output_ids)} tokens")
+
+    def _save_prefix(self, row: int):
+        """Keep a finished session row's KV cache for that session's next turn"""
+        seq = self._running[row]
+        if self.prefix_cache is None or seq.request.session_id is None:
+            return
+        # Real tokens in this row; the last sampled token has not been fed yet
+        length = int(self._attention_mask[row].sum())
+        token_ids = (seq.request.input_ids + seq.handle.output_ids)[:length]
+        cache = tuple((k[row:row + 1, :, -length:].clone(), v[row:row + 1, :, -length:].clone()) for k, v in self._past)
+        self.prefix_cache.store(seq.request.session_id, token_ids, cache, adapter=seq.request.adapter)
+
+    def _evict(self, keep: List[int]):
+        if not keep:
+            self._running, self._past, self._attention_mask, self._next_tokens = [], None, None, None
+            return
+        rows = torch.tensor(keep, device=self.device)
+        self._running = [self._running[i] for i in keep]
+        self._next_tokens = self._next_tokens[rows]
+        if self.kv_cache is not None:
+            return  # Finished rows' blocks are released by the loop
+        attention_mask = self._attention_mask[rows]
+        # Columns that are padding for every remaining row can go
+        trim = int(attention_mask.any(0).long().argmax())
+        self._past = select_rows(self._past, rows, trim)
+        self._attention_mask = attention_mask[:, trim:]
+
+    def _fail_running(self, error: BaseException):
+        for seq in self._running:
+            seq.handle._finish(error)
+        self._evict([])
+
+    def _sample(self, logits: torch.Tensor, seqs: List[_Sequence]) -> torch.Tensor:
+        """Pick the next token for every row using that row's own parameters"""
+        logits = logits.float()
+        tokens = []
+        for row, seq in enumerate(seqs):
+            request = seq.request
+            scores = logits[row]
+            if seq.seen is not None:
+                penalized = scores[seq.seen]
+                scores[seq.seen] = torch.where(
+                    penalized < 0, penalized * request.repetition_penalty, penalized / request.repetition_penalty
+                )
+            if not request.do_sample or request.temperature <= 0:
+                token = scores.argmax()
+            else:
+                scores = scores / request.temperature
+                if request.top_p < 1.0:
+                    sorted_scores, sorted_idx = scores.sort(descending=True)
+                    cumulative = sorted_scores.softmax(-1).cumsum(-1)
+                    remove = cumulative > request.top_p
+                    remove[1:] = remove[:-1].clone()
+                    remove[0] = False
+                    scores[sorted_idx[remove]] = float("-inf")
+                token = torch.multinomial(scores.softmax(-1), 1, generator=seq.generator)[0]
+            if seq.seen is not None:
+                seq.seen[token] = True
+            tokens.append(token)
+        return torch.stack(tokens)
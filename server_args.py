@@ -0,0 +1,43 @@
+"""
+Command-line and environment configuration shared by app.py and chat_app.py
+Flags win over R2D2_* environment variables, which win over the defaults.
+"""
+
+import argparse
+import os
+from typing import Optional
+
+# Where the launcher downloads the model and prepares its fast-loading copy; both apps load it from here
+MODEL_PATH = "models/deepseek-coder-1.3b-instruct"
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    return default if value is None else value.lower() not in ("0", "false", "no", "")
+
+
+def server_arg_parser(description: str, default_port: Optional[int], metrics_port: int) -> argparse.ArgumentParser:
+    """
+    Parser with the options every app server takes; apps add their own before parsing.
+
+    Args:
+        description: Shown by --help
+        default_port: UI port when neither --port nor R2D2_PORT is given (None: first free port from 7860)
+        metrics_port: Default for --metrics-port (also serves /health and /ready; 0 disables)
+    """
+    env_port = os.environ.get("R2D2_PORT")
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--host", default=os.environ.get("R2D2_HOST", "0.0.0.0"), help="Interface to bind (R2D2_HOST)")
+    parser.add_argument(
+        "--port", type=int, default=int(env_port) if env_port else default_port,
+        help="Gradio UI port (R2D2_PORT)",
+    )
+    parser.add_argument(
+        "--share", action=argparse.BooleanOptionalAction, default=_env_flag("R2D2_SHARE", True),
+        help="Create a public Gradio share link (R2D2_SHARE)",
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=metrics_port,
+        help="Port for /metrics, /health and /ready (R2D2_METRICS_PORT, 0 disables)",
+    )
+    return parser
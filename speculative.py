@@ -0,0 +1,79 @@
+"""
+Speculative decoding options for model.generate
+Drafts come either from n-gram lookup in the prompt and history (no second
+model; good for "fix/refactor this snippet" replies that copy long spans) or
+from a small draft model; the main model verifies a whole draft in one pass.
+"""
+
+import logging
+from typing import Any, Dict
+
+from device import load_causal_lm
+
+logger = logging.getLogger("deepseek_speculative")
+
+MODES = ("off", "ngram", "draft")
+
+# Draft tokens proposed per step by prompt lookup
+NGRAM_DRAFT_TOKENS = 10
+# Longest n-gram matched against the prompt when looking up a draft
+NGRAM_MAX_MATCH = 3
+
+
+def speculative_kwargs(
+    mode: str,
+    draft_model=None,
+    num_draft_tokens: int = NGRAM_DRAFT_TOKENS,
+    max_matching_ngram: int = NGRAM_MAX_MATCH,
+) -> Dict[str, Any]:
+    """
+    Extra model.generate arguments for a speculative decoding mode.
+
+    Args:
+        mode: One of MODES
+        draft_model: Small model sharing the main tokenizer, used by "draft"
+        num_draft_tokens: Tokens proposed per step by n-gram lookup
+        max_matching_ngram: Longest n-gram matched by the lookup
+
+    Returns:
+        Keyword arguments to merge into the generate call (empty for "off")
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown speculative mode {mode!r}, expected one of {MODES}")
+    if mode == "ngram":
+        return {"prompt_lookup_num_tokens": num_draft_tokens, "max_matching_ngram_size": max_matching_ngram}
+    if mode == "draft":
+        if draft_model is None:
+            logger.warning("No draft model loaded, falling back to n-gram lookup")
+            return speculative_kwargs("ngram", num_draft_tokens=num_draft_tokens, max_matching_ngram=max_matching_ngram)
+        return {"assistant_model": draft_model}
+    return {}
+
+
+def load_draft_model(model_path: str, config, main_model=None):
+    """
+    Load a small draft model on the same device/precision as the main model.
+
+    Args:
+        model_path: Local path of the draft model
+        config: DeviceConfig of the main model
+        main_model: Main model, used to check that the vocabularies match
+
+    Returns:
+        The draft model, or None if it could not be loaded
+    """
+    try:
+        draft = load_causal_lm(model_path, config)
+    except Exception as e:
+        logger.error(f"Could not load draft model from {model_path}: {e}")
+        return None
+    if main_model is not None and draft.config.vocab_size != main_model.config.vocab_size:
+        logger.error(
+            f"Draft vocabulary ({draft.config.vocab_size}) differs from the main model "
+            f"({main_model.config.vocab_size}); a draft model must share the main tokenizer"
+        )
+        return None
+    draft.generation_config.num_assistant_tokens = 5
+    draft.generation_config.num_assistant_tokens_schedule = "heuristic"
+    logger.info(f"Draft model loaded from {model_path}")
+    return draft
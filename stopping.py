@@ -0,0 +1,74 @@
+"""
+Stop-sequence detection for generation
+Checks the decoded tail of each row for stop strings (next user turn, EOS text,
+code fence closers) so generation ends as soon as a row has finished instead
+of running to max_new_tokens.
+"""
+
+from typing import Dict, Iterable, Sequence
+
+import torch
+from transformers import StoppingCriteria
+
+# Closing fence of a markdown code block; stop on it when only the code is wanted
+FENCE_CLOSER = "\n```\n"
+# Name that stands for FENCE_CLOSER in R2D2_STOP_SEQUENCES
+FENCE = "fence"
+
+
+def stop_sequences_from_env(environ: Dict[str, str], defaults: Iterable[str] = ()) -> tuple:
+    """
+    `defaults` plus the stop strings listed in R2D2_STOP_SEQUENCES.
+
+    The variable is comma-separated; backslash escapes such as \\n are decoded
+    and the word `fence` adds FENCE_CLOSER (replies then end after their first
+    code block).
+    """
+    stops = list(defaults)
+    for item in environ.get("R2D2_STOP_SEQUENCES", "").split(","):
+        if item.strip() == FENCE:
+            stops.append(FENCE_CLOSER)
+        elif item:
+            stops.append(item.encode("latin-1", "backslashreplace").decode("unicode_escape"))
+    return tuple(dict.fromkeys(stops))
+
+
+def with_eos_text(tokenizer, stop_sequences: Iterable[str]) -> tuple:
+    """Add the tokenizer's EOS text, for models that emit an end-of-turn token not listed as eos_token_id"""
+    stops = list(stop_sequences)
+    if tokenizer.eos_token:
+        stops.append(tokenizer.eos_token)
+    return tuple(dict.fromkeys(stops))
+
+
+class StopSequenceCriteria(StoppingCriteria):
+    """
+    Per-row stop-string check over the last few generated tokens.
+
+    Only the tail is decoded (enough tokens to cover the longest stop string),
+    and special tokens are kept so EOS-like markers are matched as text.
+
+    Args:
+        tokenizer: Tokenizer used to decode the tail
+        stop_sequences: Strings that finish a row
+        prompt_length: Width of the prompt in the input_ids passed by generate
+    """
+
+    def __init__(self, tokenizer, stop_sequences: Sequence[str], prompt_length: int = 0):
+        self.tokenizer = tokenizer
+        self.stop_sequences = tuple(s for s in stop_sequences if s)
+        self.prompt_length = prompt_length
+        # A stop string spans at most one token per character, plus partial bytes
+        self.tail_tokens = max((len(s) for s in self.stop_sequences), default=0) + 2
+
+    def matches(self, generated_ids: Sequence[int]) -> bool:
+        """True once the generated ids end in (or just passed) a stop sequence"""
+        if not self.stop_sequences or not generated_ids:
+            return False
+        tail = self.tokenizer.decode(generated_ids[-self.tail_tokens:], skip_special_tokens=False)
+        return any(stop in tail for stop in self.stop_sequences)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        generated = input_ids[:, self.prompt_length:].tolist()
+        done = [self.matches(row) for row in generated]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
@@ -0,0 +1,268 @@
+"""
+Token streaming helpers for DeepSeek Coder
+Yields reply text as it is decoded, from model.generate or the batch scheduler
+"""
+
+import logging
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+
+from cancellation import DISCONNECTED
+from metrics import DECODE_STEP, DETOKENIZE, GENERATED_TOKENS, PREFILL
+from stopping import StopSequenceCriteria
+
+logger = logging.getLogger("deepseek_streaming")
+
+
+class EventStoppingCriteria(StoppingCriteria):
+    """Stop generation once a threading.Event is set by the consumer"""
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+class IncrementalDetokenizer:
+    """
+    Emit text deltas for a growing token sequence without re-decoding all of it.
+
+    Each step decodes only a short window: the tokens already emitted since the
+    previous boundary (for context, so leading spaces and merges come out right)
+    plus the new ones. Output is held back while it ends in a partial
+    multi-byte character.
+    """
+
+    def __init__(self, tokenizer, skip_special_tokens: bool = True):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.ids: List[int] = []
+        self.seconds = 0.0
+        self._prefix_offset = 0
+        self._read_offset = 0
+
+    def _decode(self, ids: List[int]) -> str:
+        return self.tokenizer.decode(ids, skip_special_tokens=self.skip_special_tokens)
+
+    def push(self, token: int) -> str:
+        """Add one token and return the newly completed text (possibly empty)"""
+        started = time.perf_counter()
+        self.ids.append(token)
+        prefix_text = self._decode(self.ids[self._prefix_offset:self._read_offset])
+        new_text = self._decode(self.ids[self._prefix_offset:])
+        delta = ""
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            self._prefix_offset = self._read_offset
+            self._read_offset = len(self.ids)
+            delta = new_text[len(prefix_text):]
+        self.seconds += time.perf_counter() - started
+        return delta
+
+    def flush(self) -> str:
+        """Text still held back at the end of the sequence"""
+        prefix_text = self._decode(self.ids[self._prefix_offset:self._read_offset])
+        new_text = self._decode(self.ids[self._prefix_offset:])
+        self._prefix_offset = self._read_offset = len(self.ids)
+        return new_text[len(prefix_text):]
+
+
+class TimingStreamer(BaseStreamer):
+    """
+    model.generate streamer that records prefill and per-step decode time.
+
+    generate() puts the prompt first, then the tokens of each step.
+    """
+
+    def __init__(self):
+        self._last: Optional[float] = None
+        self._prefilled = False
+
+    def put(self, value: torch.Tensor):
+        now = time.perf_counter()
+        if self._last is None:
+            self._last = now
+            return
+        (DECODE_STEP if self._prefilled else PREFILL).observe(now - self._last)
+        self._prefilled = True
+        self._last = now
+        tokens = value.reshape(-1).tolist()
+        GENERATED_TOKENS.inc(len(tokens))
+        self.on_tokens(tokens)
+
+    def on_tokens(self, tokens: List[int]):
+        pass
+
+    def end(self):
+        pass
+
+
+class DeltaStreamer(TimingStreamer):
+    """Streamer that queues incremental text deltas (prompt skipped)"""
+
+    _END = object()
+
+    def __init__(self, tokenizer):
+        super().__init__()
+        self.detokenizer = IncrementalDetokenizer(tokenizer)
+        self._queue: "queue.Queue" = queue.Queue()
+
+    def on_tokens(self, tokens: List[int]):
+        for token in tokens:
+            delta = self.detokenizer.push(token)
+            if delta:
+                self._queue.put(delta)
+
+    def end(self):
+        delta = self.detokenizer.flush()
+        DETOKENIZE.observe(self.detokenizer.seconds)
+        if delta:
+            self._queue.put(delta)
+        self._queue.put(self._END)
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            delta = self._queue.get()
+            if delta is self._END:
+                return
+            yield delta
+
+
+def _stop_holdback(text: str, stop_sequences: Sequence[str]) -> int:
+    """Number of trailing characters that could be the start of a stop sequence"""
+    holdback = 0
+    for stop in stop_sequences:
+        for size in range(min(len(stop) - 1, len(text)), holdback, -1):
+            if text.endswith(stop[:size]):
+                holdback = size
+                break
+    return holdback
+
+
+def iter_until_stop(
+    deltas: Iterable[str],
+    stop_sequences: Sequence[str] = (),
+    on_stop: Optional[Callable[[], None]] = None,
+) -> Iterator[str]:
+    """
+    Accumulate text deltas and yield the visible text after each one.
+
+    Text that could still turn into a stop sequence is held back until it is
+    resolved, so a partial "\\n\\nUser:" never flashes up in the UI.
+
+    Args:
+        deltas: Iterable of decoded text fragments
+        stop_sequences: Strings that end the response when they appear
+        on_stop: Called once when a stop sequence is found
+
+    Returns:
+        Iterator over the accumulated response text
+    """
+    text = ""
+    visible = 0
+    longest = max((len(s) for s in stop_sequences), default=0)
+    for delta in deltas:
+        if not delta:
+            continue
+        # Only the new text and the tail before it can complete a stop sequence
+        search_from = max(0, len(text) - longest)
+        text += delta
+        cut = min((i for i in (text.find(s, search_from) for s in stop_sequences) if i >= 0), default=-1)
+        if cut >= 0:
+            if on_stop is not None:
+                on_stop()
+            yield text[:cut]
+            return
+        visible = len(text) - _stop_holdback(text, stop_sequences)
+        yield text[:visible]
+    if visible < len(text):
+        yield text
+
+
+def stream_generate(
+    model,
+    tokenizer,
+    input_ids: torch.LongTensor,
+    stop_sequences: Sequence[str] = (),
+    lock: Optional[threading.Lock] = None,
+    **generate_kwargs,
+) -> Iterator[str]:
+    """
+    Run model.generate on a background thread and stream the reply.
+
+    Args:
+        model: Loaded causal LM
+        tokenizer: Matching tokenizer
+        input_ids: Prompt token ids, already on the model device
+        stop_sequences: Strings that end the response; checked per generated token
+        lock: Held while model.generate runs, e.g. the model_lock of a BatchScheduler on the same model
+        **generate_kwargs: Forwarded to model.generate
+
+    Returns:
+        Iterator over the accumulated response text (prompt excluded)
+    """
+    streamer = DeltaStreamer(tokenizer)
+    stop_event = threading.Event()
+    criteria = StoppingCriteriaList(generate_kwargs.pop("stopping_criteria", None) or [])
+    if stop_sequences:
+        criteria.append(StopSequenceCriteria(tokenizer, stop_sequences, prompt_length=input_ids.shape[1]))
+    criteria.append(EventStoppingCriteria(stop_event))
+    errors: list = []
+
+    def run():
+        try:
+            with lock or nullcontext(), torch.no_grad():
+                model.generate(input_ids, streamer=streamer, stopping_criteria=criteria, **generate_kwargs)
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    thread = threading.Thread(target=run, name="generate-stream", daemon=True)
+    thread.start()
+    try:
+        yield from iter_until_stop(streamer, stop_sequences, on_stop=stop_event.set)
+    finally:
+        # Covers early stops and consumers that walk away mid-stream
+        stop_event.set()
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def decode_tokens(tokenizer, token_ids: Iterable[int]) -> Iterator[str]:
+    """Turn a stream of token ids into text deltas"""
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    try:
+        for token in token_ids:
+            delta = detokenizer.push(token)
+            if delta:
+                yield delta
+        delta = detokenizer.flush()
+        if delta:
+            yield delta
+    finally:
+        DETOKENIZE.observe(detokenizer.seconds)
+
+
+def stream_handle(handle, tokenizer, stop_sequences: Sequence[str] = ()) -> Iterator[str]:
+    """
+    Stream the reply of a scheduler GenerationHandle.
+
+    The request is cancelled as soon as a stop sequence shows up or the
+    consumer stops iterating, which frees its batch slot; a consumer that
+    walks away before the reply is complete counts as disconnected.
+
+    Returns:
+        Iterator over the accumulated response text
+    """
+    try:
+        yield from iter_until_stop(decode_tokens(tokenizer, handle), stop_sequences, on_stop=handle.cancel)
+    finally:
+        handle.cancel(DISCONNECTED)
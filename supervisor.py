@@ -0,0 +1,268 @@
+"""
+Supervisor for an app server process
+Starts the server, streams its output, polls its /health probe for readiness
+and live request/token rates, and restarts it with exponential backoff when it
+exits, never becomes ready, or stops making progress. Used by launcher.py and
+usable headless:
+
+    python -m supervisor --health-url http://127.0.0.1:9100/health -- python chat_app.py --no-share
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+from urllib.error import URLError
+from urllib.request import urlopen
+
+logger = logging.getLogger("deepseek_supervisor")
+
+
+class Supervisor:
+    """
+    Keep one server process alive and report its state.
+
+    Args:
+        command: Server command line (no shell)
+        health_url: The server's /health endpoint (see metrics.start_http_server)
+        on_line: Called with every output line of the server (from a reader thread)
+        on_stats: Called with a stats dict after every poll and state change
+        poll_interval: Seconds between health polls
+        start_timeout: Restart if the model is not ready this long after a start
+        wedge_timeout: Restart if health fails, or requests are in flight without a new token, this long
+        backoff: (first, max) seconds to wait before a restart, doubling per consecutive failure
+        stable_after: Seconds of healthy uptime that reset the backoff
+    """
+
+    def __init__(
+        self,
+        command: List[str],
+        health_url: str,
+        on_line: Optional[Callable[[str], None]] = None,
+        on_stats: Optional[Callable[[dict], None]] = None,
+        poll_interval: float = 1.0,
+        start_timeout: float = 900.0,
+        wedge_timeout: float = 120.0,
+        backoff: tuple = (1.0, 60.0),
+        stable_after: float = 300.0,
+    ):
+        self.command = command
+        self.health_url = health_url
+        self.on_line = on_line or (lambda line: None)
+        self.on_stats = on_stats or (lambda stats: None)
+        self.poll_interval = poll_interval
+        self.start_timeout = start_timeout
+        self.wedge_timeout = wedge_timeout
+        self.backoff = backoff
+        self.stable_after = stable_after
+        self.restarts = 0
+        self.process: Optional[subprocess.Popen] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"state": "stopped", "restarts": 0}
+
+    def start(self) -> "Supervisor":
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="supervisor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 15.0):
+        """Stop supervising and shut the server down"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            started = time.monotonic()
+            reason = self._supervise_once()
+            if self._stop.is_set():
+                break
+            failures = 1 if time.monotonic() - started > self.stable_after else failures + 1
+            delay = min(self.backoff[1], self.backoff[0] * 2 ** (failures - 1))
+            self.restarts += 1
+            self.on_line(f"⚠️ Server {reason}; restarting in {delay:.0f}s (restart #{self.restarts})")
+            self._publish(state="restarting", reason=reason, restart_in=delay)
+            self._stop.wait(delay)
+        self._publish(state="stopped")
+
+    def _supervise_once(self) -> str:
+        """Run the server until it fails; returns why (or "stopped")"""
+        self.process = self._spawn()
+        reader = threading.Thread(target=self._read_output, args=(self.process,), name="supervisor-output", daemon=True)
+        reader.start()
+        launched = time.monotonic()
+        self._publish(state="starting", pid=self.process.pid, cold_start=None)
+        samples: deque = deque(maxlen=6)  # (time, requests, tokens) over the last few polls
+        last_ok = launched
+        last_progress = launched
+        ready = False
+        try:
+            while not self._stop.wait(self.poll_interval):
+                code = self.process.poll()
+                if code is not None:
+                    return f"exited with code {code}"
+                now = time.monotonic()
+                health = self._probe()
+                if health is None:
+                    if ready and now - last_ok > self.wedge_timeout:
+                        return f"stopped answering health checks for {self.wedge_timeout:.0f}s"
+                    if not ready and now - launched > self.start_timeout:
+                        return f"was not ready after {self.start_timeout:.0f}s"
+                    continue
+                last_ok = now
+                if not health.get("ready"):
+                    if health.get("status") == "failed":
+                        return f"failed to load the model: {health.get('error', 'unknown error')}"
+                    if now - launched > self.start_timeout:
+                        return f"was not ready after {self.start_timeout:.0f}s"
+                    self._publish(state="loading", health=health)
+                    continue
+                tokens = health.get("generated_tokens_total", 0)
+                if not ready or tokens != samples[-1][2] or not health.get("in_flight"):
+                    ready = True
+                    last_progress = now
+                elif now - last_progress > self.wedge_timeout:
+                    return f"made no progress on {health['in_flight']:.0f} requests for {self.wedge_timeout:.0f}s"
+                samples.append((now, health.get("requests_total", 0), tokens))
+                self._publish(state="ready", health=health, **self._rates(samples))
+            return "stopped"
+        finally:
+            self._terminate(self.process)
+            reader.join(5)
+
+    def _spawn(self) -> subprocess.Popen:
+        self.on_line(f"▶️ {' '.join(self.command)}")
+        # Own process group, so the share tunnel and any workers go down with the server
+        extra = {"start_new_session": True} if os.name == "posix" else {}
+        return subprocess.Popen(
+            self.command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+            env=dict(os.environ, PYTHONUNBUFFERED="1"),
+            **extra,
+        )
+
+    def _read_output(self, process: subprocess.Popen):
+        for line in process.stdout:
+            self.on_line(line.rstrip("\n"))
+
+    def _terminate(self, process: subprocess.Popen):
+        if process.poll() is not None:
+            # The server is gone; make sure nothing it started outlives it
+            if os.name == "posix":
+                self._signal(process, signal.SIGKILL)
+            return
+        self._signal(process, signal.SIGTERM)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            self._signal(process, signal.SIGKILL if os.name == "posix" else signal.SIGTERM)
+            process.wait()
+
+    @staticmethod
+    def _signal(process: subprocess.Popen, sig):
+        try:
+            if os.name == "posix":
+                os.killpg(process.pid, sig)
+            else:
+                process.terminate()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _probe(self) -> Optional[dict]:
+        try:
+            with urlopen(self.health_url, timeout=max(2.0, self.poll_interval)) as response:
+                return json.loads(response.read())
+        except (URLError, OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _rates(samples: deque) -> dict:
+        if len(samples) < 2:
+            return {"requests_per_sec": 0.0, "tokens_per_sec": 0.0}
+        (t0, r0, k0), (t1, r1, k1) = samples[0], samples[-1]
+        elapsed = max(t1 - t0, 1e-6)
+        return {"requests_per_sec": (r1 - r0) / elapsed, "tokens_per_sec": (k1 - k0) / elapsed}
+
+    def _publish(self, **changes):
+        health = changes.pop("health", None)
+        if health is not None:
+            changes.update(
+                cold_start=health.get("time_to_ready"),
+                in_flight=health.get("in_flight", 0),
+                requests_total=health.get("requests_total", 0),
+                errors_total=health.get("errors_total", 0),
+            )
+        self._stats.update(changes, restarts=self.restarts)
+        self.on_stats(dict(self._stats))
+
+
+def format_stats(stats: dict) -> str:
+    """One-line summary, e.g. for a status label"""
+    state = stats.get("state", "stopped")
+    parts = [{"ready": "🟢 Ready", "loading": "🟡 Loading model", "starting": "🟡 Starting",
+              "restarting": "🔴 Restarting", "stopped": "⚪ Stopped"}.get(state, state)]
+    if stats.get("cold_start") is not None:
+        parts.append(f"cold start {stats['cold_start']:.1f}s")
+    if state == "ready":
+        parts.append(f"{stats.get('requests_per_sec', 0):.2f} req/s")
+        parts.append(f"{stats.get('tokens_per_sec', 0):.1f} tok/s")
+        parts.append(f"{stats.get('in_flight', 0):.0f} in flight")
+    if state == "restarting" and stats.get("reason"):
+        parts.append(stats["reason"])
+    if stats.get("restarts"):
+        parts.append(f"{stats['restarts']} restarts")
+    return " · ".join(parts)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    parser = argparse.ArgumentParser(description="Run an app server under supervision")
+    parser.add_argument("--health-url", default="http://127.0.0.1:9100/health")
+    parser.add_argument("--start-timeout", type=float, default=900.0)
+    parser.add_argument("--wedge-timeout", type=float, default=120.0)
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Server command, after --")
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("no server command given")
+
+    last_state = [None]
+
+    def on_stats(stats):
+        if stats.get("state") != last_state[0]:
+            logger.info(format_stats(stats))
+        last_state[0] = stats.get("state")
+
+    supervisor = Supervisor(
+        command, args.health_url, on_line=print, on_stats=on_stats,
+        start_timeout=args.start_timeout, wedge_timeout=args.wedge_timeout,
+    ).start()
+    try:
+        while supervisor.running:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# Modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.tiny_model import build_tiny_model  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def tiny_model():
+    """Tiny random Llama and tokenizer on CPU; never emits EOS, so replies run to max_new_tokens"""
+    model, tokenizer = build_tiny_model(hidden_size=64, num_layers=2)
+    model.generation_config.eos_token_id = None
+    return model, tokenizer
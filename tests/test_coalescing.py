@@ -0,0 +1,38 @@
+import threading
+
+from benchmarks.tiny_model import CORPUS
+from coalescing import Coalescer
+from scheduler import BatchScheduler
+from streaming import stream_handle
+
+
+def test_identical_callers_share_one_scheduler_request(tiny_model):
+    model, tokenizer = tiny_model
+    prompt = tokenizer(CORPUS[0]).input_ids
+    scheduler = BatchScheduler(model, tokenizer, max_batch_size=8)
+    coalescer = Coalescer()
+    callers = 6
+    barrier = threading.Barrier(callers)
+    replies = [None] * callers
+
+    def generate(cancel):
+        handle = scheduler.submit(prompt, max_new_tokens=24, do_sample=False)
+        cancel.on_cancel(handle.cancel)
+        yield from stream_handle(handle, tokenizer)
+
+    def caller(index):
+        barrier.wait()
+        flight, _ = coalescer.join("same-prompt", generate)
+        replies[index] = list(flight.stream())
+
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = scheduler.stats()
+    scheduler.close()
+
+    assert stats["requests"] == 1
+    assert coalescer.stats()["coalesced"] == callers - 1
+    assert len({reply[-1] for reply in replies}) == 1
@@ -0,0 +1,54 @@
+import random
+
+from paged_kv import PagedKVCache
+from scheduler import BatchScheduler
+
+
+def _prompts(vocab: int, block_size: int):
+    rng = random.Random(0)
+    system = [rng.randrange(5, vocab) for _ in range(3 * block_size)]
+    prompts = [system + [rng.randrange(5, vocab) for _ in range(rng.randrange(4, 40))] for _ in range(6)]
+    return prompts + [list(prompts[0])]
+
+
+def _replies(scheduler: BatchScheduler, prompts):
+    handles = [scheduler.submit(prompt, max_new_tokens=16, do_sample=False) for prompt in prompts]
+    replies = [handle.result() for handle in handles]
+    scheduler.close()
+    return replies
+
+
+def test_paged_replies_match_contiguous(tiny_model):
+    model, tokenizer = tiny_model
+    prompts = _prompts(500, block_size=8)
+    reference = _replies(BatchScheduler(model, tokenizer, max_batch_size=4), prompts)
+
+    kv_cache = PagedKVCache.for_model(model, num_blocks=64, block_size=8)
+    scheduler = BatchScheduler(model, tokenizer, max_batch_size=4, kv_cache=kv_cache)
+    assert _replies(scheduler, prompts) == reference
+    stats = kv_cache.stats()
+    assert stats["shared_tokens"] > 0
+    assert stats["used_blocks"] == 0 and stats["reserved_blocks"] == 0
+
+
+def test_release_frees_blocks_and_reservation(tiny_model):
+    model, _ = tiny_model
+    kv_cache = PagedKVCache.for_model(model, num_blocks=8, block_size=4)
+    table = kv_cache.admit(list(range(5, 15)), max_new_tokens=6)
+    assert table is not None
+    assert kv_cache.allocator.available == 8 - 4
+
+    kv_cache.release(table)
+    stats = kv_cache.stats()
+    assert stats["used_blocks"] == 0 and stats["reserved_blocks"] == 0
+    assert kv_cache.allocator.available == 8
+
+
+def test_admit_waits_for_free_blocks(tiny_model):
+    model, _ = tiny_model
+    kv_cache = PagedKVCache.for_model(model, num_blocks=4, block_size=4)
+    first = kv_cache.admit(list(range(5, 13)), max_new_tokens=4)
+    assert first is not None
+    assert kv_cache.admit(list(range(100, 108)), max_new_tokens=4) is None
+    kv_cache.release(first)
+    assert kv_cache.admit(list(range(100, 108)), max_new_tokens=4) is not None
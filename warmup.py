@@ -0,0 +1,88 @@
+"""
+Startup warm-up
+Runs after the model is loaded so the first real request does not pay for
+kernel selection, allocator growth and tokenizer initialization, and so the
+example prompts are answered straight from the response cache.
+"""
+
+import logging
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+import torch
+
+logger = logging.getLogger("deepseek_warmup")
+
+# Prompt lengths (tokens) that get one dummy generation each
+PROMPT_BUCKETS = (32, 128, 512, 2048)
+
+
+def _generate_dummy(model, tokenizer, scheduler, length: int, new_tokens: int):
+    token = tokenizer.eos_token_id if tokenizer.eos_token_id is not None else 0
+    filler = tokenizer(" x", add_special_tokens=False).input_ids or [token]
+    prompt_ids = (filler * length)[:length]
+    if scheduler is not None:
+        scheduler.generate(prompt_ids, max_new_tokens=new_tokens)
+        return
+    with torch.no_grad():
+        model.generate(
+            torch.tensor([prompt_ids], device=model.device),
+            max_new_tokens=new_tokens,
+            do_sample=False,
+            pad_token_id=token,
+        )
+
+
+def warm_up(
+    model,
+    tokenizer,
+    scheduler=None,
+    max_prompt_tokens: int = 2048,
+    examples: Iterable[str] = (),
+    answer_example: Optional[Callable[[str], None]] = None,
+    new_tokens: int = 4,
+) -> Dict[str, float]:
+    """
+    Run the warm-up phases and log how long each took.
+
+    Args:
+        model: Loaded model
+        tokenizer: Matching tokenizer
+        scheduler: BatchScheduler, if the app uses one (warm-up then goes through it)
+        max_prompt_tokens: Largest prompt bucket worth warming
+        examples: Example prompts to precompute
+        answer_example: Generates and caches the answer to one example, through the app's own path
+        new_tokens: Tokens generated per dummy bucket run
+
+    Returns:
+        Seconds per phase
+    """
+    timings: Dict[str, float] = {}
+
+    started = time.perf_counter()
+    tokenizer("Warm up the tokenizer")
+    timings["tokenizer"] = time.perf_counter() - started
+
+    buckets = [b for b in PROMPT_BUCKETS if b <= max_prompt_tokens]
+    for bucket in buckets:
+        started = time.perf_counter()
+        try:
+            _generate_dummy(model, tokenizer, scheduler, bucket, new_tokens)
+        except Exception as e:
+            logger.warning(f"Warm-up for {bucket}-token prompts failed: {e}")
+        timings[f"bucket_{bucket}"] = time.perf_counter() - started
+
+    if answer_example is not None:
+        started = time.perf_counter()
+        count = 0
+        for prompt in examples:
+            try:
+                answer_example(prompt)
+                count += 1
+            except Exception as e:
+                logger.warning(f"Warm-up for example {prompt!r} failed: {e}")
+        timings["examples"] = time.perf_counter() - started
+        logger.info(f"Precomputed {count} example answers")
+
+    logger.info("Warm-up timings: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()))
+    return timings
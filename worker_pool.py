@@ -0,0 +1,397 @@
+"""
+Multi-process CPU worker pool
+Runs N model replicas in separate processes, each pinned to its own cores, behind
+a router that sends each request to the least-loaded worker (sticky per session).
+Weights are memory-mapped from the prepared model (model_cache), so RAM holds them once.
+"""
+
+import argparse
+import logging
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict
+from multiprocessing.connection import Client, Listener
+from typing import Dict, List, Optional
+
+import torch
+
+from device import DeviceConfig, allowed_cores, load_mmap_causal_lm
+from metrics import GENERATED_TOKENS, record_cancelled
+from model_cache import WEIGHTS, prepare
+from scheduler import GenerationHandle, GenerationRequest
+
+logger = logging.getLogger("deepseek_worker_pool")
+
+_DTYPE_NAMES = {torch.float32: "fp32", torch.bfloat16: "bf16", torch.float16: "fp16"}
+
+
+def split_cores(cores: List[int], workers: int) -> List[List[int]]:
+    """Disjoint, contiguous core sets, as even as possible"""
+    cores = sorted(cores)
+    workers = max(1, min(workers, len(cores)))
+    size, extra = divmod(len(cores), workers)
+    sets, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        sets.append(cores[start:end])
+        start = end
+    return sets
+
+
+def load_pool_model(model_path: str, config: DeviceConfig):
+    """
+    Prepare the model once (see model_cache) and load the parent's copy from the same mapped file.
+
+    Returns:
+        (model, prepared_dir) tuple; pass prepared_dir to WorkerPool
+    """
+    model_dir = prepare(model_path, config.dtype)
+    return load_mmap_causal_lm(model_dir, os.path.join(model_dir, WEIGHTS), config), model_dir
+
+
+class _PoolHandle(GenerationHandle):
+    """GenerationHandle whose cancel() also reaches the worker process"""
+
+    def __init__(self, request: GenerationRequest, pool: "WorkerPool", worker: int, request_id: int):
+        super().__init__(request)
+        self._pool = pool
+        self._worker = worker
+        self._request_id = request_id
+
+    def cancel(self, reason: Optional[str] = None):
+        if not self.cancelled and not self.done:
+            self._pool._send(self._worker, ("cancel", self._request_id, reason))
+        super().cancel(reason)
+
+
+class _Worker:
+    def __init__(self, index: int, cores: List[int]):
+        self.index = index
+        self.cores = cores
+        self.process: Optional[subprocess.Popen] = None
+        self.conn = None
+        self.lock = threading.Lock()
+        self.in_flight: Dict[int, _PoolHandle] = {}
+        self.routed = 0
+        self.alive = False
+
+
+class WorkerPool:
+    """
+    Router over N worker processes; a drop-in for BatchScheduler (submit/generate/stats/close).
+
+    Args:
+        model_path: Prepared model directory (config, tokenizer and model.safetensors)
+        config: DeviceConfig of the replicas (threads are set per worker from its core set)
+        num_workers: Number of replicas
+        max_batch_size: Batch size of each worker's scheduler
+        prefix_cache_mb: Prefix KV cache per worker (0 disables)
+        prefill_chunk: Prompt tokens each worker prefills between decode steps (0: whole prompts)
+        cores: Cores to split between workers (default: all available)
+        max_sessions: Session-to-worker assignments remembered for affinity
+        adapter_dir: LoRA adapters each worker may load on request (see adapters.AdapterCache)
+        max_adapters: Adapters each worker keeps loaded
+        kv_blocks: Paged KV-cache blocks per worker (0: contiguous caches; see paged_kv.PagedKVCache).
+            Replaces the worker's prefix cache
+        kv_block_size: Tokens per KV-cache block
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        config: DeviceConfig,
+        num_workers: int,
+        max_batch_size: int = 8,
+        prefix_cache_mb: int = 0,
+        prefill_chunk: int = 0,
+        cores: Optional[List[int]] = None,
+        max_sessions: int = 4096,
+        adapter_dir: Optional[str] = None,
+        max_adapters: int = 8,
+        kv_blocks: int = 0,
+        kv_block_size: int = 16,
+    ):
+        self.model_path = model_path
+        self.config = config
+        self.max_batch_size = max_batch_size
+        self.prefix_cache_mb = prefix_cache_mb
+        self.prefill_chunk = prefill_chunk
+        self.max_sessions = max_sessions
+        self.adapter_dir = adapter_dir
+        self.max_adapters = max_adapters
+        self.kv_blocks = kv_blocks
+        self.kv_block_size = kv_block_size
+        cores = cores if cores is not None else allowed_cores()
+        self._workers = [_Worker(i, core_set) for i, core_set in enumerate(split_cores(cores, num_workers))]
+        self._affinity: "OrderedDict[object, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._closed = False
+
+    def start(self, timeout: float = 600.0) -> "WorkerPool":
+        """Spawn the workers and wait until each has loaded its replica"""
+        authkey = secrets.token_bytes(16)
+        listener = Listener(("127.0.0.1", 0), authkey=authkey)
+        host, port = listener.address
+        env = dict(os.environ, R2D2_POOL_AUTHKEY=authkey.hex())
+        for worker in self._workers:
+            command = [
+                sys.executable, "-m", "worker_pool",
+                "--address", f"{host}:{port}",
+                "--index", str(worker.index),
+                "--cores", ",".join(map(str, worker.cores)),
+                "--model-path", self.model_path,
+                "--dtype", _DTYPE_NAMES[self.config.dtype],
+                "--max-batch-size", str(self.max_batch_size),
+                "--prefix-cache-mb", str(self.prefix_cache_mb),
+                "--prefill-chunk", str(self.prefill_chunk),
+                "--kv-blocks", str(self.kv_blocks),
+                "--kv-block-size", str(self.kv_block_size),
+            ]
+            if self.config.quantize_int8:
+                command.append("--int8")
+            if self.adapter_dir:
+                command += ["--adapter-dir", self.adapter_dir, "--max-adapters", str(self.max_adapters)]
+            worker.process = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+        started = time.monotonic()
+        pending = {w.index for w in self._workers}
+        # accept() blocks, so a watchdog closes the listener if a worker never connects
+        watchdog = threading.Timer(timeout, listener.close)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            while pending:
+                conn = listener.accept()
+                kind, index = conn.recv()
+                worker = self._workers[index]
+                worker.conn = conn
+                worker.alive = kind == "ready"
+                pending.discard(index)
+                if worker.alive:
+                    threading.Thread(target=self._read, args=(worker,), name=f"pool-reader-{index}", daemon=True).start()
+                    logger.info(f"Worker {index} ready on cores {worker.cores}")
+                else:
+                    logger.error(f"Worker {index} failed to load its model")
+        except OSError:
+            logger.error(f"Workers {sorted(pending)} did not start within {timeout:.0f}s")
+        finally:
+            watchdog.cancel()
+            listener.close()
+        if not any(w.alive for w in self._workers):
+            self.close()
+            raise RuntimeError("No pool worker started")
+        logger.info(f"Worker pool up: {sum(w.alive for w in self._workers)} replicas in {time.monotonic() - started:.1f}s")
+        return self
+
+    def submit(self, input_ids: List[int], **params) -> GenerationHandle:
+        """Route a prompt to a worker; returns immediately"""
+        if self._closed:
+            raise RuntimeError("Worker pool is closed")
+        request = GenerationRequest(input_ids=list(input_ids), **params)
+        with self._lock:
+            worker = self._pick(request.session_id)
+            request_id = self._next_id
+            self._next_id += 1
+            handle = _PoolHandle(request, self, worker.index, request_id)
+            worker.in_flight[request_id] = handle
+            worker.routed += 1
+        if not self._send(worker.index, ("submit", request_id, asdict(request))):
+            with self._lock:
+                worker.in_flight.pop(request_id, None)
+            handle._finish(RuntimeError(f"Worker {worker.index} is not available"))
+        return handle
+
+    def generate(self, input_ids: List[int], **params) -> List[int]:
+        return self.submit(input_ids, **params).result()
+
+    def release(self, session_id):
+        """Forget a session's worker and free the prefix KV it holds there"""
+        with self._lock:
+            index = self._affinity.pop(session_id, None)
+        if index is not None:
+            self._send(index, ("release", session_id))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": [
+                    {"cores": w.cores, "alive": w.alive, "in_flight": len(w.in_flight), "routed": w.routed}
+                    for w in self._workers
+                ],
+                "sessions": len(self._affinity),
+            }
+
+    def close(self):
+        self._closed = True
+        for worker in self._workers:
+            self._send(worker.index, ("stop",))
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            try:
+                worker.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+
+    # Router internals
+    def _pick(self, session_id) -> _Worker:
+        """Session's previous worker while it has room, else the least-loaded live worker (caller holds the lock)"""
+        live = [w for w in self._workers if w.alive]
+        if not live:
+            raise RuntimeError("No live pool workers")
+        if session_id is not None and session_id in self._affinity:
+            worker = self._workers[self._affinity[session_id]]
+            if worker.alive and len(worker.in_flight) < self.max_batch_size:
+                self._affinity.move_to_end(session_id)
+                return worker
+        worker = min(live, key=lambda w: (len(w.in_flight), w.routed))
+        if session_id is not None:
+            self._affinity[session_id] = worker.index
+            self._affinity.move_to_end(session_id)
+            while len(self._affinity) > self.max_sessions:
+                self._affinity.popitem(last=False)
+        return worker
+
+    def _send(self, index: int, message) -> bool:
+        worker = self._workers[index]
+        if worker.conn is None or not worker.alive:
+            return False
+        try:
+            with worker.lock:
+                worker.conn.send(message)
+            return True
+        except (OSError, EOFError):
+            return False
+
+    def _read(self, worker: _Worker):
+        """Deliver one worker's tokens and completions to the waiting handles"""
+        try:
+            while True:
+                kind, request_id, payload = worker.conn.recv()
+                handle = worker.in_flight.get(request_id)
+                if handle is None:
+                    continue
+                if kind == "tokens":
+                    GENERATED_TOKENS.inc(len(payload))
+                    for token in payload:
+                        handle._emit(token)
+                elif kind == "done":
+                    with self._lock:
+                        worker.in_flight.pop(request_id, None)
+                    if handle.cancel_reason is not None:
+                        # The worker's own counters are not scraped; count the reclaimed work here
+                        request = handle.request
+                        prefill_tokens = len(request.input_ids) if handle.first_token_at is None else 0
+                        record_cancelled(prefill_tokens, max(0, request.max_new_tokens - len(handle.output_ids)))
+                    handle._finish(RuntimeError(payload) if payload else None)
+        except (OSError, EOFError):
+            pass
+        worker.alive = False
+        if not self._closed:
+            logger.error(f"Worker {worker.index} exited; failing its {len(worker.in_flight)} requests")
+        with self._lock:
+            failed, worker.in_flight = worker.in_flight, {}
+        for handle in failed.values():
+            handle._finish(RuntimeError(f"Worker {worker.index} exited"))
+
+
+# Worker process side
+def _forward(conn, lock: threading.Lock, request_id: int, handle: GenerationHandle, handles: dict):
+    try:
+        for token in handle:
+            with lock:
+                conn.send(("tokens", request_id, [token]))
+        error = None
+    except Exception as e:
+        error = str(e)
+    handles.pop(request_id, None)
+    with lock:
+        conn.send(("done", request_id, error))
+
+
+def worker_main(args):
+    from transformers import AutoTokenizer
+
+    from adapters import AdapterCache, list_adapters
+    from paged_kv import PagedKVCache
+    from prefix_cache import PrefixCache
+    from scheduler import BatchScheduler
+
+    cores = [int(c) for c in args.cores.split(",")]
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    dtype = {"fp32": torch.float32, "bf16": torch.bfloat16, "fp16": torch.float16}[args.dtype]
+    config = DeviceConfig(device="cpu", dtype=dtype, quantize_int8=args.int8, threads=len(cores))
+    host, port = args.address.rsplit(":", 1)
+    conn = Client((host, int(port)), authkey=bytes.fromhex(os.environ["R2D2_POOL_AUTHKEY"]))
+    try:
+        torch.set_num_interop_threads(1)
+        tokenizer = AutoTokenizer.from_pretrained(args.model_path, trust_remote_code=True)
+        model = load_mmap_causal_lm(args.model_path, os.path.join(args.model_path, WEIGHTS), config)
+        kv_cache = PagedKVCache.for_model(model, args.kv_blocks, args.kv_block_size) if args.kv_blocks > 0 else None
+        prefix_cache = None
+        if args.prefix_cache_mb > 0 and kv_cache is None:
+            prefix_cache = PrefixCache(max_bytes=args.prefix_cache_mb * 1024 * 1024)
+        adapters = None
+        if list_adapters(args.adapter_dir) and not args.int8:
+            adapters = AdapterCache(model, args.adapter_dir, max_loaded=args.max_adapters)
+        scheduler = BatchScheduler(
+            model, tokenizer, max_batch_size=args.max_batch_size, prefix_cache=prefix_cache, adapters=adapters,
+            prefill_chunk=args.prefill_chunk, kv_cache=kv_cache,
+        )
+    except Exception as e:
+        logger.error(f"Worker {args.index} failed to load: {e}", exc_info=True)
+        conn.send(("failed", args.index))
+        return
+    conn.send(("ready", args.index))
+
+    lock = threading.Lock()
+    handles: Dict[int, GenerationHandle] = {}
+    try:
+        while True:
+            message = conn.recv()
+            if message[0] == "submit":
+                _, request_id, request = message
+                handle = scheduler.submit(request.pop("input_ids"), **request)
+                handles[request_id] = handle
+                threading.Thread(
+                    target=_forward, args=(conn, lock, request_id, handle, handles), daemon=True
+                ).start()
+            elif message[0] == "cancel":
+                handle = handles.get(message[1])
+                if handle is not None:
+                    handle.cancel(message[2])
+            elif message[0] == "release":
+                if prefix_cache is not None:
+                    prefix_cache.drop(message[1])
+            elif message[0] == "stop":
+                break
+    except (EOFError, OSError):
+        pass
+    finally:
+        scheduler.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    parser = argparse.ArgumentParser(description="Model worker process (started by WorkerPool)")
+    parser.add_argument("--address", required=True)
+    parser.add_argument("--index", type=int, required=True)
+    parser.add_argument("--cores", required=True)
+    parser.add_argument("--model-path", required=True)
+    parser.add_argument("--dtype", default="fp32")
+    parser.add_argument("--int8", action="store_true")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--prefix-cache-mb", type=int, default=0)
+    parser.add_argument("--prefill-chunk", type=int, default=0)
+    parser.add_argument("--kv-blocks", type=int, default=0)
+    parser.add_argument("--kv-block-size", type=int, default=16)
+    parser.add_argument("--adapter-dir", default=None)
+    parser.add_argument("--max-adapters", type=int, default=8)
+    worker_main(parser.parse_args())
@@ -0,0 +1,158 @@
+"""
+Workload recorder
+Opt-in, append-only JSONL log of what the apps actually serve: prompt hash,
+history length, parameters, token counts and timings per request. Records are
+handed to a writer thread through a bounded queue, so the request path never
+waits on disk; benchmarks/replay.py turns a log back into load.
+"""
+
+import hashlib
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger("deepseek_workload")
+
+# Parameters worth replaying; anything else in generation_params is left out
+_PARAMS = ("max_new_tokens", "temperature", "top_p", "repetition_penalty", "do_sample")
+
+
+def prompt_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", "replace")).hexdigest()[:16]
+
+
+class RequestRecord:
+    """Timings and counts of one request; fill it in along the way, then call finish()"""
+
+    def __init__(self, recorder: Optional["WorkloadRecorder"], fields: dict):
+        self.recorder = recorder
+        self.fields = fields
+        self.started = time.perf_counter()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._admitted: Optional[float] = None
+        self._first_token: Optional[float] = None
+        self._finished = False
+
+    def admitted(self):
+        if self._admitted is None:
+            self._admitted = time.perf_counter()
+
+    def first_token(self, at: Optional[float] = None):
+        """Mark the first generated token now, or at a perf_counter() value"""
+        if self._first_token is None:
+            self._first_token = at or time.perf_counter()
+
+    def finish(self, status: str = "ok", cached: bool = False, coalesced: bool = False):
+        if self.recorder is None or self._finished:
+            return
+        self._finished = True
+        now = time.perf_counter()
+        fields = dict(
+            self.fields,
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens,
+            status=status,
+            latency=round(now - self.started, 5),
+        )
+        if cached:
+            fields["cached"] = True
+        if coalesced:
+            fields["coalesced"] = True
+        if self._admitted is not None:
+            fields["queue_wait"] = round(self._admitted - self.started, 5)
+        if self._first_token is not None:
+            fields["ttft"] = round(self._first_token - self.started, 5)
+        self.recorder._submit(fields)
+
+
+class WorkloadRecorder:
+    """
+    Writes one compact JSON line per finished request.
+
+    Args:
+        path: Log file, appended to
+        max_pending: Records buffered for the writer; beyond that they are dropped (and counted)
+        flush_interval: Seconds between file flushes
+    """
+
+    def __init__(self, path: Optional[str], max_pending: int = 10000, flush_interval: float = 1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.written = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._thread: Optional[threading.Thread] = None
+        if path:
+            self._thread = threading.Thread(target=self._write_loop, name="workload-recorder", daemon=True)
+            self._thread.start()
+            logger.info(f"Recording workload to {path}")
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+    def request(
+        self,
+        app: str,
+        prompt: str,
+        history_turns: int = 0,
+        params: Optional[Dict] = None,
+        session_id: Optional[str] = None,
+        **extra,
+    ) -> RequestRecord:
+        """Start a record at the request's arrival; a no-op record when recording is off"""
+        if not self.enabled:
+            return RequestRecord(None, {})
+        fields = {"t": round(time.time(), 4), "app": app, "prompt": prompt_hash(prompt), "history": history_turns}
+        fields["params"] = {k: v for k, v in (params or {}).items() if k in _PARAMS}
+        if session_id is not None:
+            fields["session"] = prompt_hash(str(session_id))[:8]
+        fields.update({k: v for k, v in extra.items() if v is not None})
+        return RequestRecord(self, fields)
+
+    def close(self, timeout: float = 5.0):
+        """Flush and stop the writer, waiting at most `timeout` seconds in total"""
+        if self._thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning(f"Workload writer is stalled; closing without its last {self._queue.qsize()} records")
+        else:
+            self._thread.join(max(0.0, deadline - time.monotonic()))
+        self._thread = None
+
+    def _submit(self, fields: dict):
+        try:
+            self._queue.put_nowait(fields)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"Workload recorder is behind; {self.dropped} records dropped")
+
+    def _write_loop(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            last_flush = time.monotonic()
+            while True:
+                try:
+                    fields = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    f.flush()
+                    continue
+                if fields is None:
+                    break
+                f.write(json.dumps(fields, separators=(",", ":")) + "\n")
+                self.written += 1
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    f.flush()
+                    last_flush = time.monotonic()
+
+
+def recorder_from_env(environ: Dict[str, str]) -> WorkloadRecorder:
+    """R2D2_RECORD_WORKLOAD=<path> turns recording on; otherwise every record is a no-op"""
+    return WorkloadRecorder(environ.get("R2D2_RECORD_WORKLOAD") or None)